@@ -1,22 +1,43 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, Response, render_template, request, redirect, url_for, session, flash, abort
 from datetime import datetime, date, timedelta
-from config import db, SQLALCHEMY_DATABASE_URI, SQLALCHEMY_TRACK_MODIFICATIONS
+from config import db, SQLALCHEMY_DATABASE_URI, SQLALCHEMY_TRACK_MODIFICATIONS, EDGE_CHECKIN, REPORTING_DATABASE_URL, METRICS_TOKEN, engine_options
+from config import ATTENDANCE_IMAGE_RETENTION_MONTHS, FACE_INDEX_PATH
 from routes.employee_routes import employee_bp
 from routes.payroll_routes import payroll_bp
 from models.employee import Employee
 from models.department import Department
 from models.attendance import Attendance
-from sqlalchemy import func, and_
-from models.payroll import calculate_salary
+from sqlalchemy.exc import IntegrityError
+from models.payroll import get_monthly_totals, close_payroll
+from models.dashboard_stats import get_dashboard_stats
+from models.payroll_summary import reconcile_payroll_summary
+from models.employee_import import read_import_file, import_employees, report_to_csv, ImportFileError, EMPLOYEE_IMAGE_DIR
+from models.face_encoding import reencode_face_encodings
+from camera.image_store import compact_attendance_images
+from models.checkin_journal import checkin_journal, checkin_syncer
+from models.reporting import REPORTING_BIND, reporting_view
+from models.metrics import init_metrics, render_metrics, PROMETHEUS_CONTENT_TYPE
 from functools import wraps
+import click
+import hmac
+import os
 
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-very-secret-key-2025'  
 app.config['SQLALCHEMY_DATABASE_URI'] = SQLALCHEMY_DATABASE_URI
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = SQLALCHEMY_TRACK_MODIFICATIONS
+# Pool kết nối và tinh chỉnh driver theo cấu hình (xem config.py, ghi đè bằng HRMS_* / HRMS_CONFIG_FILE)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(SQLALCHEMY_DATABASE_URI)
+# Báo cáo/xuất file đọc từ bản sao nếu có cấu hình (xem models/reporting.py)
+if REPORTING_DATABASE_URL:
+    app.config['SQLALCHEMY_BINDS'] = {
+        REPORTING_BIND: dict(engine_options(REPORTING_DATABASE_URL), url=REPORTING_DATABASE_URL)
+    }
 
 db.init_app(app)
+# Thời gian request, số truy vấn/thời gian CSDL, cảnh báo N+1 (xem models/metrics.py)
+init_metrics(app)
 
 app.register_blueprint(employee_bp, url_prefix='/employee')
 app.register_blueprint(payroll_bp)
@@ -26,6 +47,28 @@ app.register_blueprint(payroll_bp)
 def inject_datetime():
     return {'datetime': datetime}
 
+@app.before_request
+def start_checkin_syncer():
+    # Chế độ edge: luồng đồng bộ chạy từ request đầu tiên, phát lại các sự kiện còn tồn trong nhật ký
+    if EDGE_CHECKIN:
+        checkin_syncer.ensure_running(app)
+
+def _metrics_allowed():
+    """Quản trị viên đã đăng nhập, Prometheus có token, hoặc (khi chưa cấu hình token) truy cập từ chính máy chủ"""
+    if session.get('is_admin'):
+        return True
+    if METRICS_TOKEN:
+        return hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}')
+    # Request qua reverse proxy có remote_addr là proxy: không coi là truy cập cục bộ
+    return request.remote_addr in ('127.0.0.1', '::1') and 'X-Forwarded-For' not in request.headers
+
+@app.route('/metrics')
+def metrics():
+    """Số liệu hiệu năng của tiến trình này theo định dạng text của Prometheus"""
+    if not _metrics_allowed():
+        abort(401 if METRICS_TOKEN else 403)
+    return Response(render_metrics(), content_type=PROMETHEUS_CONTENT_TYPE)
+
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -37,26 +80,7 @@ def admin_required(f):
 @app.route('/')
 @admin_required
 def index():
-    # Lấy tổng số nhân viên
-    total_employees = Employee.query.count()
-    
-    # Lấy số nhân viên đi làm hôm nay
     today = date.today()
-    today_start = datetime.combine(today, datetime.min.time())
-    today_end = datetime.combine(today, datetime.max.time())
-    
-    present_today = db.session.query(func.count(func.distinct(Attendance.employee_id))).filter(
-        Attendance.timestamp.between(today_start, today_end),
-        Attendance.status == 'IN'
-    ).scalar()
-
-    # Tính tỷ lệ đi làm
-    attendance_rate = round((present_today / total_employees * 100) if total_employees > 0 else 0)
-
-    # Lấy số phòng ban và số phòng ban có nhân viên
-    total_departments = Department.query.count()
-    active_departments = db.session.query(func.count(func.distinct(Employee.department_id))).scalar()
-
     # Lấy tháng/năm từ bộ lọc nếu có
     month_str = request.args.get('month', '')
     if month_str:
@@ -68,7 +92,8 @@ def index():
     else:
         current_month = today.month
         current_year = today.year
-    total_salary = calculate_salary(current_month, current_year)
+    # Số nhân viên, đi làm hôm nay, phòng ban và tổng lương tháng (đọc từ bộ nhớ đệm)
+    stats = get_dashboard_stats(current_month, current_year, today)
     
     # Lấy 5 nhân viên mới nhất và lương thực nhận tháng hiện tại
     recent_employees_raw = Employee.query.order_by(Employee.id.desc()).limit(5).all()
@@ -97,12 +122,12 @@ def index():
         })
 
     return render_template('index.html',
-        total_employees=total_employees,
-        present_today=present_today,
-        attendance_rate=attendance_rate,
-        total_departments=total_departments,
-        active_departments=active_departments,
-        total_salary=total_salary,
+        total_employees=stats['total_employees'],
+        present_today=stats['present_today'],
+        attendance_rate=stats['attendance_rate'],
+        total_departments=stats['total_departments'],
+        active_departments=stats['active_departments'],
+        total_salary=stats['total_salary'],
         current_month=current_month,
         current_year=current_year,
         recent_employees=recent_employees,
@@ -138,6 +163,7 @@ def settings():
 # Báo cáo tổng lương thực nhận từng tháng
 @app.route('/salary/report')
 @admin_required
+@reporting_view
 def salary_report():
     # Lấy danh sách 12 tháng gần nhất
     now = datetime.now()
@@ -147,10 +173,11 @@ def salary_report():
         y = now.year - ((now.month - i - 1) // 12)
         months.append((y, m))
     months = months[::-1]
+    # Các tháng đã chốt đọc từ snapshot, chỉ tháng hiện tại tính lại
+    totals = get_monthly_totals(months)
     salary_data = []
     for y, m in months:
-        total = calculate_salary(m, y)
-        salary_data.append({'year': y, 'month': m, 'total': total})
+        salary_data.append({'year': y, 'month': m, 'label': '%02d/%d' % (m, y), 'total': totals[(y, m)]})
     return render_template('salary_report.html', salary_data=salary_data)
 
 @app.route('/change-password', methods=['POST'])
@@ -176,6 +203,298 @@ def change_password():
     flash('Đổi mật khẩu thành công! (Hiện tại vẫn dùng mật khẩu cũ để đăng nhập)', 'success')
     return redirect(url_for('settings'))
 
+@app.cli.command('close-payroll')
+@click.option('--month', type=int, help='Tháng cần chốt (mặc định: tháng trước)')
+@click.option('--year', type=int, help='Năm cần chốt')
+def close_payroll_command(month, year):
+    """Chốt lương tháng vào bảng PAYROLLS"""
+    if not month or not year:
+        last_month = date.today().replace(day=1) - timedelta(days=1)
+        month = month or last_month.month
+        year = year or last_month.year
+    try:
+        count = close_payroll(month, year)
+    except IntegrityError:
+        print(f"Tháng {month}/{year} đang được chốt ở tiến trình khác, hãy chạy lại sau")
+        return
+    print(f"Đã chốt lương tháng {month}/{year} cho {count} nhân viên")
+
+@app.cli.command('reconcile-payroll')
+@click.option('--month', type=int, help='Tháng cần đối soát (mặc định: tháng hiện tại)')
+@click.option('--year', type=int, help='Năm cần đối soát')
+@click.option('--fix', is_flag=True, help='Tính lại các dòng bị lệch từ ATTENDANCE')
+def reconcile_payroll_command(month, year, fix):
+    """Đối soát bảng tổng hợp lương PAYROLL_SUMMARY với dữ liệu chấm công gốc"""
+    today = date.today()
+    month = month or today.month
+    year = year or today.year
+    drift = reconcile_payroll_summary(month, year, fix=fix)
+    for row in drift:
+        print(f"NV {row['employee_id']}: {row['field']} lưu {row['stored']} / thực tế {row['actual']}")
+    if not drift:
+        print(f"Tháng {month}/{year}: bảng tổng hợp khớp với chấm công")
+    elif fix:
+        print(f"Đã tính lại {len({row['employee_id'] for row in drift})} nhân viên bị lệch")
+
+@app.cli.command('compact-attendance-images')
+@click.option('--months', type=int, help='Giữ lại ảnh của số tháng gần nhất (mặc định: ATTENDANCE_IMAGE_RETENTION_MONTHS)')
+def compact_attendance_images_command(months):
+    """Gom ảnh chấm công cũ vào file nén theo tháng trong static/attendance_archive"""
+    months = months or ATTENDANCE_IMAGE_RETENTION_MONTHS
+    first = date.today().replace(day=1)
+    total = first.year * 12 + first.month - 1 - months
+    cutoff = datetime(total // 12, total % 12 + 1, 1)
+    count = compact_attendance_images(cutoff)
+    print(f"Đã lưu trữ ảnh của {count} bản ghi chấm công trước {cutoff.strftime('%m/%Y')}")
+
+@app.cli.command('reencode-faces')
+@click.option('--images', 'image_dir', default=EMPLOYEE_IMAGE_DIR, show_default=True, help='Thư mục ảnh đăng ký')
+@click.option('--max-distance', type=float, default=0.3, show_default=True,
+              help='Khoảng cách tối đa để coi ảnh là nguồn của encoding đã lưu')
+@click.option('--dry-run', is_flag=True, help='Chỉ đối chiếu, không ghi database')
+def reencode_faces_command(image_dir, max_distance, dry_run):
+    """Chuyển encoding khuôn mặt cũ (tính trên ảnh BGR) sang RGB từ ảnh đăng ký đã lưu"""
+    from camera.face_index import face_index
+    result = reencode_face_encodings(image_dir, max_distance=max_distance, dry_run=dry_run)
+    for name in result['unmatched_images']:
+        print(f"Bỏ qua ảnh {name}: không khớp encoding nào")
+    if result['unmatched_employees']:
+        print(f"Nhân viên cần đăng ký lại khuôn mặt: {', '.join(map(str, result['unmatched_employees']))}")
+    action = 'Sẽ' if dry_run else 'Đã'
+    print(f"{action} mã hóa lại {result['updated']} encoding đăng ký, xóa {result['deleted']} encoding chấm công")
+    if dry_run:
+        return
+    # File chỉ mục chỉ đối chiếu theo id: xóa để lần khởi động sau nạp lại vector mới
+    if FACE_INDEX_PATH and os.path.exists(FACE_INDEX_PATH):
+        os.remove(FACE_INDEX_PATH)
+    face_index.invalidate()
+    print("Đặt FACE_ENCODING_CHANNELS = 'rgb' (hoặc HRMS_FACE_ENCODING_CHANNELS=rgb) rồi khởi động lại ứng dụng")
+
+@app.cli.command('import-employees')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--workers', type=int, help='Số tiến trình mã hóa khuôn mặt (mặc định: IMPORT_WORKERS)')
+@click.option('--batch-size', type=int, help='Số dòng mỗi lượt ghi DB (mặc định: IMPORT_BATCH_SIZE)')
+@click.option('--report', 'report_path', type=click.Path(dir_okay=False), help='Ghi báo cáo từng dòng ra file CSV')
+def import_employees_command(path, workers, batch_size, report_path):
+    """Nhập nhân viên hàng loạt từ file CSV (ảnh theo đường dẫn tương đối) hoặc ZIP"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        rows, read_photo = read_import_file(path, data, base_dir=os.path.dirname(os.path.abspath(path)))
+    except ImportFileError as e:
+        raise click.ClickException(str(e))
+    started = datetime.now()
+    report = import_employees(rows, read_photo, workers=workers, batch_size=batch_size)
+    created = sum(1 for entry in report if entry['status'] == 'created')
+    for entry in report:
+        if entry['status'] != 'created':
+            print(f"Dòng {entry['row']} ({entry['employee_code'] or entry['full_name']}): {entry['message']}")
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8', newline='') as f:
+            f.write(report_to_csv(report))
+    elapsed = (datetime.now() - started).total_seconds()
+    print(f"Đã nhập {created}/{len(report)} nhân viên trong {elapsed:.1f} giây")
+
+@app.cli.command('sync-checkins')
+def sync_checkins_command():
+    """Đồng bộ ngay các sự kiện chấm công còn trong nhật ký edge vào ATTENDANCE"""
+    total = 0
+    while True:
+        count = checkin_syncer.sync_once()
+        if not count:
+            break
+        total += count
+    print(f"Đã đồng bộ {total} sự kiện chấm công, còn {checkin_journal.backlog()} sự kiện chờ")
+
+def ensure_indexes():
+    """Tạo các chỉ mục khai báo trong model nếu chưa có
+
+    ``db.create_all`` không tạo chỉ mục cho bảng đã tồn tại, nên CSDL cũ cần bước này.
+    """
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {ix['name'].lower() for ix in inspector.get_indexes(table.name) if ix.get('name')}
+        for index in table.indexes:
+            if index.name.lower() in existing:
+                continue
+            try:
+                index.create(bind=db.engine)
+                print(f"Đã tạo chỉ mục {index.name} cho bảng {table.name}")
+            except Exception as e:
+                print(f"Lỗi khi tạo chỉ mục {index.name}: {str(e)}")
+
+def update_face_encoding_table():
+    """Bổ sung cột ``source`` (ảnh đăng ký / ảnh chấm công) cho bảng FACE_ENCODINGS"""
+    try:
+        if not db.inspect(db.engine).has_table("FACE_ENCODINGS"):
+            return
+        columns = [col['name'].lower() for col in db.inspect(db.engine).get_columns('FACE_ENCODINGS')]
+        if 'source' not in columns:
+            db.session.execute(db.text("ALTER TABLE FACE_ENCODINGS ADD source VARCHAR(20)"))
+            db.session.commit()
+            print("Đã thêm cột source cho bảng FACE_ENCODINGS!")
+    except Exception as e:
+        print(f"Lỗi khi cập nhật bảng FACE_ENCODINGS: {str(e)}")
+        db.session.rollback()
+
+def update_department_table():
+    """Gộp các phòng ban trùng tên và tạo ràng buộc duy nhất UQ_DEPARTMENTS_NAME"""
+    try:
+        inspector = db.inspect(db.engine)
+        if not inspector.has_table("DEPARTMENTS"):
+            return
+        existing = {uc['name'].lower() for uc in inspector.get_unique_constraints('DEPARTMENTS') if uc.get('name')}
+        existing |= {ix['name'].lower() for ix in inspector.get_indexes('DEPARTMENTS') if ix.get('name') and ix.get('unique')}
+        if 'uq_departments_name' in existing:
+            return
+        # Nhân viên của phòng ban trùng tên chuyển về phòng ban có id nhỏ nhất
+        keep = dict(db.session.query(Department.name, db.func.min(Department.id)).group_by(Department.name).all())
+        duplicates = [
+            {'old_id': dept_id, 'new_id': keep[name]}
+            for dept_id, name in db.session.query(Department.id, Department.name).all()
+            if keep[name] != dept_id
+        ]
+        if duplicates:
+            db.session.execute(db.text("UPDATE EMPLOYEES SET department_id = :new_id WHERE department_id = :old_id"), duplicates)
+            db.session.execute(db.text("DELETE FROM DEPARTMENTS WHERE id = :old_id"), [{'old_id': d['old_id']} for d in duplicates])
+            print(f"Đã gộp {len(duplicates)} phòng ban trùng tên")
+        db.session.execute(db.text("CREATE UNIQUE INDEX UQ_DEPARTMENTS_NAME ON DEPARTMENTS (name)"))
+        db.session.commit()
+        print("Đã tạo ràng buộc duy nhất cho tên phòng ban!")
+    except Exception as e:
+        print(f"Lỗi khi cập nhật bảng DEPARTMENTS: {str(e)}")
+        db.session.rollback()
+
+def update_employee_table():
+    """Bổ sung cột ``search_name`` (tên không dấu) cho bảng EMPLOYEES và điền dữ liệu cũ"""
+    from models.employee import normalize_name
+    try:
+        if not db.inspect(db.engine).has_table("EMPLOYEES"):
+            return
+        columns = [col['name'].lower() for col in db.inspect(db.engine).get_columns('EMPLOYEES')]
+        if 'search_name' not in columns:
+            db.session.execute(db.text("ALTER TABLE EMPLOYEES ADD search_name VARCHAR(200)"))
+            db.session.commit()
+            print("Đã thêm cột search_name cho bảng EMPLOYEES!")
+        rows = db.session.query(Employee.id, Employee.full_name).filter(Employee.search_name.is_(None)).all()
+        if rows:
+            db.session.execute(
+                db.text("UPDATE EMPLOYEES SET search_name = :search_name WHERE id = :id"),
+                [{'id': emp_id, 'search_name': normalize_name(name)} for emp_id, name in rows]
+            )
+            db.session.commit()
+            print(f"Đã điền search_name cho {len(rows)} nhân viên")
+    except Exception as e:
+        print(f"Lỗi khi cập nhật bảng EMPLOYEES: {str(e)}")
+        db.session.rollback()
+
+def update_attendance_day_slots():
+    """Bổ sung cột ``work_date``/``seq``/``event_key`` cho bảng ATTENDANCE, điền dữ liệu cũ và tạo UQ_ATTENDANCE_EMP_DAY_SEQ
+
+    Bản ghi cũ nhận lượt 1 (IN) / 2 (OUT); các bản ghi trùng loại trong cùng ngày (chấm công
+    đồng thời trước đây) nhận lượt 3, 4, ... để ràng buộc duy nhất vẫn tạo được. Sau khi điền,
+    hai cột được đặt NOT NULL (Oracle bỏ qua dòng có cột NULL khi kiểm tra ràng buộc duy nhất);
+    bản ghi không có ``timestamp`` không điền được nên phải xử lý tay trước.
+    """
+    from models.attendance import SEQ_BY_STATUS
+    try:
+        inspector = db.inspect(db.engine)
+        if not inspector.has_table("ATTENDANCE"):
+            return
+        columns = [col['name'].lower() for col in inspector.get_columns('ATTENDANCE')]
+        if 'work_date' not in columns:
+            db.session.execute(db.text("ALTER TABLE ATTENDANCE ADD work_date DATE"))
+            db.session.execute(db.text("ALTER TABLE ATTENDANCE ADD seq INTEGER"))
+            db.session.commit()
+            print("Đã thêm cột work_date, seq cho bảng ATTENDANCE!")
+        if 'event_key' not in columns:
+            db.session.execute(db.text("ALTER TABLE ATTENDANCE ADD event_key VARCHAR(64)"))
+            db.session.execute(db.text("CREATE UNIQUE INDEX UQ_ATTENDANCE_EVENT_KEY ON ATTENDANCE (event_key)"))
+            db.session.commit()
+            print("Đã thêm cột event_key (chống ghi trùng sự kiện edge) cho bảng ATTENDANCE!")
+        if db.session.query(Attendance.id).filter(Attendance.seq.is_(None)).first():
+            rows = db.session.query(
+                Attendance.id, Attendance.employee_id, Attendance.timestamp, Attendance.status, Attendance.seq
+            ).filter(Attendance.timestamp.isnot(None)).order_by(
+                Attendance.employee_id, Attendance.timestamp, Attendance.id
+            ).yield_per(5000)
+            updates = []
+            group, taken = None, set()
+            for att_id, employee_id, timestamp, status, seq in rows:
+                if (employee_id, timestamp.date()) != group:
+                    group, taken = (employee_id, timestamp.date()), set()
+                if seq is None:
+                    seq = SEQ_BY_STATUS.get(status)
+                    if seq is None or seq in taken:
+                        seq = max(taken | {len(SEQ_BY_STATUS)}) + 1
+                    updates.append({'id': att_id, 'work_date': timestamp.date(), 'seq': seq})
+                taken.add(seq)
+            for start in range(0, len(updates), 5000):
+                db.session.execute(
+                    db.text("UPDATE ATTENDANCE SET work_date = :work_date, seq = :seq WHERE id = :id"),
+                    updates[start:start + 5000]
+                )
+            db.session.commit()
+            print(f"Đã điền work_date, seq cho {len(updates)} bản ghi chấm công")
+        existing = {ix['name'].lower() for ix in inspector.get_indexes('ATTENDANCE') if ix.get('name') and ix.get('unique')}
+        existing |= {uc['name'].lower() for uc in inspector.get_unique_constraints('ATTENDANCE') if uc.get('name')}
+        if 'uq_attendance_emp_day_seq' not in existing:
+            db.session.execute(db.text("CREATE UNIQUE INDEX UQ_ATTENDANCE_EMP_DAY_SEQ ON ATTENDANCE (employee_id, work_date, seq)"))
+            db.session.commit()
+            print("Đã tạo ràng buộc duy nhất (nhân viên, ngày, lượt) cho bảng ATTENDANCE!")
+        nullable = [col['name'] for col in inspector.get_columns('ATTENDANCE')
+                    if col['name'].lower() in ('work_date', 'seq') and col['nullable']]
+        # Cú pháp MODIFY của Oracle; SQLite (chạy thử) không đổi được ràng buộc cột
+        if nullable and db.engine.dialect.name == 'oracle':
+            missing = db.session.query(Attendance.id).filter(
+                db.or_(Attendance.work_date.is_(None), Attendance.seq.is_(None))
+            ).count()
+            if missing:
+                print(f"Còn {missing} bản ghi chấm công chưa có work_date/seq (thiếu timestamp), chưa thể đặt NOT NULL")
+            else:
+                db.session.execute(db.text("ALTER TABLE ATTENDANCE MODIFY (work_date NOT NULL, seq NOT NULL)"))
+                db.session.commit()
+                print("Đã đặt NOT NULL cho cột work_date, seq của bảng ATTENDANCE!")
+    except Exception as e:
+        print(f"Lỗi khi cập nhật bảng ATTENDANCE: {str(e)}")
+        db.session.rollback()
+
+def update_payroll_table():
+    """Bổ sung cột ``stale`` cho bảng PAYROLLS và tạo ràng buộc duy nhất UQ_PAYROLLS_MONTH_EMP
+
+    Snapshot trùng (do chốt lương đồng thời trước đây) chỉ giữ bản ghi mới nhất; chỉ mục
+    IX_PAYROLLS_MONTH_EMP cùng cột được thay bằng chỉ mục duy nhất.
+    """
+    try:
+        inspector = db.inspect(db.engine)
+        if not inspector.has_table("PAYROLLS"):
+            return
+        columns = [col['name'].lower() for col in inspector.get_columns('PAYROLLS')]
+        if 'stale' not in columns:
+            db.session.execute(db.text("ALTER TABLE PAYROLLS ADD stale CHAR(1) DEFAULT '0'"))
+            db.session.commit()
+            print("Đã thêm cột stale cho bảng PAYROLLS!")
+        indexes = {ix['name'].lower(): ix.get('unique') for ix in inspector.get_indexes('PAYROLLS') if ix.get('name')}
+        unique = {name for name, is_unique in indexes.items() if is_unique}
+        unique |= {uc['name'].lower() for uc in inspector.get_unique_constraints('PAYROLLS') if uc.get('name')}
+        if 'uq_payrolls_month_emp' in unique:
+            return
+        deleted = db.session.execute(db.text(
+            "DELETE FROM PAYROLLS WHERE id NOT IN (SELECT MAX(id) FROM PAYROLLS GROUP BY month_year, employee_id)"
+        )).rowcount
+        if deleted:
+            print(f"Đã xóa {deleted} snapshot lương trùng")
+        if 'ix_payrolls_month_emp' in indexes:
+            db.session.execute(db.text("DROP INDEX IX_PAYROLLS_MONTH_EMP"))
+        db.session.execute(db.text("CREATE UNIQUE INDEX UQ_PAYROLLS_MONTH_EMP ON PAYROLLS (month_year, employee_id)"))
+        db.session.commit()
+        print("Đã tạo ràng buộc duy nhất (tháng, nhân viên) cho bảng PAYROLLS!")
+    except Exception as e:
+        print(f"Lỗi khi cập nhật bảng PAYROLLS: {str(e)}")
+        db.session.rollback()
+
 def update_attendance_table():
     """Cập nhật cấu trúc bảng Attendance"""
     try:
@@ -245,4 +564,10 @@ if __name__ == '__main__':
     with app.app_context():
         db.create_all()
         update_attendance_table()
+        update_attendance_day_slots()
+        update_payroll_table()
+        update_employee_table()
+        update_department_table()
+        update_face_encoding_table()
+        ensure_indexes()
     app.run(debug=True)
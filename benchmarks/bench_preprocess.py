@@ -0,0 +1,100 @@
+"""So sánh độ trễ và bộ nhớ đỉnh khi tiền xử lý một khung hình camera
+
+- legacy: base64 -> PIL (kích thước đầy đủ) -> NumPy -> cv2.resize -> cv2.cvtColor
+  -> ascontiguousarray, sau đó nén lại JPEG để lưu ảnh chấm công (cách làm cũ)
+- preprocess: camera/preprocess.py (giải mã JPEG thu nhỏ bằng draft mode, lưu nguyên bytes gốc)
+
+Bộ nhớ đỉnh đo bằng tracemalloc (gồm các mảng NumPy; bộ đệm nội bộ của PIL không được tính).
+
+Chạy từ thư mục gốc dự án:
+    python benchmarks/bench_preprocess.py --width 1920 --height 1080 --runs 50
+"""
+import argparse
+import base64
+import importlib.util
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from camera.preprocess import MAX_WIDTH, decode_data_url, load_rgb, save_original  # noqa: E402
+
+
+def make_frame(width, height, seed=0):
+    """Khung hình JPEG tổng hợp (gradient + nhiễu) dạng data URL"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=-1)
+    noise = rng.integers(0, 40, size=base.shape)
+    pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format='JPEG', quality=90)
+    return 'data:image/jpeg;base64,' + base64.b64encode(buf.getvalue()).decode('ascii')
+
+
+def legacy_pipeline(data_url, out_path):
+    import cv2
+    _, encoded = data_url.split(',', 1)
+    img_bytes = base64.b64decode(encoded)
+    pil_img = Image.open(io.BytesIO(img_bytes)).convert('RGB')
+    img_np = np.array(pil_img, dtype=np.uint8)
+    if img_np.shape[1] > MAX_WIDTH:
+        scale = MAX_WIDTH / img_np.shape[1]
+        new_size = (int(img_np.shape[1] * scale), int(img_np.shape[0] * scale))
+        img_np = cv2.resize(img_np, new_size, interpolation=cv2.INTER_AREA)
+    img_np = cv2.cvtColor(img_np, cv2.COLOR_BGR2RGB)
+    img_np = np.ascontiguousarray(img_np, dtype=np.uint8)
+    pil_img.save(out_path, format='JPEG')
+    return img_np
+
+
+def new_pipeline(data_url, out_path):
+    img_bytes = decode_data_url(data_url)
+    img_np = load_rgb(img_bytes)
+    save_original(img_bytes, out_path)
+    return img_np
+
+
+def measure(func, data_url, out_path, runs):
+    func(data_url, out_path)  # làm nóng
+    start = time.perf_counter()
+    for _ in range(runs):
+        func(data_url, out_path)
+    latency_ms = (time.perf_counter() - start) * 1000 / runs
+    tracemalloc.start()
+    result = func(data_url, out_path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return latency_ms, peak / 1024 / 1024, result.shape
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--runs', type=int, default=30)
+    args = parser.parse_args()
+
+    data_url = make_frame(args.width, args.height)
+    print(f"frame {args.width}x{args.height}, JPEG {len(data_url) * 3 // 4 // 1024} KB")
+    print(f"{'pipeline':<12}{'ms/frame':>10}{'peak MB':>10}  output")
+    with tempfile.TemporaryDirectory() as tmp:
+        out_path = os.path.join(tmp, 'frame.jpg')
+        pipelines = [('preprocess', new_pipeline)]
+        if importlib.util.find_spec('cv2') is not None:
+            pipelines.insert(0, ('legacy', legacy_pipeline))
+        else:
+            print("(không có cv2: bỏ qua pipeline cũ)")
+        for name, func in pipelines:
+            latency_ms, peak_mb, shape = measure(func, data_url, out_path, args.runs)
+            print(f"{name:<12}{latency_ms:>10.2f}{peak_mb:>10.2f}  {shape}")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,41 +2,199 @@
 import cv2
 import numpy as np
 import os
+import threading
+import time
 from datetime import datetime
 
 # Đường dẫn lưu ảnh khuôn mặt mẫu của nhân viên (dạng: static/captured/{employee_id}.jpg)
 FACE_SAMPLES_DIR = 'static/captured/'
+# Ảnh chụp từ camera lưu riêng để không lẫn vào bộ ảnh mẫu
+CAPTURED_FRAMES_DIR = os.path.join(FACE_SAMPLES_DIR, 'frames')
+# Kích thước chuẩn (rộng, cao) của khuôn mặt khi so sánh điểm ảnh
+SAMPLE_SIZE = (64, 64)
+# Ngưỡng nhận diện: sai khác trung bình mỗi điểm ảnh (0-255), có thể điều chỉnh
+MATCH_THRESHOLD = 50
+# Khoảng thời gian tối thiểu giữa hai lần kiểm tra thư mục ảnh mẫu có thay đổi (giây)
+GALLERY_CHECK_INTERVAL = 2.0
+# Chế độ chạy liên tục: bỏ qua nhận diện lặp lại cùng một người trong khoảng thời gian này (giây)
+MATCH_COOLDOWN = 10.0
+
+
+class FaceRecognizer:
+    """Nhận diện khuôn mặt bằng so khớp ảnh mẫu, dùng lại được giữa các khung hình
+
+    Bộ phát hiện Haar cascade chỉ nạp một lần. Ảnh mẫu trong ``samples_dir`` được đọc,
+    thu về ``SAMPLE_SIZE`` và xếp thành một mảng N × (H·W·3) trong bộ nhớ; mảng này chỉ
+    được dựng lại khi danh sách file hoặc thời điểm sửa file thay đổi. Mỗi khung hình chỉ
+    cần một phép trừ vector hóa với cả bộ ảnh mẫu thay vì đọc từng file từ đĩa.
+    """
+
+    def __init__(self, samples_dir=FACE_SAMPLES_DIR, threshold=MATCH_THRESHOLD, size=SAMPLE_SIZE):
+        self.samples_dir = samples_dir
+        self.threshold = threshold
+        self.size = size
+        self._lock = threading.Lock()
+        self._cascade = None
+        self._signature = None
+        self._checked_at = 0.0
+        self._employee_ids = []
+        self._gallery = np.empty((0, size[1] * size[0] * 3), dtype=np.int16)
+        self._capture = None
+        self._device = None
+
+    @property
+    def cascade(self):
+        if self._cascade is None:
+            self._cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        return self._cascade
+
+    def detect(self, frame):
+        """Các khung chữ nhật (x, y, w, h) của khuôn mặt trong ảnh BGR"""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return self.cascade.detectMultiScale(gray, 1.3, 5)
+
+    def _scan(self):
+        """Chữ ký của thư mục ảnh mẫu: (tên file, thời điểm sửa, kích thước)"""
+        try:
+            with os.scandir(self.samples_dir) as entries:
+                return tuple(sorted(
+                    (entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+                    for entry in entries
+                    if entry.is_file() and entry.name.endswith('.jpg')
+                ))
+        except FileNotFoundError:
+            return ()
+
+    def _load_gallery(self, signature):
+        employee_ids = []
+        samples = []
+        for name, _, _ in signature:
+            sample = cv2.imread(os.path.join(self.samples_dir, name))
+            if sample is None:
+                continue
+            employee_ids.append(name.rsplit('.', 1)[0])
+            samples.append(cv2.resize(sample, self.size, interpolation=cv2.INTER_AREA))
+        self._employee_ids = employee_ids
+        # Lưu sẵn dạng int16 phẳng N × (H·W·3) để phép trừ không phải đổi kiểu mỗi khung hình
+        if samples:
+            self._gallery = np.stack(samples).reshape(len(samples), -1).astype(np.int16)
+        else:
+            self._gallery = np.empty((0, self.size[1] * self.size[0] * 3), dtype=np.int16)
+        self._signature = signature
+
+    def refresh(self, force=False):
+        """Dựng lại bộ ảnh mẫu nếu thư mục đã thay đổi (kiểm tra tối đa mỗi ``GALLERY_CHECK_INTERVAL`` giây)"""
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._checked_at < GALLERY_CHECK_INTERVAL and self._signature is not None:
+                return
+            self._checked_at = now
+            signature = self._scan()
+            if force or signature != self._signature:
+                self._load_gallery(signature)
+
+    def match(self, face_img):
+        """So một ảnh khuôn mặt (BGR) với toàn bộ ảnh mẫu
+
+        Returns:
+            tuple: (employee_id, score); employee_id là None nếu không mẫu nào dưới ngưỡng
+        """
+        self.refresh()
+        with self._lock:
+            gallery = self._gallery
+            employee_ids = self._employee_ids
+        if len(gallery) == 0:
+            return None, None
+        face = cv2.resize(face_img, self.size, interpolation=cv2.INTER_AREA).reshape(-1).astype(np.int16)
+        scores = np.abs(gallery - face).mean(axis=1)
+        best = int(np.argmin(scores))
+        score = float(scores[best])
+        if score >= self.threshold:
+            return None, score
+        return employee_ids[best], score
+
+    def recognize(self, frame):
+        """Nhận diện khuôn mặt đầu tiên trong khung hình
+
+        Returns:
+            tuple: (employee_id hoặc None, frame)
+        """
+        faces = self.detect(frame)
+        if len(faces) == 0:
+            return None, frame
+        (x, y, w, h) = faces[0]
+        employee_id, _ = self.match(frame[y:y+h, x:x+w])
+        return employee_id, frame
+
+    def _open(self, device):
+        if self._capture is None or self._device != device or not self._capture.isOpened():
+            self.release()
+            self._capture = cv2.VideoCapture(device)
+            self._device = device
+        return self._capture
+
+    def capture(self, device=0, save=True):
+        """Chụp một khung hình và nhận diện; thiết bị camera được giữ mở cho lần gọi sau
+
+        Returns:
+            str: employee_id, hoặc None nếu không nhận diện được
+        """
+        ret, frame = self._open(device).read()
+        if not ret:
+            return None
+        employee_id, frame = self.recognize(frame)
+        if save:
+            os.makedirs(CAPTURED_FRAMES_DIR, exist_ok=True)
+            cv2.imwrite(os.path.join(CAPTURED_FRAMES_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"), frame)
+        return employee_id
+
+    def run(self, on_match, device=0, stop_event=None, cooldown=MATCH_COOLDOWN, interval=0.0):
+        """Chạy liên tục trên luồng video, gọi ``on_match(employee_id, frame)`` khi nhận diện được
+
+        Camera chỉ mở một lần cho cả vòng lặp. Cùng một nhân viên chỉ được báo lại sau
+        ``cooldown`` giây để một lần đứng trước camera không bị tính nhiều lần.
+
+        Args:
+            on_match (callable): Hàm xử lý khi nhận diện được nhân viên
+            device (int | str): Chỉ số camera hoặc URL luồng video
+            stop_event (threading.Event, optional): Đặt cờ để dừng vòng lặp
+            cooldown (float): Thời gian bỏ qua nhận diện lặp lại (giây)
+            interval (float): Thời gian nghỉ giữa hai khung hình (giây)
+        """
+        capture = self._open(device)
+        last_seen = {}
+        try:
+            while stop_event is None or not stop_event.is_set():
+                ret, frame = capture.read()
+                if not ret:
+                    break
+                employee_id, frame = self.recognize(frame)
+                now = time.monotonic()
+                if employee_id is not None and now - last_seen.get(employee_id, -cooldown) >= cooldown:
+                    last_seen[employee_id] = now
+                    on_match(employee_id, frame)
+                if interval:
+                    time.sleep(interval)
+        finally:
+            self.release()
+
+    def release(self):
+        """Đóng thiết bị camera đang giữ"""
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+            self._device = None
+
+
+# Bộ nhận diện dùng chung (giữ cascade, bộ ảnh mẫu và camera giữa các lần gọi)
+face_recognizer = FaceRecognizer()
+
 
 def detect_face(frame):
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-    faces = face_cascade.detectMultiScale(gray, 1.3, 5)
-    return faces
+    return face_recognizer.detect(frame)
 
 def recognize_face(frame):
-    faces = detect_face(frame)
-    if len(faces) == 0:
-        return None, frame
-    (x, y, w, h) = faces[0]
-    face_img = frame[y:y+h, x:x+w]
-    # Duyệt qua các ảnh mẫu để so sánh
-    for filename in os.listdir(FACE_SAMPLES_DIR):
-        if filename.endswith('.jpg'):
-            sample = cv2.imread(os.path.join(FACE_SAMPLES_DIR, filename))
-            sample = cv2.resize(sample, (w, h))
-            diff = cv2.absdiff(face_img, sample)
-            if np.mean(diff) < 50:  # Ngưỡng nhận diện, có thể điều chỉnh
-                employee_id = filename.split('.')[0]
-                return employee_id, frame
-    return None, frame
+    return face_recognizer.recognize(frame)
 
 def capture_and_recognize():
-    cam = cv2.VideoCapture(0)
-    ret, frame = cam.read()
-    employee_id = None
-    if ret:
-        employee_id, frame = recognize_face(frame)
-        filename = f"static/captured/{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-        cv2.imwrite(filename, frame)
-    cam.release()
-    return employee_id
+    return face_recognizer.capture()
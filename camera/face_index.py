@@ -0,0 +1,369 @@
+import atexit
+import logging
+import threading
+import time
+import numpy as np
+from config import (FACE_INDEX_BACKEND, FACE_INDEX_NLIST, FACE_INDEX_NPROBE, FACE_INDEX_PATH,
+                    FACE_INDEX_SAVE_INTERVAL, FACE_INDEX_CHECK_INTERVAL, FACE_MATCH_CANDIDATES)
+from camera.vector_index import create_index, load_index
+
+logger = logging.getLogger(__name__)
+
+# Số chiều vector mã hóa khuôn mặt của face_recognition (dlib)
+ENCODING_DIM = 128
+# Ngưỡng khoảng cách Euclid để coi là cùng một người
+FACE_MATCH_TOLERANCE = 0.5
+
+
+class FaceIndex:
+    """Chỉ mục mã hóa khuôn mặt trong bộ nhớ, dùng chung cho cả tiến trình
+
+    Các encoding được giữ trong một chỉ mục vector (``camera/vector_index.py``):
+    'exact' quét toàn bộ ma trận float32 N × 128, 'ivf' tìm kiếm xấp xỉ theo cụm.
+    Chỉ mục được nạp một lần (từ file đã lưu nếu có, đối chiếu với bảng FACE_ENCODINGS),
+    sau đó cập nhật trực tiếp khi thêm/xóa nhân viên thay vì truy vấn lại mỗi lần chấm công.
+    Thay đổi từ tiến trình khác được nhận qua ``refresh``: phiên bản dữ liệu được kiểm tra
+    tối đa một lần mỗi ``FACE_INDEX_CHECK_INTERVAL`` giây, chỉ đối chiếu lại khi phiên bản đổi.
+
+    Mỗi nhân viên có thể có nhiều encoding (ảnh đăng ký và ảnh chấm công). Với mỗi nhân
+    viên, tâm (trung bình các encoding) và độ phân tán (khoảng cách xa nhất từ tâm tới
+    một mẫu) được tính sẵn. Tâm được giữ trong một chỉ mục vector riêng theo employee_id.
+
+    Thay đổi chỉ cập nhật chỉ mục trong bộ nhớ; file ``FACE_INDEX_PATH`` được ghi ở luồng
+    nền, tối đa một lần mỗi ``FACE_INDEX_SAVE_INTERVAL`` giây (và khi tiến trình thoát).
+    Nhiều tiến trình có thể ghi đè file của nhau: file chỉ là bộ nhớ đệm khởi động, lần
+    nạp sau luôn đối chiếu lại với bảng FACE_ENCODINGS.
+    """
+
+    def __init__(self, backend=None, nlist=None, nprobe=None, path=None):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._backend = backend
+        self._nlist = nlist
+        self._nprobe = nprobe
+        self._path = path
+        self._index = None
+        self._employee_of = {}
+        # employee_id -> {face_id: vector float32}
+        self._samples = {}
+        # employee_id -> khoảng cách xa nhất từ tâm tới một mẫu
+        self._spread = {}
+        self._centroids = None
+        self._dirty = False
+        self._save_timer = None
+        # Phiên bản dữ liệu (face_encoding_version) lúc đối chiếu gần nhất
+        self._version = None
+        self._checked_at = 0.0
+
+    def _settings(self):
+        backend = self._backend or FACE_INDEX_BACKEND
+        nlist = self._nlist or FACE_INDEX_NLIST
+        nprobe = self._nprobe or FACE_INDEX_NPROBE
+        path = self._path if self._path is not None else FACE_INDEX_PATH
+        return backend, nlist, nprobe, path
+
+    def _new_index(self):
+        backend, nlist, nprobe, _ = self._settings()
+        return create_index(backend, ENCODING_DIM, nlist=nlist, nprobe=nprobe)
+
+    def __len__(self):
+        return len(self._employee_of)
+
+    @staticmethod
+    def _vectors(rows):
+        return np.vstack([np.frombuffer(encoding, dtype=np.float64) for _, _, encoding in rows])
+
+    def load(self, rows):
+        """Nạp lại toàn bộ chỉ mục từ các bộ (face_id, employee_id, encoding_bytes)"""
+        rows = [row for row in rows if row[1] is not None and row[2]]
+        index = self._new_index()
+        if rows:
+            # IVF tự huấn luyện tâm cụm khi đủ dữ liệu
+            index.add([face_id for face_id, _, _ in rows], self._vectors(rows))
+        with self._lock:
+            self._index = index
+            self._employee_of = {face_id: employee_id for face_id, employee_id, _ in rows}
+            self._build_gallery(*index.items())
+            self._loaded = True
+            # Nạp từ dữ liệu truyền vào: không đối chiếu với database
+            self._version = None
+
+    def ensure_loaded(self):
+        """Nạp chỉ mục ở lần dùng đầu tiên (cần app context)
+
+        Nếu có file chỉ mục đã lưu thì dùng lại, chỉ đọc thêm các encoding mới
+        và bỏ các encoding đã xóa so với database.
+        """
+        if self._loaded:
+            return
+        from config import db
+        from models.face_encoding import FaceEncoding, face_encoding_version
+        with self._lock:
+            if self._loaded:
+                return
+            # Lấy phiên bản trước khi đọc: thay đổi xen giữa sẽ được ``refresh`` đối chiếu lại
+            version = face_encoding_version()[0]
+            backend, nlist, nprobe, path = self._settings()
+            index = load_index(path, backend, ENCODING_DIM, nlist=nlist, nprobe=nprobe)
+            if index is None:
+                rows = db.session.query(
+                    FaceEncoding.id,
+                    FaceEncoding.employee_id,
+                    FaceEncoding.encoding
+                ).all()
+                self.load(rows)
+                self._version, self._checked_at = version, time.monotonic()
+                self._mark_dirty()
+                return
+            current, removed, rows = self._changes(index.keys().tolist())
+            if removed:
+                index.remove(removed)
+            if rows:
+                index.add([face_id for face_id, _, _ in rows], self._vectors(rows))
+            self._index = index
+            self._employee_of = {face_id: current[face_id] for face_id in index.keys().tolist()}
+            self._build_gallery(*index.items())
+            self._loaded = True
+            self._version, self._checked_at = version, time.monotonic()
+            if removed or rows:
+                self._mark_dirty()
+
+    def _changes(self, face_ids):
+        """So các ``face_id`` đang có với bảng FACE_ENCODINGS (chỉ đọc id, không đọc lại encoding đã có)
+
+        Returns:
+            tuple: (dict face_id -> employee_id trong database, face_id đã bị xóa,
+                    các dòng (face_id, employee_id, encoding) chưa có)
+        """
+        from config import db
+        from models.face_encoding import FaceEncoding
+        from models.attendance_matrix import MAX_IN_CLAUSE
+        current = dict(db.session.query(FaceEncoding.id, FaceEncoding.employee_id).filter(
+            FaceEncoding.employee_id.isnot(None)
+        ).all())
+        stored = set(face_ids)
+        removed = list(stored - set(current))
+        missing = sorted(set(current) - stored)
+        rows = []
+        for start in range(0, len(missing), MAX_IN_CLAUSE):
+            rows.extend(row for row in db.session.query(
+                FaceEncoding.id,
+                FaceEncoding.employee_id,
+                FaceEncoding.encoding
+            ).filter(FaceEncoding.id.in_(missing[start:start + MAX_IN_CLAUSE])).all() if row[2])
+        return current, removed, rows
+
+    def refresh(self):
+        """Nạp chỉ mục nếu chưa nạp, hoặc đối chiếu lại khi tiến trình khác đã thêm/xóa encoding (cần app context)
+
+        ``face_encoding_version`` được kiểm tra tối đa một lần mỗi ``FACE_INDEX_CHECK_INTERVAL``
+        giây; chỉ khi phiên bản đổi mới đọc lại danh sách id và các encoding còn thiếu.
+        """
+        if not self._loaded:
+            self.ensure_loaded()
+            return
+        now = time.monotonic()
+        if self._version is None or now - self._checked_at < FACE_INDEX_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        from models.face_encoding import face_encoding_version
+        version = face_encoding_version()[0]
+        if version == self._version:
+            return
+        with self._lock:
+            _, removed, rows = self._changes(list(self._employee_of))
+            changed = self._remove_vectors(removed)
+            if rows:
+                changed |= self._add_vectors([row[0] for row in rows], [row[1] for row in rows], self._vectors(rows))
+            self._version = version
+            if changed:
+                self._refresh_centroids(list(changed))
+                self._mark_dirty()
+
+    def save(self):
+        """Ghi chỉ mục ra file ngay (nếu cấu hình FACE_INDEX_PATH)"""
+        path = self._settings()[3]
+        if not path or self._index is None:
+            return
+        with self._lock:
+            self._dirty = False
+            try:
+                self._index.save(path)
+            except OSError as e:
+                logger.warning('Không ghi được chỉ mục khuôn mặt: %s', e)
+
+    def flush(self):
+        """Ghi file chỉ mục nếu có thay đổi chưa lưu"""
+        with self._lock:
+            self._save_timer = None
+            if not self._dirty:
+                return
+        self.save()
+
+    def _mark_dirty(self):
+        """Đánh dấu chỉ mục đã đổi, hẹn ghi file ở luồng nền (gộp các thay đổi trong khoảng chờ)"""
+        interval = FACE_INDEX_SAVE_INTERVAL
+        with self._lock:
+            self._dirty = True
+            if self._save_timer is not None or interval <= 0:
+                return
+            self._save_timer = threading.Timer(interval, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _build_gallery(self, face_ids, vectors):
+        """Nhóm encoding theo nhân viên và tính lại tâm của tất cả nhân viên"""
+        self._samples = {}
+        for face_id, vector in zip(face_ids.tolist(), vectors):
+            employee_id = self._employee_of.get(face_id)
+            if employee_id is not None:
+                self._samples.setdefault(employee_id, {})[face_id] = vector
+        self._spread = {}
+        self._centroids = self._new_index()
+        self._refresh_centroids(list(self._samples))
+
+    def _refresh_centroids(self, employee_ids):
+        """Tính lại tâm và độ phân tán của các nhân viên có bộ mẫu thay đổi"""
+        self._centroids.remove(employee_ids)
+        keys, centroids = [], []
+        for employee_id in employee_ids:
+            samples = self._samples.get(employee_id)
+            if not samples:
+                self._samples.pop(employee_id, None)
+                self._spread.pop(employee_id, None)
+                continue
+            vectors = np.vstack(list(samples.values()))
+            centroid = vectors.mean(axis=0)
+            self._spread[employee_id] = float(np.sqrt(((vectors - centroid) ** 2).sum(axis=1)).max())
+            keys.append(employee_id)
+            centroids.append(centroid)
+        if keys:
+            self._centroids.add(keys, np.vstack(centroids))
+
+    def invalidate(self):
+        """Buộc nạp lại từ database ở lần dùng tiếp theo"""
+        with self._lock:
+            self._loaded = False
+
+    def _add_vectors(self, face_ids, employee_ids, encodings):
+        """Thêm encoding vào chỉ mục (đang giữ khóa); trả về các nhân viên có bộ mẫu thay đổi"""
+        vectors = np.asarray(encodings, dtype=np.float32).reshape(len(face_ids), ENCODING_DIM)
+        # Bỏ encoding đã có (``refresh`` có thể đã đọc từ database trước khi request kịp cập nhật)
+        keep = [i for i, face_id in enumerate(face_ids) if face_id not in self._employee_of]
+        if not keep:
+            return set()
+        face_ids = [face_ids[i] for i in keep]
+        employee_ids = [employee_ids[i] for i in keep]
+        vectors = vectors[keep]
+        self._index.add(face_ids, vectors)
+        self._employee_of.update(zip(face_ids, employee_ids))
+        for face_id, employee_id, vector in zip(face_ids, employee_ids, vectors):
+            self._samples.setdefault(employee_id, {})[face_id] = vector
+        return set(employee_ids)
+
+    def _remove_vectors(self, face_ids):
+        """Xóa encoding khỏi chỉ mục (đang giữ khóa); trả về các nhân viên có bộ mẫu thay đổi"""
+        face_ids = [face_id for face_id in face_ids if face_id in self._employee_of]
+        if not face_ids:
+            return set()
+        self._index.remove(face_ids)
+        changed = set()
+        for face_id in face_ids:
+            employee_id = self._employee_of.pop(face_id)
+            self._samples.get(employee_id, {}).pop(face_id, None)
+            changed.add(employee_id)
+        return changed
+
+    def replace_faces(self, removed_ids, face_ids, employee_ids, encodings):
+        """Xóa và thêm encoding trong một lần cập nhật (tâm của mỗi nhân viên chỉ tính lại một lần)
+
+        Args:
+            removed_ids (list): face_id cần xóa (ví dụ mẫu chấm công cũ bị thay thế)
+            face_ids (list): face_id mới (đã commit vào FACE_ENCODINGS)
+            employee_ids (list): Nhân viên của từng encoding mới
+            encodings (list): Các vector 128 chiều
+        """
+        with self._lock:
+            if not self._loaded:
+                # Chưa nạp thì lần nạp đầu tiên sẽ lấy luôn thay đổi từ database
+                return
+            changed = self._remove_vectors(removed_ids) | self._add_vectors(face_ids, employee_ids, encodings)
+            if not changed:
+                return
+            self._refresh_centroids(list(changed))
+            self._mark_dirty()
+
+    def add(self, face_id, employee_id, encoding):
+        """Thêm một encoding mới (sau khi đã commit vào FACE_ENCODINGS)"""
+        self.replace_faces([], [face_id], [employee_id], [encoding])
+
+    def add_many(self, face_ids, employee_ids, encodings):
+        """Thêm nhiều encoding một lần (nhập hàng loạt)"""
+        self.replace_faces([], list(face_ids), list(employee_ids), encodings)
+
+    def remove_faces(self, face_ids):
+        """Xóa một số encoding"""
+        self.replace_faces(face_ids, [], [], [])
+
+    def remove_employee(self, employee_id):
+        """Xóa mọi encoding của một nhân viên khỏi chỉ mục"""
+        with self._lock:
+            if not self._loaded:
+                return
+            face_ids = [face_id for face_id, emp_id in self._employee_of.items() if emp_id == employee_id]
+            if not face_ids:
+                return
+            self._index.remove(face_ids)
+            for face_id in face_ids:
+                del self._employee_of[face_id]
+            self._samples.pop(employee_id, None)
+            self._refresh_centroids([employee_id])
+            self._mark_dirty()
+
+    def match(self, encoding, tolerance=FACE_MATCH_TOLERANCE):
+        """Tìm nhân viên có encoding gần nhất
+
+        Bước 1 lấy ``FACE_MATCH_CANDIDATES`` nhân viên có tâm gần nhất và loại những người
+        chắc chắn không khớp: mọi mẫu cách tâm không quá ``spread`` nên khoảng cách tới
+        mẫu gần nhất không nhỏ hơn ``khoảng cách tới tâm - spread``. Bước 2 chỉ so từng mẫu
+        của các ứng viên còn lại.
+
+        Args:
+            encoding (array): Vector 128 chiều của khuôn mặt cần nhận diện
+            tolerance (float): Khoảng cách tối đa để chấp nhận
+
+        Returns:
+            tuple: (employee_id, distance); employee_id là None nếu không có ai đủ gần
+        """
+        self.refresh()
+        query = np.asarray(encoding, dtype=np.float32).reshape(ENCODING_DIM)
+        with self._lock:
+            if len(self._centroids) == 0:
+                return None, None
+            keys, centroid_distances = self._centroids.search(query, k=FACE_MATCH_CANDIDATES)
+            if len(keys) == 0:
+                return None, None
+            candidates = [
+                employee_id for employee_id, distance in zip(keys.tolist(), centroid_distances.tolist())
+                if distance - self._spread.get(employee_id, 0.0) <= tolerance
+            ]
+            if not candidates:
+                return None, float(centroid_distances[0])
+            owners = []
+            vectors = []
+            for employee_id in candidates:
+                samples = self._samples[employee_id]
+                owners.extend([employee_id] * len(samples))
+                vectors.extend(samples.values())
+        distances = np.sqrt(((np.vstack(vectors) - query) ** 2).sum(axis=1))
+        best = int(np.argmin(distances))
+        distance = float(distances[best])
+        if distance > tolerance:
+            return None, distance
+        return owners[best], distance
+
+
+# Chỉ mục dùng chung cho toàn bộ tiến trình
+face_index = FaceIndex()
+# Ghi các thay đổi còn chờ khi tiến trình thoát
+atexit.register(face_index.flush)
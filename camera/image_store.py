@@ -0,0 +1,198 @@
+import atexit
+import hashlib
+import io
+import logging
+import os
+import queue
+import threading
+import zipfile
+from PIL import Image
+from config import ATTENDANCE_THUMBNAILS
+
+logger = logging.getLogger(__name__)
+
+# Thư mục lưu ảnh chấm công và file nén lưu trữ theo tháng
+ATTENDANCE_IMAGE_DIR = 'static/attendance_images'
+ARCHIVE_DIR = 'static/attendance_archive'
+# Kích thước ảnh thu nhỏ cho trang lịch sử
+THUMBNAIL_SIZE = (120, 120)
+THUMBNAIL_SUFFIX = '_thumb.jpg'
+# Đường dẫn ảnh đã lưu trữ có dạng '<file zip>#<tên trong zip>'
+ARCHIVE_SEPARATOR = '#'
+
+
+def is_archived(rel_path):
+    return bool(rel_path) and ARCHIVE_SEPARATOR in rel_path
+
+
+def thumbnail_path(rel_path):
+    """Đường dẫn ảnh thu nhỏ tương ứng với một ảnh chấm công"""
+    root, _ = os.path.splitext(rel_path)
+    return root + THUMBNAIL_SUFFIX
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class AttendanceImageStore:
+    """Kho ảnh chấm công đặt tên theo nội dung, ghi file ở luồng nền
+
+    Tên file là SHA-256 của nội dung, chia thư mục theo 2 cấp tiền tố
+    (``ab/cd/abcd....jpg``) nên hai lần chấm công cùng giây không ghi đè nhau
+    và ảnh trùng chỉ lưu một lần. Request chỉ tính hash và đưa bytes vào hàng đợi,
+    việc ghi đĩa và tạo ảnh thu nhỏ do một luồng nền đảm nhận.
+    """
+
+    def __init__(self, root=ATTENDANCE_IMAGE_DIR, thumbnails=None, max_pending=256):
+        self.root = root
+        self._thumbnails = thumbnails
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def thumbnails(self):
+        if self._thumbnails is not None:
+            return self._thumbnails
+        return ATTENDANCE_THUMBNAILS
+
+    def path_for(self, img_bytes, ext='.jpg'):
+        digest = hashlib.sha256(img_bytes).hexdigest()
+        return f'{self.root}/{digest[:2]}/{digest[2:4]}/{digest}{ext}'
+
+    def _ensure_writer(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='attendance-image-writer', daemon=True)
+                self._thread.start()
+
+    def put(self, img_bytes, ext='.jpg'):
+        """Đưa ảnh vào hàng đợi ghi, trả về ngay đường dẫn tương đối (lưu vào Attendance.image)"""
+        rel_path = self.path_for(img_bytes, ext)
+        if os.path.exists(rel_path):
+            return rel_path
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait((rel_path, img_bytes))
+        except queue.Full:
+            # Hàng đợi đầy: ghi trực tiếp thay vì bỏ ảnh
+            self._write(rel_path, img_bytes)
+        return rel_path
+
+    def _run(self):
+        while True:
+            rel_path, img_bytes = self._queue.get()
+            try:
+                self._write(rel_path, img_bytes)
+            except Exception:
+                logger.exception('Lỗi khi lưu ảnh chấm công %s', rel_path)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, rel_path, img_bytes):
+        if not os.path.exists(rel_path):
+            _write_atomic(rel_path, img_bytes)
+        if self.thumbnails:
+            self.make_thumbnail(rel_path, img_bytes)
+
+    def make_thumbnail(self, rel_path, img_bytes=None):
+        thumb = thumbnail_path(rel_path)
+        if os.path.exists(thumb):
+            return thumb
+        if img_bytes is None:
+            with open(rel_path, 'rb') as f:
+                img_bytes = f.read()
+        img = Image.open(io.BytesIO(img_bytes))
+        img.draft('RGB', THUMBNAIL_SIZE)
+        img = img.convert('RGB')
+        img.thumbnail(THUMBNAIL_SIZE)
+        buf = io.BytesIO()
+        img.save(buf, format='JPEG', quality=80)
+        _write_atomic(thumb, buf.getvalue())
+        return thumb
+
+    def flush(self):
+        """Chờ ghi xong mọi ảnh trong hàng đợi"""
+        if self._thread is not None:
+            self._queue.join()
+
+    def read(self, rel_path):
+        """Đọc bytes ảnh, kể cả ảnh đã được gom vào file nén"""
+        if is_archived(rel_path):
+            archive, name = rel_path.split(ARCHIVE_SEPARATOR, 1)
+            with zipfile.ZipFile(archive) as zf:
+                return zf.read(name)
+        with open(rel_path, 'rb') as f:
+            return f.read()
+
+
+def compact_attendance_images(before, archive_dir=ARCHIVE_DIR):
+    """Gom ảnh chấm công trước thời điểm ``before`` vào file zip theo tháng
+
+    Ảnh được chuyển vào ``attendance_YYYY-MM.zip`` theo tháng của bản ghi chấm công,
+    cột ``Attendance.image`` đổi thành ``<zip>#<tên>``. File gốc (và ảnh thu nhỏ)
+    chỉ bị xóa khi không còn bản ghi mới hơn dùng chung ảnh đó.
+
+    Args:
+        before (datetime): Mốc thời gian; ảnh của bản ghi cũ hơn sẽ được lưu trữ
+        archive_dir (str): Thư mục chứa file zip
+
+    Returns:
+        int: Số bản ghi chấm công đã chuyển ảnh vào file lưu trữ
+    """
+    from config import db
+    from models.attendance import Attendance
+    from models.attendance_matrix import MAX_IN_CLAUSE
+    prefix = ATTENDANCE_IMAGE_DIR + '/'
+    rows = db.session.query(Attendance.id, Attendance.timestamp, Attendance.image).filter(
+        Attendance.timestamp < before,
+        Attendance.image.like(prefix + '%')
+    ).all()
+    if not rows:
+        return 0
+    still_used = {image for image, in db.session.query(Attendance.image).filter(
+        Attendance.timestamp >= before,
+        Attendance.image.like(prefix + '%')
+    ).distinct().all()}
+
+    by_month = {}
+    for att_id, timestamp, image in rows:
+        by_month.setdefault(timestamp.strftime('%Y-%m'), {}).setdefault(image, []).append(att_id)
+
+    os.makedirs(archive_dir, exist_ok=True)
+    archived = 0
+    done_files = set()
+    for month, images in sorted(by_month.items()):
+        archive = f'{archive_dir}/attendance_{month}.zip'
+        with zipfile.ZipFile(archive, 'a', compression=zipfile.ZIP_STORED) as zf:
+            existing = set(zf.namelist())
+            for image, att_ids in images.items():
+                name = image[len(prefix):]
+                if name not in existing:
+                    if not os.path.exists(image):
+                        continue
+                    zf.write(image, arcname=name)
+                    existing.add(name)
+                for start in range(0, len(att_ids), MAX_IN_CLAUSE):
+                    Attendance.query.filter(Attendance.id.in_(att_ids[start:start + MAX_IN_CLAUSE])).update(
+                        {'image': f'{archive}{ARCHIVE_SEPARATOR}{name}'}, synchronize_session=False
+                    )
+                archived += len(att_ids)
+                done_files.add(image)
+        db.session.commit()
+
+    for image in done_files - still_used:
+        for path in (image, thumbnail_path(image)):
+            if os.path.exists(path):
+                os.remove(path)
+    return archived
+
+
+# Kho ảnh dùng chung cho toàn bộ tiến trình
+attendance_image_store = AttendanceImageStore()
+atexit.register(attendance_image_store.flush)
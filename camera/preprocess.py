@@ -0,0 +1,80 @@
+import base64
+import binascii
+import io
+import os
+import numpy as np
+from PIL import Image
+
+# Chiều rộng tối đa của ảnh đưa vào nhận diện (HOG chậm dần theo kích thước ảnh)
+MAX_WIDTH = 640
+
+# Phần mở rộng file theo định dạng ảnh gốc
+EXTENSIONS = {
+    'JPEG': '.jpg',
+    'PNG': '.png',
+    'WEBP': '.webp',
+    'BMP': '.bmp'
+}
+
+
+class InvalidImage(ValueError):
+    """Dữ liệu ảnh gửi lên không hợp lệ"""
+
+
+def decode_data_url(data_url):
+    """Giải mã data URL (``data:image/jpeg;base64,...``) thành bytes ảnh gốc"""
+    try:
+        _, encoded = data_url.split(',', 1)
+        return base64.b64decode(encoded)
+    except (ValueError, binascii.Error) as e:
+        raise InvalidImage(f'Ảnh base64 không hợp lệ: {e}')
+
+
+def image_extension(img_bytes, default='.jpg'):
+    """Phần mở rộng file đúng với định dạng ảnh gốc (chỉ đọc header)"""
+    try:
+        with Image.open(io.BytesIO(img_bytes)) as img:
+            return EXTENSIONS.get(img.format, default)
+    except OSError:
+        return default
+
+
+def load_rgb(img_bytes, max_width=MAX_WIDTH):
+    """Giải mã ảnh thành mảng RGB uint8 liền mạch, chiều rộng không quá ``max_width``
+
+    Với JPEG, dùng chế độ draft của PIL để bộ giải mã thu nhỏ ngay trong miền DCT
+    (1/2, 1/4, 1/8) nên không phải giải mã ảnh kích thước đầy đủ. Ảnh chỉ được
+    chuyển sang NumPy một lần ở cuối.
+
+    Args:
+        img_bytes (bytes): Dữ liệu ảnh gốc (JPEG/PNG/...)
+        max_width (int): Chiều rộng tối đa
+
+    Returns:
+        numpy.ndarray: Ảnh H × W × 3 uint8, C-contiguous
+
+    Raises:
+        InvalidImage: Không đọc được ảnh
+    """
+    try:
+        img = Image.open(io.BytesIO(img_bytes))
+        if img.width > max_width:
+            target = (max_width, max(1, img.height * max_width // img.width))
+            img.draft('RGB', target)
+        img = img.convert('RGB')
+        if img.width > max_width:
+            target = (max_width, max(1, img.height * max_width // img.width))
+            img = img.resize(target, Image.BILINEAR, reducing_gap=2.0)
+    except OSError as e:
+        raise InvalidImage(f'Không đọc được ảnh: {e}')
+    return np.asarray(img, dtype=np.uint8)
+
+
+def save_original(img_bytes, path):
+    """Lưu nguyên bytes ảnh gốc (không giải mã/nén lại)"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(img_bytes)
+    return path.replace('\\', '/')
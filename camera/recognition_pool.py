@@ -0,0 +1,175 @@
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as RecognitionTimeout
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from config import FACE_ENCODING_CHANNELS, RECOGNITION_WORKERS, RECOGNITION_QUEUE_DEPTH, RECOGNITION_TIMEOUT
+
+
+class RecognitionBusy(Exception):
+    """Hàng đợi nhận diện đã đầy, client nên thử lại sau"""
+
+
+def detect_and_encode(img_np, model='hog', timings=None, channels=None):
+    """Phát hiện và mã hóa khuôn mặt (chạy trong tiến trình worker)
+
+    Args:
+        img_np (numpy.ndarray): Ảnh RGB uint8 liền mạch
+        model (str): Mô hình phát hiện của face_recognition ('hog' / 'cnn')
+        timings (dict, optional): Nhận thời gian (giây) của bước face_locations / face_encodings
+        channels (str, optional): 'rgb' hoặc 'bgr' (mặc định ``FACE_ENCODING_CHANNELS``)
+
+    Returns:
+        tuple: (face_locations, encodings)
+    """
+    import face_recognition
+    if (channels or FACE_ENCODING_CHANNELS) == 'bgr':
+        # Encoding tạo trước khi sửa lỗi đảo kênh được tính trên ảnh BGR: giữ nguyên để còn khớp
+        img_np = np.ascontiguousarray(img_np[:, :, ::-1])
+    timings = {} if timings is None else timings
+    started = time.perf_counter()
+    face_locations = face_recognition.face_locations(img_np, model=model)
+    timings['face_locations'] = time.perf_counter() - started
+    if not face_locations:
+        return [], []
+    started = time.perf_counter()
+    encodings = face_recognition.face_encodings(img_np, face_locations)
+    timings['face_encodings'] = time.perf_counter() - started
+    return face_locations, [np.asarray(enc, dtype=np.float64) for enc in encodings]
+
+
+def _detect_and_encode_timed(img_np, model='hog'):
+    """``detect_and_encode`` kèm thời gian từng bước để tiến trình web ghi vào /metrics"""
+    timings = {}
+    return detect_and_encode(img_np, model, timings), timings
+
+
+def encode_enrollment_photo(img_bytes, model='hog'):
+    """Giải mã ảnh đăng ký và mã hóa khuôn mặt duy nhất trong ảnh (chạy trong tiến trình worker)
+
+    Args:
+        img_bytes (bytes): Ảnh gốc (JPEG/PNG/...)
+        model (str): Mô hình phát hiện của face_recognition
+
+    Returns:
+        tuple: (encoding, None) nếu thành công, (None, thông báo lỗi) nếu không dùng được ảnh
+    """
+    from camera.preprocess import load_rgb, InvalidImage
+    try:
+        img_np = load_rgb(img_bytes)
+    except InvalidImage as e:
+        return None, str(e)
+    face_locations, encodings = detect_and_encode(img_np, model)
+    if not face_locations:
+        return None, 'Không phát hiện được khuôn mặt trong ảnh'
+    if len(face_locations) > 1:
+        return None, f'Ảnh có {len(face_locations)} khuôn mặt, cần ảnh chỉ có một người'
+    if not encodings:
+        return None, 'Không thể tạo mã nhận diện khuôn mặt'
+    return encodings[0], None
+
+
+class RecognitionPool:
+    """Pool tiến trình nhận diện khuôn mặt có giới hạn hàng đợi
+
+    Request chỉ gửi ảnh đã giải mã sang pool và chờ kết quả, phần HOG + dlib chạy
+    trên các tiến trình khác nên tận dụng được nhiều lõi CPU. Khi số ảnh đang chờ
+    vượt ``queue_depth`` thì ``submit`` báo ``RecognitionBusy`` ngay (backpressure).
+    """
+
+    def __init__(self, workers=None, queue_depth=None, timeout=None):
+        self._workers = workers
+        self._queue_depth = queue_depth
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+
+    def _settings(self):
+        workers = self._workers if self._workers is not None else RECOGNITION_WORKERS
+        queue_depth = self._queue_depth or RECOGNITION_QUEUE_DEPTH
+        timeout = self._timeout or RECOGNITION_TIMEOUT
+        return workers, queue_depth, timeout
+
+    def _get_executor(self):
+        with self._lock:
+            workers, queue_depth, _ = self._settings()
+            if self._slots is None:
+                self._slots = threading.BoundedSemaphore(queue_depth)
+            if self._executor is None and workers > 0:
+                self._executor = ProcessPoolExecutor(max_workers=workers)
+            return self._executor
+
+    def _submit(self, fn, *args):
+        executor = self._get_executor()
+        if not self._slots.acquire(blocking=False):
+            raise RecognitionBusy()
+        if executor is None:
+            # Không dùng worker: chạy trực tiếp (vẫn giới hạn số request đồng thời)
+            from concurrent.futures import Future
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            self._slots.release()
+            return future
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            # Worker bị chết: tạo lại pool cho lần sau
+            self._slots.release()
+            self.shutdown()
+            raise RecognitionBusy()
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def submit(self, img_np, model='hog'):
+        """Gửi ảnh vào pool, trả về Future của ``((face_locations, encodings), timings)``
+
+        Raises:
+            RecognitionBusy: Hàng đợi đã đầy
+        """
+        return self._submit(_detect_and_encode_timed, img_np, model)
+
+    def submit_enrollment(self, img_bytes, model='hog'):
+        """Gửi ảnh đăng ký vào pool (dùng chung hàng đợi với chấm công), trả về Future của ``encode_enrollment_photo``
+
+        Raises:
+            RecognitionBusy: Hàng đợi đã đầy
+        """
+        return self._submit(encode_enrollment_photo, img_bytes, model)
+
+    def recognize(self, img_np, model='hog'):
+        """Nhận diện đồng bộ qua pool
+
+        Returns:
+            tuple: (face_locations, encodings)
+
+        Raises:
+            RecognitionBusy: Hàng đợi đã đầy
+            RecognitionTimeout: Quá ``RECOGNITION_TIMEOUT`` giây
+        """
+        from models.metrics import observe_face_spans
+        timeout = self._settings()[2]
+        started = time.perf_counter()
+        future = self.submit(img_np, model)
+        try:
+            result, timings = future.result(timeout=timeout)
+        except BrokenProcessPool:
+            self.shutdown()
+            raise RecognitionBusy()
+        # Tổng thời gian gồm cả chờ hàng đợi và chuyển ảnh sang worker
+        timings['recognize'] = time.perf_counter() - started
+        observe_face_spans(timings)
+        return result
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+# Pool dùng chung cho toàn bộ tiến trình web
+recognition_pool = RecognitionPool()
@@ -0,0 +1,264 @@
+import os
+import numpy as np
+
+# Số điểm dữ liệu tối thiểu cho mỗi cụm khi huấn luyện IVF
+MIN_POINTS_PER_LIST = 39
+# Số dòng xử lý mỗi lượt khi tính khoảng cách tới tâm cụm (giới hạn bộ nhớ tạm)
+ASSIGN_CHUNK = 8192
+
+
+def _sq_norms(matrix):
+    return np.einsum('ij,ij->i', matrix, matrix)
+
+
+def _nearest_centroids(vectors, centroids, count=1):
+    """Chỉ số ``count`` tâm cụm gần nhất của từng vector (tính theo từng khối)"""
+    centroid_norms = _sq_norms(centroids)
+    result = np.empty((len(vectors), count), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_CHUNK):
+        block = vectors[start:start + ASSIGN_CHUNK]
+        sq_dist = centroid_norms[None, :] - 2.0 * (block @ centroids.T)
+        if count == 1:
+            result[start:start + len(block), 0] = np.argmin(sq_dist, axis=1)
+        else:
+            part = np.argpartition(sq_dist, count - 1, axis=1)[:, :count]
+            order = np.take_along_axis(sq_dist, part, axis=1).argsort(axis=1)
+            result[start:start + len(block)] = np.take_along_axis(part, order, axis=1)
+    return result
+
+
+def kmeans(vectors, k, iterations=10, seed=0):
+    """K-means đơn giản bằng NumPy để huấn luyện tâm cụm cho IVF"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].astype(np.float32)
+    for _ in range(iterations):
+        assign = _nearest_centroids(vectors, centroids)[:, 0]
+        counts = np.bincount(assign, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+def _top_k(keys, matrix, sq_norms, query, k):
+    if len(keys) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    sq_dist = sq_norms - 2.0 * (matrix @ query) + float(query @ query)
+    k = min(k, len(keys))
+    best = np.argpartition(sq_dist, k - 1)[:k] if k < len(keys) else np.arange(len(keys))
+    best = best[np.argsort(sq_dist[best])]
+    return keys[best], np.sqrt(np.maximum(sq_dist[best], 0.0))
+
+
+def _save_npz(path, **arrays):
+    """Ghi file .npz nguyên tử (ghi file tạm rồi đổi tên) để các worker không đọc file dở"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+class ExactIndex:
+    """Tìm kiếm chính xác: quét toàn bộ ma trận float32 N × dim"""
+
+    kind = 'exact'
+
+    def __init__(self, dim):
+        self.dim = dim
+        self._keys = np.empty(0, dtype=np.int64)
+        self._matrix = np.empty((0, dim), dtype=np.float32)
+        self._norms = np.empty(0, dtype=np.float32)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def keys(self):
+        return self._keys.copy()
+
+    def items(self):
+        """Toàn bộ (keys, vectors) đang có trong chỉ mục"""
+        return self._keys.copy(), self._matrix.copy()
+
+    def add(self, keys, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        self._keys = np.concatenate([self._keys, np.asarray(keys, dtype=np.int64)])
+        self._matrix = np.ascontiguousarray(np.vstack([self._matrix, vectors]))
+        self._norms = _sq_norms(self._matrix)
+
+    def remove(self, keys):
+        keep = ~np.isin(self._keys, np.asarray(keys, dtype=np.int64))
+        if keep.all():
+            return
+        self._keys = self._keys[keep]
+        self._matrix = np.ascontiguousarray(self._matrix[keep])
+        self._norms = self._norms[keep]
+
+    def search(self, query, k=1):
+        """Trả về (keys, distances) của ``k`` vector gần nhất, sắp xếp tăng dần"""
+        query = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        return _top_k(self._keys, self._matrix, self._norms, query, k)
+
+    def save(self, path):
+        _save_npz(path, kind=np.array(self.kind), keys=self._keys, vectors=self._matrix)
+
+    @classmethod
+    def from_arrays(cls, dim, data, **params):
+        index = cls(dim)
+        index.add(data['keys'], data['vectors'])
+        return index
+
+
+class IVFIndex:
+    """Chỉ mục xấp xỉ IVF (inverted file) thuần NumPy
+
+    Các vector được chia vào ``nlist`` cụm theo k-means; mỗi lần tìm chỉ quét
+    ``nprobe`` cụm gần truy vấn nhất. Tăng ``nprobe`` để tăng recall, giảm để nhanh hơn.
+    Khi chưa đủ dữ liệu để huấn luyện, chỉ mục hoạt động như tìm kiếm chính xác.
+    Hỗ trợ thêm/xóa từng vector mà không cần dựng lại; tự huấn luyện lại khi dữ liệu
+    tăng gấp đôi so với lần huấn luyện trước.
+    """
+
+    kind = 'ivf'
+
+    def __init__(self, dim, nlist=256, nprobe=8):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.centroids = None
+        self._trained_size = 0
+        self._lists = [self._empty_list()]
+        self._list_of = {}
+
+    def _empty_list(self):
+        return {
+            'keys': np.empty(0, dtype=np.int64),
+            'vectors': np.empty((0, self.dim), dtype=np.float32),
+            'norms': np.empty(0, dtype=np.float32)
+        }
+
+    def __len__(self):
+        return len(self._list_of)
+
+    def keys(self):
+        return np.fromiter(self._list_of.keys(), dtype=np.int64, count=len(self._list_of))
+
+    def items(self):
+        """Toàn bộ (keys, vectors) đang có trong chỉ mục"""
+        return self._all_vectors()
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def _all_vectors(self):
+        keys = np.concatenate([lst['keys'] for lst in self._lists])
+        vectors = np.vstack([lst['vectors'] for lst in self._lists])
+        return keys, vectors
+
+    def train(self):
+        """(Huấn luyện lại) tâm cụm từ toàn bộ dữ liệu hiện có và phân cụm lại"""
+        keys, vectors = self._all_vectors()
+        nlist = min(self.nlist, len(keys) // MIN_POINTS_PER_LIST)
+        if nlist < 2:
+            return
+        self.centroids = kmeans(vectors, nlist)
+        self._trained_size = len(keys)
+        self._lists = [self._empty_list() for _ in range(nlist)]
+        self._list_of = {}
+        self._insert(keys, vectors)
+
+    def _insert(self, keys, vectors):
+        if self.is_trained:
+            assign = _nearest_centroids(vectors, self.centroids)[:, 0]
+        else:
+            assign = np.zeros(len(keys), dtype=np.int64)
+        for list_no in np.unique(assign):
+            mask = assign == list_no
+            lst = self._lists[list_no]
+            lst['keys'] = np.concatenate([lst['keys'], keys[mask]])
+            lst['vectors'] = np.ascontiguousarray(np.vstack([lst['vectors'], vectors[mask]]))
+            lst['norms'] = _sq_norms(lst['vectors'])
+        self._list_of.update(zip(keys.tolist(), assign.tolist()))
+
+    def add(self, keys, vectors):
+        keys = np.asarray(keys, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        self._insert(keys, vectors)
+        if len(self) >= max(2 * self._trained_size, MIN_POINTS_PER_LIST * 2):
+            self.train()
+
+    def remove(self, keys):
+        by_list = {}
+        for key in np.asarray(keys, dtype=np.int64).tolist():
+            list_no = self._list_of.pop(key, None)
+            if list_no is not None:
+                by_list.setdefault(list_no, []).append(key)
+        for list_no, removed in by_list.items():
+            lst = self._lists[list_no]
+            keep = ~np.isin(lst['keys'], removed)
+            lst['keys'] = lst['keys'][keep]
+            lst['vectors'] = np.ascontiguousarray(lst['vectors'][keep])
+            lst['norms'] = lst['norms'][keep]
+
+    def search(self, query, k=1):
+        """Trả về (keys, distances) của ``k`` vector gần nhất trong ``nprobe`` cụm gần nhất"""
+        query = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        if self.is_trained:
+            nprobe = min(self.nprobe, len(self._lists))
+            probes = _nearest_centroids(query[None, :], self.centroids, nprobe)[0]
+            lists = [self._lists[i] for i in probes]
+        else:
+            lists = self._lists
+        keys = np.concatenate([lst['keys'] for lst in lists])
+        matrix = np.vstack([lst['vectors'] for lst in lists])
+        norms = np.concatenate([lst['norms'] for lst in lists])
+        return _top_k(keys, matrix, norms, query, k)
+
+    def save(self, path):
+        keys, vectors = self._all_vectors()
+        centroids = self.centroids if self.is_trained else np.empty((0, self.dim), dtype=np.float32)
+        _save_npz(path, kind=np.array(self.kind), keys=keys, vectors=vectors,
+                  centroids=centroids, trained_size=np.array(self._trained_size))
+
+    @classmethod
+    def from_arrays(cls, dim, data, nlist=256, nprobe=8):
+        index = cls(dim, nlist=nlist, nprobe=nprobe)
+        centroids = data['centroids']
+        if len(centroids):
+            index.centroids = np.asarray(centroids, dtype=np.float32)
+            index._trained_size = int(data['trained_size'])
+            index._lists = [index._empty_list() for _ in range(len(centroids))]
+        index._insert(np.asarray(data['keys'], dtype=np.int64), np.asarray(data['vectors'], dtype=np.float32))
+        return index
+
+
+BACKENDS = {
+    ExactIndex.kind: ExactIndex,
+    IVFIndex.kind: IVFIndex
+}
+
+
+def create_index(kind, dim, nlist=256, nprobe=8):
+    """Tạo chỉ mục theo tên backend ('exact' hoặc 'ivf')"""
+    if kind == IVFIndex.kind:
+        return IVFIndex(dim, nlist=nlist, nprobe=nprobe)
+    if kind == ExactIndex.kind:
+        return ExactIndex(dim)
+    raise ValueError(f'Backend chỉ mục không hợp lệ: {kind}')
+
+
+def load_index(path, kind, dim, nlist=256, nprobe=8):
+    """Đọc chỉ mục đã lưu; trả về None nếu không có file hoặc khác backend/số chiều"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            if str(data['kind']) != kind or data['vectors'].shape[1:] != (dim,):
+                return None
+            return BACKENDS[kind].from_arrays(dim, data, nlist=nlist, nprobe=nprobe)
+    except (OSError, KeyError, ValueError):
+        return None
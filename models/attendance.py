@@ -1,8 +1,23 @@
+import base64
 from config import db
-from datetime import datetime
+from datetime import datetime, timedelta
+from sqlalchemy.orm import validates
+
+# Thứ tự của từng loại bản ghi trong ngày: mỗi nhân viên tối đa một IN và một OUT mỗi ngày
+SEQ_BY_STATUS = {'IN': 1, 'OUT': 2}
 
 class Attendance(db.Model):
     __tablename__ = 'ATTENDANCE'
+    __table_args__ = (
+        # Tra cứu chấm công của một nhân viên theo ngày/tháng (camera, bảng công, sửa công)
+        db.Index('IX_ATTENDANCE_EMP_TS', 'employee_id', 'timestamp', 'status'),
+        # Quét theo khoảng thời gian cho cả công ty (dashboard, bảng lương tháng, lịch sử)
+        db.Index('IX_ATTENDANCE_TS', 'timestamp', 'status', 'employee_id'),
+        # Chấm công đồng thời: lần ghi thứ hai vào cùng (nhân viên, ngày, lượt) bị từ chối ở DB
+        db.UniqueConstraint('employee_id', 'work_date', 'seq', name='UQ_ATTENDANCE_EMP_DAY_SEQ'),
+        # Sự kiện từ nhật ký chấm công edge chỉ được ghi một lần (đồng bộ lại / phát lại an toàn)
+        db.UniqueConstraint('event_key', name='UQ_ATTENDANCE_EVENT_KEY'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(db.Integer, db.ForeignKey('EMPLOYEES.id'))
@@ -14,6 +29,12 @@ class Attendance(db.Model):
     late_penalty = db.Column(db.Float, default=0.0)
     overtime_minutes = db.Column(db.Integer, default=0)
     overtime_pay = db.Column(db.Float, default=0.0)
+    # Ngày chấm công và lượt trong ngày (1 = IN, 2 = OUT), tự đồng bộ theo timestamp/status
+    # NOT NULL: Oracle không so trùng các dòng có cột NULL, thiếu giá trị thì ràng buộc duy nhất không chặn
+    work_date = db.Column(db.Date, nullable=False)
+    seq = db.Column(db.Integer, nullable=False)
+    # Khóa chống ghi trùng của sự kiện chấm công edge (None với chấm công trực tiếp)
+    event_key = db.Column(db.String(64))
 
     employee = db.relationship('Employee', backref='attendances')
 
@@ -27,5 +48,114 @@ class Attendance(db.Model):
         """Trả về timestamp nếu đây là bản ghi check-out"""
         return self.timestamp if self.status == 'OUT' else None
 
+    @validates('timestamp', 'status')
+    def _sync_day_slot(self, key, value):
+        """Giữ ``work_date``/``seq`` khớp với ``timestamp``/``status``
+
+        Chỉ tính lại khi ngày hoặc trạng thái thực sự đổi, để bản ghi cũ (lượt > 2 từ dữ liệu
+        trước khi có ràng buộc) vẫn sửa được các trường khác.
+        """
+        if key == 'timestamp':
+            if value is not None and (self.timestamp is None or value.date() != self.timestamp.date()):
+                self.work_date = value.date()
+                if self.status in SEQ_BY_STATUS:
+                    self.seq = SEQ_BY_STATUS[self.status]
+        elif value != self.status and value in SEQ_BY_STATUS:
+            self.seq = SEQ_BY_STATUS[value]
+        return value
+
     def __repr__(self):
         return f'<Attendance {self.employee_id} - {self.timestamp} - {self.status}>'
+
+
+def month_range(month, year):
+    """Khoảng thời gian của một tháng dạng nửa mở [đầu tháng, đầu tháng sau)
+
+    Args:
+        month (int): Tháng
+        year (int): Năm
+
+    Returns:
+        tuple: (start, end) kiểu datetime, dùng với điều kiện ``start <= timestamp < end``
+    """
+    start = datetime(year, month, 1)
+    if month == 12:
+        end = datetime(year + 1, 1, 1)
+    else:
+        end = datetime(year, month + 1, 1)
+    return start, end
+
+
+def day_range(day):
+    """Khoảng thời gian của một ngày dạng nửa mở [0h ngày đó, 0h ngày hôm sau)
+
+    Args:
+        day (date | datetime): Ngày cần lấy (phần giờ bị bỏ qua)
+
+    Returns:
+        tuple: (start, end) kiểu datetime, dùng với điều kiện ``start <= timestamp < end``
+    """
+    start = datetime(day.year, day.month, day.day)
+    return start, start + timedelta(days=1)
+
+
+def encode_cursor(att):
+    """Con trỏ phân trang (dạng chuỗi an toàn cho URL) trỏ tới bản ghi chấm công ``att``"""
+    raw = f'{att.timestamp.isoformat()}|{att.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Giải mã con trỏ phân trang
+
+    Returns:
+        tuple: (timestamp, id), hoặc None nếu con trỏ không hợp lệ
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        ts, att_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(ts), int(att_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def keyset_page(query, page_size, after=None, before=None):
+    """Một trang chấm công mới nhất trước, phân trang theo (timestamp, id)
+
+    Thay vì OFFSET (phải bỏ qua toàn bộ các dòng phía trước), mỗi trang chỉ đọc
+    ``page_size + 1`` dòng tiếp theo trên chỉ mục timestamp, nên trang sâu cũng nhanh như trang đầu.
+
+    Args:
+        query: Truy vấn Attendance đã lọc
+        page_size (int): Số bản ghi mỗi trang
+        after (str, optional): Con trỏ trang sau (các bản ghi cũ hơn)
+        before (str, optional): Con trỏ trang trước (các bản ghi mới hơn)
+
+    Returns:
+        tuple: (attendances, next_cursor, prev_cursor), con trỏ là None nếu không còn trang
+    """
+    after = decode_cursor(after) if after else None
+    before = decode_cursor(before) if before else None
+    if before:
+        ts, att_id = before
+        rows = query.filter(db.or_(
+            Attendance.timestamp > ts,
+            db.and_(Attendance.timestamp == ts, Attendance.id > att_id)
+        )).order_by(Attendance.timestamp.asc(), Attendance.id.asc()).limit(page_size + 1).all()
+        has_more = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        next_cursor = encode_cursor(rows[-1]) if rows else None
+        prev_cursor = encode_cursor(rows[0]) if rows and has_more else None
+        return rows, next_cursor, prev_cursor
+    if after:
+        ts, att_id = after
+        query = query.filter(db.or_(
+            Attendance.timestamp < ts,
+            db.and_(Attendance.timestamp == ts, Attendance.id < att_id)
+        ))
+    rows = query.order_by(Attendance.timestamp.desc(), Attendance.id.desc()).limit(page_size + 1).all()
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    next_cursor = encode_cursor(rows[-1]) if rows and has_more else None
+    prev_cursor = encode_cursor(rows[0]) if rows and after else None
+    return rows, next_cursor, prev_cursor
@@ -0,0 +1,169 @@
+from datetime import date, datetime
+import calendar
+import numpy as np
+from config import db
+from models.attendance import Attendance, SEQ_BY_STATUS, month_range
+
+# Oracle giới hạn 1000 phần tử trong một mệnh đề IN
+MAX_IN_CLAUSE = 1000
+# Giờ vào/ra ghi cho ngày được đánh dấu đi làm khi sửa bảng công
+GRID_CHECK_IN = (8, 0)
+GRID_CHECK_OUT = (17, 0)
+# Trạng thái ngày trên bảng công
+PRESENT = '✓'
+DAY_STATUSES = ('✓', 'X', '-')
+
+
+class AttendanceMatrix:
+    """Ma trận chấm công nhân viên × ngày của một tháng
+
+    Mỗi hàng ứng với một nhân viên (theo thứ tự ``employee_ids``), mỗi cột là một ngày
+    trong tháng. Một ngày được tính là đi làm khi có cả check-in (IN) và check-out (OUT).
+    Kèm theo tổng tiền phạt trễ và phụ cấp tăng ca của từng nhân viên trong tháng.
+    """
+
+    def __init__(self, month, year, employee_ids):
+        self.month = month
+        self.year = year
+        self.num_days = calendar.monthrange(year, month)[1]
+        self.employee_ids = np.asarray(list(employee_ids), dtype=np.int64)
+        self._row_of = {emp_id: i for i, emp_id in enumerate(self.employee_ids.tolist())}
+        shape = (len(self.employee_ids), self.num_days)
+        self.has_in = np.zeros(shape, dtype=bool)
+        self.has_out = np.zeros(shape, dtype=bool)
+        self.late_penalty = np.zeros(len(self.employee_ids), dtype=np.float64)
+        self.overtime_pay = np.zeros(len(self.employee_ids), dtype=np.float64)
+
+    @property
+    def presence(self):
+        """Ma trận bool: True nếu nhân viên có đủ IN và OUT trong ngày"""
+        return self.has_in & self.has_out
+
+    @property
+    def sunday_mask(self):
+        """Mảng bool độ dài ``num_days``, True tại các ngày Chủ Nhật"""
+        first_weekday = date(self.year, self.month, 1).weekday()
+        weekdays = (np.arange(self.num_days) + first_weekday) % 7
+        return weekdays == 6
+
+    def row(self, employee_id):
+        """Chỉ số hàng của nhân viên trong ma trận (None nếu không có)"""
+        return self._row_of.get(employee_id)
+
+    def day_status(self, employee_id):
+        """Danh sách trạng thái từng ngày ('✓' / 'X') của một nhân viên"""
+        i = self.row(employee_id)
+        if i is None:
+            return ['X'] * self.num_days
+        return ['✓' if present else 'X' for present in self.presence[i].tolist()]
+
+    def fill(self, rows):
+        """Đổ các bản ghi (employee_id, timestamp, status, late_penalty, overtime_pay) vào ma trận"""
+        emp_idx, day_idx, is_in, is_out, late, overtime = [], [], [], [], [], []
+        for employee_id, timestamp, status, late_penalty, overtime_pay in rows:
+            i = self._row_of.get(employee_id)
+            if i is None or timestamp is None:
+                continue
+            emp_idx.append(i)
+            day_idx.append(timestamp.day - 1)
+            is_in.append(status == 'IN')
+            is_out.append(status == 'OUT')
+            late.append(late_penalty or 0.0)
+            overtime.append(overtime_pay or 0.0)
+        if not emp_idx:
+            return self
+        emp_idx = np.asarray(emp_idx, dtype=np.int64)
+        day_idx = np.asarray(day_idx, dtype=np.int64)
+        is_in = np.asarray(is_in, dtype=bool)
+        is_out = np.asarray(is_out, dtype=bool)
+        self.has_in[emp_idx[is_in], day_idx[is_in]] = True
+        self.has_out[emp_idx[is_out], day_idx[is_out]] = True
+        np.add.at(self.late_penalty, emp_idx, np.asarray(late, dtype=np.float64))
+        np.add.at(self.overtime_pay, emp_idx, np.asarray(overtime, dtype=np.float64))
+        return self
+
+
+def load_month_attendance(month, year, employee_ids=None, session=None):
+    """Lấy toàn bộ bản ghi chấm công của tháng bằng một truy vấn theo khoảng thời gian
+
+    Args:
+        month (int): Tháng
+        year (int): Năm
+        employee_ids (list, optional): Chỉ lấy các nhân viên này (bỏ qua nếu quá nhiều)
+        session (Session, optional): Session dùng để đọc (mặc định ``db.session``)
+
+    Returns:
+        list: Các bộ (employee_id, timestamp, status, late_penalty, overtime_pay)
+    """
+    start, end = month_range(month, year)
+    query = (session or db.session).query(
+        Attendance.employee_id,
+        Attendance.timestamp,
+        Attendance.status,
+        Attendance.late_penalty,
+        Attendance.overtime_pay
+    ).filter(
+        Attendance.timestamp >= start,
+        Attendance.timestamp < end
+    )
+    if employee_ids is not None and len(employee_ids) <= MAX_IN_CLAUSE:
+        query = query.filter(Attendance.employee_id.in_(list(employee_ids)))
+    return query.all()
+
+
+def build_attendance_matrix(month, year, employee_ids, session=None):
+    """Dựng ma trận chấm công nhân viên × ngày cho một tháng (1 truy vấn)
+
+    Args:
+        month (int): Tháng
+        year (int): Năm
+        employee_ids (list): Danh sách ID nhân viên, quyết định thứ tự các hàng
+        session (Session, optional): Session dùng để đọc (mặc định ``db.session``)
+
+    Returns:
+        AttendanceMatrix: Ma trận chấm công của tháng
+    """
+    employee_ids = list(employee_ids)
+    matrix = AttendanceMatrix(month, year, employee_ids)
+    if not employee_ids:
+        return matrix
+    return matrix.fill(load_month_attendance(month, year, employee_ids, session))
+
+
+def replace_month_attendance(month, year, grid):
+    """Ghi đè chấm công cả tháng của nhiều nhân viên theo bảng công (không commit)
+
+    Mỗi nhóm tối đa ``MAX_IN_CLAUSE`` nhân viên chỉ tốn một câu DELETE theo khoảng thời gian
+    của tháng, sau đó toàn bộ bản ghi mới được chèn bằng một lệnh executemany.
+    Ngày đánh dấu '✓' được ghi một cặp IN 08:00 / OUT 17:00, các ngày khác để trống.
+
+    Args:
+        month (int): Tháng
+        year (int): Năm
+        grid (dict): {employee_id: danh sách trạng thái từng ngày ('✓' / 'X' / '-')}
+
+    Returns:
+        int: Số bản ghi chấm công đã chèn
+    """
+    start, end = month_range(month, year)
+    employee_ids = list(grid)
+    for i in range(0, len(employee_ids), MAX_IN_CLAUSE):
+        Attendance.query.filter(
+            Attendance.employee_id.in_(employee_ids[i:i + MAX_IN_CLAUSE]),
+            Attendance.timestamp >= start,
+            Attendance.timestamp < end
+        ).delete(synchronize_session=False)
+    rows = []
+    for employee_id, days in grid.items():
+        for d, status in enumerate(days, 1):
+            if status != PRESENT:
+                continue
+            work_date = date(year, month, d)
+            rows.append({'employee_id': employee_id, 'status': 'IN', 'work_date': work_date,
+                         'seq': SEQ_BY_STATUS['IN'], 'timestamp': datetime(year, month, d, *GRID_CHECK_IN)})
+            rows.append({'employee_id': employee_id, 'status': 'OUT', 'work_date': work_date,
+                         'seq': SEQ_BY_STATUS['OUT'], 'timestamp': datetime(year, month, d, *GRID_CHECK_OUT)})
+    if rows:
+        # Core insert trên bảng: executemany thuần, không cần lấy lại khóa chính
+        db.session.connection().execute(Attendance.__table__.insert(), rows)
+    return len(rows)
@@ -0,0 +1,188 @@
+from collections import defaultdict
+from datetime import date, datetime
+from sqlalchemy.exc import IntegrityError
+from config import db
+from models.employee import Employee
+from models.attendance import Attendance, SEQ_BY_STATUS
+from models.attendance_matrix import MAX_IN_CLAUSE
+from models.recent_activity import RecentActivity
+from models.payroll import compute_late_penalty, compute_overtime_pay, employee_daily_salary, is_closed_month, mark_payroll_stale
+from models.payroll_summary import apply_payroll_delta
+
+# Kết quả chấm công
+CHECK_IN = 'IN'
+CHECK_OUT = 'OUT'
+REJECTED = None
+
+
+def _check_in_values(employee, now):
+    """Các cột của bản ghi IN và phần cộng vào tổng lương tháng"""
+    # Tính trễ theo lịch làm việc cố định (xem models/payroll.py)
+    late_minutes, late_penalty = compute_late_penalty(now)
+    values = {'status': CHECK_IN, 'late_minutes': late_minutes, 'late_penalty': late_penalty,
+              'overtime_minutes': 0, 'overtime_pay': 0.0}
+    return values, {'late_penalty': late_penalty}
+
+
+def _check_out_values(employee, now):
+    """Các cột của bản ghi OUT và phần cộng vào tổng lương tháng (ngày đã có IN)"""
+    daily_salary = employee_daily_salary(employee, now.month, now.year)
+    overtime_minutes, overtime_pay = compute_overtime_pay(now, daily_salary)
+    values = {'status': CHECK_OUT, 'late_minutes': 0, 'late_penalty': 0.0,
+              'overtime_minutes': overtime_minutes, 'overtime_pay': overtime_pay}
+    # Đủ IN/OUT -> thêm một ngày công (Chủ Nhật tính riêng) và phụ cấp tăng ca
+    is_sunday = now.weekday() == 6
+    delta = {'workdays': 0 if is_sunday else 1, 'sunday_days': 1 if is_sunday else 0,
+             'overtime_pay': overtime_pay}
+    return values, delta
+
+
+def _activity(employee_id, result, now):
+    return {
+        'employee_id': employee_id,
+        'action': 'Check-in' if result == CHECK_IN else 'Check-out',
+        'detail': f'Chấm công thành công lúc {now.strftime("%H:%M %d/%m/%Y")}',
+        'timestamp': now
+    }
+
+
+def _apply_delta(employee_id, day, delta):
+    """Cộng vào tổng lương tháng; chấm công rơi vào tháng đã chốt (đồng bộ trễ) làm snapshot lương cũ"""
+    apply_payroll_delta(employee_id, day, **delta)
+    if is_closed_month(day.month, day.year):
+        mark_payroll_stale(day.month, day.year, employee_id)
+
+
+def _insert_once(att):
+    """Chèn bản ghi trong một savepoint; trả False nếu (nhân viên, ngày, lượt) đã có"""
+    try:
+        with db.session.begin_nested():
+            db.session.add(att)
+        return True
+    except IntegrityError:
+        return False
+
+
+def record_check(employee, image=None, now=None, event_key=None):
+    """Ghi một lần chấm công: IN nếu hôm nay chưa có, OUT nếu đã có IN, ngược lại từ chối
+
+    Không đọc trước các bản ghi trong ngày: ràng buộc UQ_ATTENDANCE_EMP_DAY_SEQ quyết định
+    lượt nào còn trống, nên hai lần quét đồng thời không thể cùng ghi IN. Bản ghi chấm công,
+    phần cộng dồn lương tháng và hoạt động gần đây nằm chung transaction; không hàm nào
+    trong đường chấm công commit hay rollback transaction này.
+
+    Args:
+        employee: Nhân viên (cần ``id``, ``full_name``, ``base_salary``, ``salary_type``)
+        image (str, optional): Đường dẫn ảnh chấm công
+        now (datetime, optional): Thời điểm chấm công (mặc định: hiện tại)
+        event_key (str, optional): Khóa chống ghi trùng của sự kiện chấm công (chế độ edge)
+
+    Returns:
+        tuple: (CHECK_IN | CHECK_OUT | REJECTED, Attendance hoặc None)
+    """
+    now = now or datetime.now()
+    for build in (_check_in_values, _check_out_values):
+        values, delta = build(employee, now)
+        att = Attendance(employee_id=employee.id, timestamp=now, image=image, event_key=event_key, **values)
+        if _insert_once(att):
+            _apply_delta(employee.id, now, delta)
+            db.session.add(RecentActivity(**_activity(employee.id, att.status, now)))
+            return att.status, att
+    return REJECTED, None
+
+
+def _recorded_events(keys):
+    """Các sự kiện đã có trong ATTENDANCE: {event_key: status}"""
+    recorded = {}
+    for start in range(0, len(keys), MAX_IN_CLAUSE):
+        recorded.update(db.session.query(Attendance.event_key, Attendance.status).filter(
+            Attendance.event_key.in_(keys[start:start + MAX_IN_CLAUSE])
+        ).all())
+    return recorded
+
+
+def _record_batch(events):
+    """Ghi cả lượt bằng executemany sau khi đọc một lần các lượt đã chiếm trong các ngày liên quan"""
+    results = _recorded_events([e['event_key'] for e in events])
+    events = [e for e in events if e['event_key'] not in results]
+    if not events:
+        return results
+    employee_ids = sorted({e['employee_id'] for e in events})
+    days = [e['timestamp'].date() for e in events]
+    employees = {}
+    taken = set()
+    for start in range(0, len(employee_ids), MAX_IN_CLAUSE):
+        chunk = employee_ids[start:start + MAX_IN_CLAUSE]
+        employees.update((emp.id, emp) for emp in db.session.query(
+            Employee.id, Employee.full_name, Employee.base_salary, Employee.salary_type
+        ).filter(Employee.id.in_(chunk)).all())
+        taken.update(db.session.query(Attendance.employee_id, Attendance.work_date, Attendance.seq).filter(
+            Attendance.employee_id.in_(chunk),
+            Attendance.work_date >= min(days),
+            Attendance.work_date <= max(days)
+        ).all())
+
+    attendances, activities = [], []
+    deltas = defaultdict(lambda: defaultdict(float))
+    for event in events:
+        emp, now = employees.get(event['employee_id']), event['timestamp']
+        results[event['event_key']] = REJECTED
+        if emp is None:
+            continue
+        for build in (_check_in_values, _check_out_values):
+            values, delta = build(emp, now)
+            slot = (emp.id, now.date(), SEQ_BY_STATUS[values['status']])
+            if slot in taken:
+                continue
+            taken.add(slot)
+            attendances.append(dict(values, employee_id=emp.id, timestamp=now, image=event.get('image'),
+                                    work_date=slot[1], seq=slot[2], event_key=event['event_key']))
+            activities.append(_activity(emp.id, values['status'], now))
+            for field, change in delta.items():
+                deltas[(emp.id, now.year, now.month)][field] += change
+            results[event['event_key']] = values['status']
+            break
+
+    if attendances:
+        connection = db.session.connection()
+        connection.execute(Attendance.__table__.insert(), attendances)
+        connection.execute(RecentActivity.__table__.insert(), activities)
+    for (employee_id, year, month), delta in deltas.items():
+        _apply_delta(employee_id, date(year, month, 1), delta)
+    return results
+
+
+def record_checks(events):
+    """Ghi một lượt sự kiện chấm công (từ nhật ký edge) và commit một lần
+
+    Sự kiện đã có trong ATTENDANCE (trùng ``event_key``, ví dụ khi phát lại nhật ký sau khi
+    khởi động lại) chỉ trả lại kết quả cũ. Nếu cả lượt vi phạm ràng buộc vì có lần chấm công
+    trực tiếp chen vào, lượt được ghi lại từng sự kiện bằng ``record_check``.
+
+    Args:
+        events (list): Các dict event_key, employee_id, timestamp (datetime), image; theo thứ tự thời gian
+
+    Returns:
+        dict: {event_key: CHECK_IN | CHECK_OUT | REJECTED}
+    """
+    if not events:
+        return {}
+    try:
+        results = _record_batch(events)
+        db.session.commit()
+        return results
+    except IntegrityError:
+        db.session.rollback()
+    results = _recorded_events([e['event_key'] for e in events])
+    for event in events:
+        if event['event_key'] in results:
+            continue
+        emp = db.session.query(
+            Employee.id, Employee.full_name, Employee.base_salary, Employee.salary_type
+        ).filter(Employee.id == event['employee_id']).first()
+        results[event['event_key']] = REJECTED
+        if emp is not None:
+            results[event['event_key']], _ = record_check(emp, image=event.get('image'), now=event['timestamp'],
+                                                          event_key=event['event_key'])
+    db.session.commit()
+    return results
@@ -0,0 +1,238 @@
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from config import db, EDGE_JOURNAL_PATH, EDGE_SYNC_BATCH_SIZE, EDGE_SYNC_INTERVAL, EDGE_JOURNAL_RETENTION_DAYS
+
+logger = logging.getLogger(__name__)
+
+# Trạng thái sự kiện trong nhật ký
+PENDING = 'pending'
+SYNCED = 'synced'
+# Kết quả của sự kiện bị từ chối (đã đủ IN/OUT trong ngày hoặc không có nhân viên)
+REJECTED = 'REJECTED'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkin_events (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_key   TEXT NOT NULL UNIQUE,
+    employee_id INTEGER NOT NULL,
+    timestamp   TEXT NOT NULL,
+    image       TEXT,
+    received_at TEXT NOT NULL,
+    synced_at   TEXT,
+    result      TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_checkin_events_pending ON checkin_events (synced_at, id);
+"""
+
+
+class CheckinJournal:
+    """Nhật ký chấm công cục bộ (SQLite) cho chế độ edge
+
+    Mỗi sự kiện được ghi bền (WAL, ``synchronous=FULL``) trước khi trả lời kiosk, nên
+    CSDL trung tâm gặp sự cố cũng không làm mất lượt quét. Sự kiện chỉ được thêm vào;
+    sau khi đồng bộ chỉ đánh dấu ``synced_at`` và kết quả (IN/OUT/REJECTED). Các sự kiện
+    chưa đồng bộ được phát lại khi khởi động lại.
+    """
+
+    def __init__(self, path=None):
+        self._path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return self._path or EDGE_JOURNAL_PATH
+
+    def _connection(self):
+        if self._conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=FULL')
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def append(self, event_key, employee_id, timestamp, image=None):
+        """Ghi một sự kiện chấm công
+
+        Returns:
+            bool: False nếu ``event_key`` đã có (kiosk gửi lại), sự kiện cũ được giữ nguyên
+        """
+        with self._lock:
+            cursor = self._connection().execute(
+                'INSERT OR IGNORE INTO checkin_events (event_key, employee_id, timestamp, image, received_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (event_key, employee_id, timestamp.isoformat(), image, datetime.now().isoformat())
+            )
+            return cursor.rowcount == 1
+
+    def pending(self, limit):
+        """Các sự kiện chưa đồng bộ, theo thứ tự nhận"""
+        with self._lock:
+            rows = self._connection().execute(
+                'SELECT event_key, employee_id, timestamp, image FROM checkin_events '
+                'WHERE synced_at IS NULL ORDER BY id LIMIT ?', (limit,)
+            ).fetchall()
+        return [
+            {'event_key': row['event_key'], 'employee_id': row['employee_id'],
+             'timestamp': datetime.fromisoformat(row['timestamp']), 'image': row['image']}
+            for row in rows
+        ]
+
+    def mark_synced(self, results):
+        """Đánh dấu các sự kiện đã ghi vào CSDL trung tâm
+
+        Args:
+            results (dict): {event_key: 'IN' / 'OUT' / None (bị từ chối)}
+        """
+        synced_at = datetime.now().isoformat()
+        with self._lock:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.executemany(
+                    'UPDATE checkin_events SET synced_at = ?, result = ? WHERE event_key = ?',
+                    [(synced_at, result or REJECTED, key) for key, result in results.items()]
+                )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    def get(self, event_key):
+        """Trạng thái của một sự kiện cho kiosk: None nếu không có
+
+        Returns:
+            dict: event_key, employee_id, timestamp, state (PENDING/SYNCED), result
+        """
+        with self._lock:
+            row = self._connection().execute(
+                'SELECT event_key, employee_id, timestamp, synced_at, result FROM checkin_events WHERE event_key = ?',
+                (event_key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'event_key': row['event_key'],
+            'employee_id': row['employee_id'],
+            'timestamp': row['timestamp'],
+            'state': SYNCED if row['synced_at'] else PENDING,
+            'result': row['result']
+        }
+
+    def backlog(self):
+        """Số sự kiện đang chờ đồng bộ"""
+        with self._lock:
+            return self._connection().execute(
+                'SELECT COUNT(*) FROM checkin_events WHERE synced_at IS NULL'
+            ).fetchone()[0]
+
+    def purge(self, before):
+        """Xóa các sự kiện đã đồng bộ trước thời điểm ``before``"""
+        with self._lock:
+            return self._connection().execute(
+                'DELETE FROM checkin_events WHERE synced_at IS NOT NULL AND synced_at < ?', (before.isoformat(),)
+            ).rowcount
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class CheckinSyncer:
+    """Luồng nền đẩy nhật ký chấm công vào ATTENDANCE/RECENT_ACTIVITY theo lượt
+
+    Mỗi vòng lấy tối đa ``EDGE_SYNC_BATCH_SIZE`` sự kiện chưa đồng bộ, ghi bằng
+    ``record_checks`` (một commit cho cả lượt) rồi đánh dấu trong nhật ký. Nếu CSDL trung
+    tâm lỗi, sự kiện vẫn nằm trong nhật ký và được thử lại với thời gian chờ tăng dần.
+    Ghi trùng (mất điện giữa commit và đánh dấu, hay nhiều tiến trình cùng đồng bộ) được
+    chặn bởi ràng buộc UQ_ATTENDANCE_EVENT_KEY.
+    """
+
+    def __init__(self, journal):
+        self.journal = journal
+        self._app = None
+        self._thread = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def ensure_running(self, app=None):
+        """Khởi động luồng đồng bộ nếu chưa chạy (cũng là lúc phát lại sự kiện còn tồn)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._app = app or current_app._get_current_object()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='checkin-syncer', daemon=True)
+            self._thread.start()
+
+    def notify(self):
+        """Báo có sự kiện mới để đồng bộ sớm, không chờ hết chu kỳ"""
+        self._wake.set()
+
+    def sync_once(self):
+        """Đồng bộ một lượt (cần app context)
+
+        Returns:
+            int: Số sự kiện đã xử lý
+        """
+        from models.checkin import record_checks
+        from models.dashboard_stats import invalidate_attendance_stats
+        events = self.journal.pending(EDGE_SYNC_BATCH_SIZE)
+        if not events:
+            return 0
+        try:
+            results = record_checks(events)
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            db.session.remove()
+        self.journal.mark_synced(results)
+        for ts in {e['timestamp'].date() for e in events}:
+            invalidate_attendance_stats(ts)
+        return len(events)
+
+    def _run(self):
+        interval = EDGE_SYNC_INTERVAL
+        delay = interval
+        purged_at = None
+        while not self._stop.is_set():
+            try:
+                with self._app.app_context():
+                    while self.sync_once():
+                        pass
+                delay = interval
+                if purged_at is None or datetime.now() - purged_at > timedelta(hours=1):
+                    self.journal.purge(datetime.now() - timedelta(days=EDGE_JOURNAL_RETENTION_DAYS))
+                    purged_at = datetime.now()
+            except Exception:
+                logger.exception('Lỗi khi đồng bộ nhật ký chấm công')
+                # CSDL trung tâm lỗi: chờ lâu dần (tối đa 60 giây), sự kiện vẫn nằm trong nhật ký
+                delay = min(delay * 2, 60.0)
+            self._wake.wait(delay)
+            self._wake.clear()
+
+    def stop(self, timeout=10):
+        """Dừng luồng đồng bộ (sự kiện chưa đồng bộ được phát lại ở lần chạy sau)"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+# Nhật ký và luồng đồng bộ dùng chung của tiến trình
+checkin_journal = CheckinJournal()
+checkin_syncer = CheckinSyncer(checkin_journal)
+atexit.register(checkin_syncer.stop)
@@ -0,0 +1,158 @@
+import logging
+import threading
+import time
+from datetime import date, datetime
+from flask import current_app
+from config import db, DASHBOARD_CACHE_TTL
+from models.employee import Employee
+from models.department import Department
+from models.attendance import Attendance, day_range
+from models.payroll import get_month_total
+from models.reporting import reporting_reads
+
+logger = logging.getLogger(__name__)
+
+# Bộ nhớ đệm số liệu dashboard: key -> (value, expires_at)
+_cache = {}
+# Phiên bản của từng key, tăng mỗi lần bị vô hiệu hóa (bỏ kết quả làm mới đã lỗi thời)
+_versions = {}
+# Các key đang được làm mới ở luồng nền
+_refreshing = set()
+_lock = threading.Lock()
+
+
+def _store(key, value, version):
+    with _lock:
+        if _versions.get(key, 0) != version:
+            return
+        _cache[key] = (value, time.monotonic() + DASHBOARD_CACHE_TTL)
+
+
+def _refresh_in_background(key, compute, version):
+    app = current_app._get_current_object()
+
+    def run():
+        try:
+            with app.app_context():
+                _store(key, compute(), version)
+        except Exception:
+            logger.exception('Lỗi khi làm mới số liệu dashboard %s', key)
+        finally:
+            with _lock:
+                _refreshing.discard(key)
+
+    threading.Thread(target=run, name=f'dashboard-refresh-{key[0]}', daemon=True).start()
+
+
+def _cached(key, compute, background=False):
+    """Đọc số liệu từ bộ nhớ đệm, tính lại khi hết hạn hoặc đã bị vô hiệu hóa
+
+    Với ``background=True`` (số liệu tốn kém như tổng lương), khi giá trị đã cũ thì vẫn
+    trả giá trị cũ ngay và tính lại ở luồng nền; chỉ lần đầu tiên mới phải chờ tính.
+    """
+    with _lock:
+        entry = _cache.get(key)
+        version = _versions.get(key, 0)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        start_refresh = background and entry is not None and key not in _refreshing
+        if start_refresh:
+            _refreshing.add(key)
+    if entry is not None and background:
+        if start_refresh:
+            _refresh_in_background(key, compute, version)
+        return entry[0]
+    value = compute()
+    _store(key, value, version)
+    return value
+
+
+def _invalidate(key, keep_stale=False):
+    with _lock:
+        _versions[key] = _versions.get(key, 0) + 1
+        if keep_stale and key in _cache:
+            _cache[key] = (_cache[key][0], 0)
+        else:
+            _cache.pop(key, None)
+
+
+def _salary_keys(month=None, year=None):
+    with _lock:
+        return [key for key in _cache if key[0] == 'salary' and (month is None or key[1:] == (year, month))]
+
+
+def invalidate_employee_stats():
+    """Gọi sau khi thêm/sửa/xóa nhân viên: số nhân viên, phòng ban và lương đều thay đổi"""
+    _invalidate(('headcount',))
+    for key in _salary_keys():
+        _invalidate(key, keep_stale=True)
+
+
+def invalidate_attendance_stats(day):
+    """Gọi sau khi chấm công hoặc sửa chấm công của ngày ``day``"""
+    if isinstance(day, datetime):
+        day = day.date()
+    _invalidate(('present', day))
+    invalidate_salary_stats(day.month, day.year)
+
+
+def invalidate_salary_stats(month=None, year=None):
+    """Gọi sau khi cập nhật bảng công/lương của một tháng (None = mọi tháng)"""
+    keys = _salary_keys(month, year)
+    if month is not None:
+        keys = keys or [('salary', year, month)]
+    for key in keys:
+        _invalidate(key, keep_stale=True)
+
+
+def _headcount():
+    total_employees, total_departments, active_departments = db.session.query(
+        db.select(db.func.count(Employee.id)).scalar_subquery(),
+        db.select(db.func.count(Department.id)).scalar_subquery(),
+        db.select(db.func.count(db.func.distinct(Employee.department_id))).scalar_subquery()
+    ).one()
+    return {
+        'total_employees': total_employees,
+        'total_departments': total_departments,
+        'active_departments': active_departments
+    }
+
+
+def _present(day):
+    start, end = day_range(day)
+    return db.session.query(db.func.count(db.func.distinct(Attendance.employee_id))).filter(
+        Attendance.timestamp >= start,
+        Attendance.timestamp < end,
+        Attendance.status == 'IN'
+    ).scalar()
+
+
+def _salary_total(month, year):
+    # Tính lương cả tháng là truy vấn nặng: đọc từ CSDL báo cáo nếu có
+    with reporting_reads():
+        return get_month_total(month, year)
+
+
+def get_dashboard_stats(month, year, today=None):
+    """Số liệu tổng quan cho dashboard, đọc từ bộ nhớ đệm
+
+    Số nhân viên/phòng ban và số người đi làm hôm nay là các truy vấn đếm nhanh nên được
+    tính lại ngay khi bị vô hiệu hóa. Tổng lương tháng tốn kém (tính lương cả tháng) nên
+    khi cũ vẫn trả giá trị cũ và tính lại ở luồng nền.
+
+    Args:
+        month (int): Tháng cần lấy tổng lương
+        year (int): Năm
+        today (date): Ngày tính số người đi làm (mặc định hôm nay)
+
+    Returns:
+        dict: total_employees, present_today, attendance_rate, total_departments,
+              active_departments, total_salary
+    """
+    today = today or date.today()
+    stats = dict(_cached(('headcount',), _headcount))
+    stats['present_today'] = _cached(('present', today), lambda: _present(today))
+    total = stats['total_employees']
+    stats['attendance_rate'] = round((stats['present_today'] / total * 100) if total > 0 else 0)
+    stats['total_salary'] = _cached(('salary', year, month), lambda: _salary_total(month, year), background=True)
+    return stats
@@ -1,7 +1,14 @@
-from config import db
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from config import db, DEPARTMENT_CACHE_TTL
 
 class Department(db.Model):
     __tablename__ = 'DEPARTMENTS'
+    __table_args__ = (
+        db.UniqueConstraint('name', name='UQ_DEPARTMENTS_NAME'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -9,3 +16,82 @@ class Department(db.Model):
 
     def __repr__(self):
         return f'<Department {self.name}>'
+
+
+# Bộ nhớ đệm tên phòng ban -> id (chỉ chứa phòng ban đã commit)
+_registry = {}
+_registry_expires = 0.0
+_lock = threading.Lock()
+
+
+def invalidate_departments():
+    """Xóa bộ nhớ đệm phòng ban (gọi sau khi đổi tên/xóa phòng ban ngoài ``department_id_for``)"""
+    global _registry_expires
+    with _lock:
+        _registry.clear()
+        _registry_expires = 0.0
+
+
+def _cached_department_id(name):
+    global _registry_expires
+    with _lock:
+        if _registry_expires > time.monotonic():
+            return _registry.get(name)
+    rows = db.session.query(Department.name, Department.id).all()
+    with _lock:
+        _registry.clear()
+        _registry.update(rows)
+        _registry_expires = time.monotonic() + DEPARTMENT_CACHE_TTL
+        return _registry.get(name)
+
+
+def department_id_for(name):
+    """ID phòng ban theo tên, tạo mới nếu chưa có (không commit, dùng chung transaction với nhân viên)
+
+    Tên được tra trong bộ nhớ đệm nên sửa/thêm hàng loạt nhân viên không tốn truy vấn
+    cho mỗi dòng. Phòng ban mới được thêm trong savepoint: nếu request khác vừa tạo
+    cùng tên (vi phạm UQ_DEPARTMENTS_NAME) thì dùng lại dòng đó. Phòng ban mới chỉ vào
+    bộ nhớ đệm sau khi transaction commit.
+
+    Args:
+        name (str): Tên phòng ban (rỗng/None = không có phòng ban)
+
+    Returns:
+        int: ID phòng ban, hoặc None nếu ``name`` rỗng
+    """
+    name = (name or '').strip()
+    if not name:
+        return None
+    pending = db.session.info.setdefault('pending_departments', {})
+    if name in pending:
+        return pending[name]
+    dept_id = _cached_department_id(name)
+    if dept_id is not None:
+        return dept_id
+    try:
+        with db.session.begin_nested():
+            department = Department(name=name)
+            db.session.add(department)
+        dept_id = department.id
+    except IntegrityError:
+        # Request khác vừa tạo phòng ban cùng tên
+        dept_id = db.session.query(Department.id).filter_by(name=name).scalar()
+    pending[name] = dept_id
+    return dept_id
+
+
+@event.listens_for(db.session, 'after_commit')
+def _publish_pending_departments(session):
+    if session.in_nested_transaction():
+        return
+    pending = session.info.pop('pending_departments', None)
+    if pending:
+        with _lock:
+            _registry.update(pending)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _drop_pending_departments(session):
+    if session.in_nested_transaction():
+        return
+    session.info.pop('pending_departments', None)
@@ -1,13 +1,37 @@
 
+import unicodedata
+from sqlalchemy.orm import validates, contains_eager, load_only
 from config import db
 from models.department import Department
 
+
+def normalize_name(text):
+    """Chuẩn hóa tên để tìm kiếm: bỏ dấu tiếng Việt (đ -> d), chữ thường, gộp khoảng trắng
+
+    Ví dụ: 'Nguyễn Văn  Đạt' -> 'nguyen van dat'
+    """
+    if not text:
+        return ''
+    text = text.replace('đ', 'd').replace('Đ', 'D')
+    text = unicodedata.normalize('NFD', text)
+    text = ''.join(ch for ch in text if unicodedata.category(ch) != 'Mn')
+    return ' '.join(text.lower().split())
+
+
 class Employee(db.Model):
     __tablename__ = 'EMPLOYEES'
+    __table_args__ = (
+        # Tìm theo tiền tố tên đã bỏ dấu (LIKE 'nguyen van%')
+        db.Index('IX_EMPLOYEES_SEARCH_NAME', 'search_name'),
+        # Lọc danh sách nhân viên theo phòng ban
+        db.Index('IX_EMPLOYEES_DEPARTMENT_ID', 'department_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     employee_code = db.Column(db.String(50), unique=True, nullable=False)
     full_name = db.Column(db.String(200), nullable=False)
+    # Tên không dấu, chữ thường (tự cập nhật theo full_name), dùng cho tìm kiếm
+    search_name = db.Column(db.String(200))
     email = db.Column(db.String(150))
     phone = db.Column(db.String(50))
     department_id = db.Column(db.Integer, db.ForeignKey('DEPARTMENTS.id'))
@@ -21,6 +45,11 @@ class Employee(db.Model):
 
     department = db.relationship('Department', backref='employees')
 
+    @validates('full_name')
+    def _sync_search_name(self, key, value):
+        self.search_name = normalize_name(value)
+        return value
+
     @property
     def name(self):
         """Alias for full_name to maintain compatibility"""
@@ -41,3 +70,60 @@ class Employee(db.Model):
 
     def __repr__(self):
         return f'<Employee {self.full_name}>'
+
+
+# Các cột cho phép sắp xếp danh sách nhân viên: tham số ``sort`` -> cột
+EMPLOYEE_SORTS = {
+    'name': Employee.search_name,
+    'department': Department.name,
+    'position': Employee.position,
+    'salary': Employee.base_salary,
+    'hire_date': Employee.hire_date
+}
+
+
+def name_search_filter(search):
+    """Điều kiện tìm theo đầu tên hoặc đầu một từ trong tên, không phân biệt dấu
+
+    Tiền tố dùng được IX_EMPLOYEES_SEARCH_NAME; khớp đầu từ để tìm theo tên gọi
+    ('Đạt' khớp 'Nguyễn Văn Đạt'). Ký tự % và _ người dùng nhập được tìm đúng nghĩa đen.
+    """
+    term = normalize_name(search).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return db.or_(
+        Employee.search_name.like(term + '%', escape='\\'),
+        Employee.search_name.like('% ' + term + '%', escape='\\')
+    )
+
+
+def employee_directory_query(search='', department_id=None, position='', active='', sort='name', desc=False):
+    """Truy vấn danh sách nhân viên đã lọc và sắp xếp, chỉ lấy các cột hiển thị
+
+    Phòng ban được JOIN ngay trong cùng truy vấn (không tải lười từng nhân viên).
+
+    Args:
+        search (str): Đầu tên hoặc đầu một từ trong tên, ví dụ 'nguy' hay 'dat' (không phân biệt dấu)
+        department_id (int, optional): Lọc theo phòng ban
+        position (str): Lọc theo chức vụ
+        active (str): '1' đang làm, '0' đã nghỉ, '' tất cả
+        sort (str): Khóa trong ``EMPLOYEE_SORTS``
+        desc (bool): Sắp xếp giảm dần
+
+    Returns:
+        Query: Truy vấn Employee (kèm ``department``) chưa phân trang
+    """
+    query = Employee.query.outerjoin(Employee.department).options(
+        load_only(Employee.id, Employee.full_name, Employee.position, Employee.base_salary,
+                  Employee.hire_date, Employee.active, Employee.department_id),
+        contains_eager(Employee.department).load_only(Department.id, Department.name)
+    )
+    if search:
+        query = query.filter(name_search_filter(search))
+    if department_id:
+        query = query.filter(Employee.department_id == department_id)
+    if position:
+        query = query.filter(Employee.position == position)
+    if active in ('0', '1'):
+        query = query.filter(Employee.active == active)
+    column = EMPLOYEE_SORTS.get(sort, Employee.search_name)
+    order = column.desc() if desc else column.asc()
+    return query.order_by(order, Employee.id.desc() if desc else Employee.id.asc())
@@ -0,0 +1,390 @@
+import csv
+import io
+import logging
+import os
+import posixpath
+import zipfile
+from collections import deque
+import time
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from datetime import datetime
+import numpy as np
+from werkzeug.utils import secure_filename
+from config import db, IMPORT_WORKERS, IMPORT_BATCH_SIZE, IMPORT_WEB_CONCURRENCY, RECOGNITION_TIMEOUT
+from models.employee import Employee
+from models.department import department_id_for
+from models.face_encoding import FaceEncoding, SOURCE_ENROLL
+from models.attendance_matrix import MAX_IN_CLAUSE
+from camera.recognition_pool import encode_enrollment_photo, RecognitionBusy
+from camera.preprocess import image_extension, save_original
+from camera.face_index import face_index
+
+logger = logging.getLogger(__name__)
+
+# Các cột của file CSV nhập nhân viên (chỉ full_name và photo là bắt buộc)
+IMPORT_COLUMNS = (
+    'employee_code', 'full_name', 'department', 'position', 'base_salary',
+    'salary_type', 'hire_date', 'email', 'phone', 'photo'
+)
+# Thư mục lưu ảnh đăng ký của nhân viên
+EMPLOYEE_IMAGE_DIR = os.path.join('static', 'employee_images')
+
+
+class ImportFileError(ValueError):
+    """File nhập không đọc được (không phải CSV/ZIP hợp lệ, thiếu cột...)"""
+
+
+def _read_csv(text):
+    reader = csv.DictReader(io.StringIO(text))
+    if not reader.fieldnames:
+        raise ImportFileError('File CSV trống')
+    fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    if 'full_name' not in fieldnames:
+        raise ImportFileError('File CSV thiếu cột full_name')
+    reader.fieldnames = fieldnames
+    return list(reader)
+
+
+def _decode(data):
+    try:
+        return data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise ImportFileError('File CSV phải dùng mã hóa UTF-8')
+
+
+def read_import_file(filename, data, base_dir=None):
+    """Đọc file nhập nhân viên
+
+    File ZIP chứa một file CSV (ưu tiên ``employees.csv``) và các ảnh được cột ``photo``
+    tham chiếu theo đường dẫn trong ZIP. Với file CSV, ảnh được đọc từ ``base_dir``
+    (chỉ dùng cho lệnh CLI; upload CSV qua web thì cần gửi ZIP kèm ảnh).
+
+    Args:
+        filename (str): Tên file (xác định định dạng theo phần mở rộng)
+        data (bytes): Nội dung file
+        base_dir (str, optional): Thư mục gốc của đường dẫn ảnh khi nhập CSV
+
+    Returns:
+        tuple: (rows, read_photo) - danh sách dict theo cột CSV và hàm đọc bytes ảnh theo tên
+
+    Raises:
+        ImportFileError: File không hợp lệ
+    """
+    if filename.lower().endswith('.zip'):
+        try:
+            archive = zipfile.ZipFile(io.BytesIO(data))
+        except zipfile.BadZipFile:
+            raise ImportFileError('File ZIP không hợp lệ')
+        members = {posixpath.normpath(name): name for name in archive.namelist() if not name.endswith('/')}
+        csv_names = sorted(name for name in members if name.lower().endswith('.csv'))
+        if not csv_names:
+            raise ImportFileError('File ZIP không có file CSV danh sách nhân viên')
+        csv_name = next((name for name in csv_names if posixpath.basename(name).lower() == 'employees.csv'), csv_names[0])
+        rows = _read_csv(_decode(archive.read(members[csv_name])))
+        csv_dir = posixpath.dirname(csv_name)
+
+        def read_photo(photo):
+            photo = photo.replace('\\', '/').lstrip('/')
+            for name in (posixpath.normpath(posixpath.join(csv_dir, photo)), posixpath.normpath(photo)):
+                if name in members:
+                    return archive.read(members[name])
+            raise FileNotFoundError(f'Không có ảnh {photo} trong file ZIP')
+
+        return rows, read_photo
+    if filename.lower().endswith('.csv'):
+        rows = _read_csv(_decode(data))
+
+        def read_photo(photo):
+            if base_dir is None:
+                raise FileNotFoundError('Nhập CSV qua web không kèm ảnh, hãy gửi file ZIP')
+            with open(os.path.join(base_dir, photo), 'rb') as f:
+                return f.read()
+
+        return rows, read_photo
+    raise ImportFileError('Chỉ hỗ trợ file .csv hoặc .zip')
+
+
+def _parse_row(raw, line_no):
+    """Chuẩn hóa một dòng CSV thành thuộc tính Employee
+
+    Raises:
+        ValueError: Dữ liệu dòng không hợp lệ
+    """
+    values = {column: (raw.get(column) or '').strip() for column in IMPORT_COLUMNS}
+    if not values['full_name']:
+        raise ValueError('Thiếu tên nhân viên')
+    if not values['photo']:
+        raise ValueError('Thiếu ảnh nhân viên (cột photo)')
+    try:
+        base_salary = float(values['base_salary'].replace(',', '')) if values['base_salary'] else 0.0
+    except ValueError:
+        raise ValueError(f"Lương không hợp lệ: {values['base_salary']}")
+    hire_date = None
+    if values['hire_date']:
+        for fmt in ('%Y-%m-%d', '%d/%m/%Y'):
+            try:
+                hire_date = datetime.strptime(values['hire_date'], fmt).date()
+                break
+            except ValueError:
+                continue
+        else:
+            raise ValueError(f"Ngày vào làm không hợp lệ: {values['hire_date']}")
+    salary_type = values['salary_type'] or 'monthly'
+    if salary_type not in ('monthly', 'daily'):
+        raise ValueError(f'Loại lương không hợp lệ: {salary_type}')
+    return {
+        'employee_code': values['employee_code'] or f"EMP{datetime.now().strftime('%Y%m%d%H%M%S')}{line_no:05d}",
+        'full_name': values['full_name'],
+        'department': values['department'],
+        'position': values['position'] or None,
+        'base_salary': base_salary,
+        'salary_type': salary_type,
+        'hire_date': hire_date,
+        'email': values['email'] or None,
+        'phone': values['phone'] or None,
+        'photo': values['photo']
+    }
+
+
+def _existing_codes(codes):
+    codes = list(codes)
+    existing = set()
+    for start in range(0, len(codes), MAX_IN_CLAUSE):
+        existing.update(code for code, in db.session.query(Employee.employee_code).filter(
+            Employee.employee_code.in_(codes[start:start + MAX_IN_CLAUSE])
+        ).all())
+    return existing
+
+
+def _insert_batch(items):
+    """Ghi một lượt nhân viên + encoding trong một transaction
+
+    Args:
+        items (list): Các bộ (entry, fields, img_bytes, encoding)
+
+    Returns:
+        tuple: (employee_ids, face_ids) đã commit, theo thứ tự ``items``
+    """
+    now = datetime.now()
+    employees = []
+    for _, fields, _, _ in items:
+        employees.append(Employee(
+            employee_code=fields['employee_code'],
+            full_name=fields['full_name'],
+            department_id=department_id_for(fields['department']),
+            position=fields['position'],
+            base_salary=fields['base_salary'],
+            salary_type=fields['salary_type'],
+            hire_date=fields['hire_date'],
+            email=fields['email'],
+            phone=fields['phone'],
+            active='1',
+            created_at=now,
+            updated_at=now
+        ))
+    db.session.add_all(employees)
+    db.session.flush()
+    faces = [
+        FaceEncoding(employee_id=emp.id, encoding=encoding.tobytes(), source=SOURCE_ENROLL, created_at=now)
+        for emp, (_, _, _, encoding) in zip(employees, items)
+    ]
+    db.session.add_all(faces)
+    db.session.flush()
+    # Lấy id trước khi commit (sau commit các đối tượng hết hạn, đọc lại sẽ tốn truy vấn)
+    employee_ids = [emp.id for emp in employees]
+    face_ids = [face.id for face in faces]
+    db.session.commit()
+    return employee_ids, face_ids
+
+
+def _publish_batch(items, employee_ids, face_ids):
+    """Sau khi lượt đã commit: báo 'created', cập nhật chỉ mục khuôn mặt và lưu ảnh đăng ký
+
+    Các dòng đã nằm trong database nên lỗi ở bước này không làm ghi lại lượt: lỗi chỉ mục
+    được ghi log (lần đối chiếu sau của ``FaceIndex.refresh`` sẽ nạp bù), lỗi lưu ảnh được
+    ghi log và vào cột message của báo cáo.
+    """
+    for emp_id, (entry, _, _, _) in zip(employee_ids, items):
+        entry.update(status='created', employee_id=emp_id, message='')
+    try:
+        face_index.add_many(face_ids, employee_ids, [encoding for _, _, _, encoding in items])
+    except Exception:
+        logger.exception('Không cập nhật được chỉ mục khuôn mặt cho %d nhân viên vừa nhập', len(employee_ids))
+    for emp_id, (entry, fields, img_bytes, _) in zip(employee_ids, items):
+        filename = f"{secure_filename(fields['employee_code']) or emp_id}{image_extension(img_bytes)}"
+        try:
+            save_original(img_bytes, os.path.join(EMPLOYEE_IMAGE_DIR, filename))
+        except OSError as e:
+            logger.warning('Không lưu được ảnh của nhân viên %s: %s', fields['employee_code'], e)
+            entry['message'] = f'Đã tạo nhân viên nhưng không lưu được ảnh: {e}'
+
+
+def _store_batch(items):
+    """Ghi cả lượt; nếu lỗi thì ghi lại từng dòng để chỉ các dòng lỗi bị bỏ qua"""
+    if not items:
+        return
+    try:
+        committed = _insert_batch(items)
+    except Exception:
+        db.session.rollback()
+    else:
+        _publish_batch(items, *committed)
+        return
+    for item in items:
+        try:
+            committed = _insert_batch([item])
+        except Exception as e:
+            db.session.rollback()
+            item[0].update(status='error', message=f'Lỗi ghi dữ liệu: {e}')
+            continue
+        _publish_batch([item], *committed)
+
+
+def import_employees(rows, read_photo, workers=None, batch_size=None, recognition=None, concurrency=None):
+    """Nhập nhân viên hàng loạt: mã hóa khuôn mặt song song, ghi DB theo lượt
+
+    Mỗi lượt ``IMPORT_BATCH_SIZE`` dòng được gửi sang pool tiến trình để mã hóa; trong lúc
+    pool xử lý lượt tiếp theo, lượt trước được ghi vào EMPLOYEES, DEPARTMENTS và
+    FACE_ENCODINGS rồi commit một lần. Dòng lỗi (thiếu dữ liệu, trùng mã, ảnh không có
+    hoặc có nhiều khuôn mặt...) được ghi vào báo cáo và không chặn các dòng khác.
+
+    Args:
+        rows (list): Các dict theo cột CSV (``IMPORT_COLUMNS``)
+        read_photo (callable): Hàm đọc bytes ảnh theo giá trị cột ``photo``
+        workers (int, optional): Số tiến trình mã hóa (mặc định ``IMPORT_WORKERS``, 0 = chạy trực tiếp)
+        batch_size (int, optional): Số dòng mỗi lượt (mặc định ``IMPORT_BATCH_SIZE``)
+        recognition (RecognitionPool, optional): Mã hóa trên pool nhận diện dùng chung thay vì tạo
+            pool riêng (nhập từ web: không tranh CPU với kiosk chấm công); bỏ qua ``workers``
+        concurrency (int, optional): Số ảnh tối đa đang chờ trên ``recognition`` cùng lúc
+            (mặc định ``IMPORT_WEB_CONCURRENCY``)
+
+    Returns:
+        list: Báo cáo từng dòng dạng dict row, employee_code, full_name, status ('created'/'error'),
+              message, employee_id
+    """
+    if workers is None:
+        workers = IMPORT_WORKERS
+    if workers is None:
+        workers = os.cpu_count() or 1
+    batch_size = batch_size or IMPORT_BATCH_SIZE
+
+    report = []
+    parsed = []
+    seen_codes = set()
+    for line_no, raw in enumerate(rows, start=2):
+        entry = {
+            'row': line_no,
+            'employee_code': (raw.get('employee_code') or '').strip(),
+            'full_name': (raw.get('full_name') or '').strip(),
+            'status': 'error',
+            'message': '',
+            'employee_id': None
+        }
+        report.append(entry)
+        try:
+            fields = _parse_row(raw, line_no)
+        except ValueError as e:
+            entry['message'] = str(e)
+            continue
+        entry['employee_code'] = fields['employee_code']
+        if fields['employee_code'] in seen_codes:
+            entry['message'] = 'Mã nhân viên bị trùng trong file'
+            continue
+        seen_codes.add(fields['employee_code'])
+        parsed.append((entry, fields))
+    existing = _existing_codes(seen_codes)
+    candidates = []
+    for entry, fields in parsed:
+        if fields['employee_code'] in existing:
+            entry['message'] = 'Mã nhân viên đã tồn tại'
+        else:
+            candidates.append((entry, fields))
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 0 and recognition is None else None
+    concurrency = concurrency or IMPORT_WEB_CONCURRENCY
+    timeout = RECOGNITION_TIMEOUT
+    in_flight = set()
+    busy = []
+
+    def submit_shared(img_bytes):
+        """Gửi một ảnh sang pool dùng chung, giữ tối đa ``concurrency`` ảnh đang chờ"""
+        if busy:
+            # Pool đã bận quá ``RECOGNITION_TIMEOUT``: báo lỗi ngay các dòng còn lại
+            raise RecognitionBusy()
+        while len(in_flight) >= concurrency:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            in_flight.difference_update(done)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                future = recognition.submit_enrollment(img_bytes)
+                break
+            except RecognitionBusy:
+                # Kiosk đang dùng hết hàng đợi: nhường chấm công, thử lại sau
+                if time.monotonic() > deadline:
+                    busy.append(True)
+                    raise
+                time.sleep(0.1)
+        in_flight.add(future)
+        return future
+
+    def submit(batch):
+        """Đọc ảnh và gửi cả lượt sang pool (ảnh lỗi ghi báo cáo ngay)"""
+        jobs = []
+        for entry, fields in batch:
+            try:
+                img_bytes = read_photo(fields['photo'])
+            except (OSError, KeyError) as e:
+                entry['message'] = str(e) or 'Không đọc được ảnh'
+                continue
+            if recognition is not None:
+                try:
+                    future = submit_shared(img_bytes)
+                except RecognitionBusy:
+                    entry['message'] = 'Hệ thống nhận diện đang bận, vui lòng nhập lại dòng này'
+                    continue
+            elif pool is None:
+                future = Future()
+                future.set_result(encode_enrollment_photo(img_bytes))
+            else:
+                future = pool.submit(encode_enrollment_photo, img_bytes)
+            jobs.append((entry, fields, img_bytes, future))
+        return jobs
+
+    def collect(jobs):
+        items = []
+        for entry, fields, img_bytes, future in jobs:
+            try:
+                encoding, error = future.result()
+            except Exception as e:
+                encoding, error = None, f'Lỗi mã hóa khuôn mặt: {e}'
+            if error:
+                entry['message'] = error
+            else:
+                items.append((entry, fields, img_bytes, np.asarray(encoding, dtype=np.float64)))
+        return items
+
+    try:
+        # Luôn có sẵn một lượt đang mã hóa trong lúc ghi lượt trước
+        pending = deque()
+        batches = (candidates[start:start + batch_size] for start in range(0, len(candidates), batch_size))
+        for batch in batches:
+            pending.append(submit(batch))
+            if len(pending) > 1:
+                _store_batch(collect(pending.popleft()))
+        while pending:
+            _store_batch(collect(pending.popleft()))
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    return report
+
+
+def report_to_csv(report):
+    """Báo cáo nhập nhân viên dạng CSV (có BOM để Excel đọc đúng tiếng Việt)"""
+    buffer = io.StringIO()
+    buffer.write('\ufeff')
+    writer = csv.DictWriter(buffer, fieldnames=['row', 'employee_code', 'full_name', 'status', 'employee_id', 'message'])
+    writer.writeheader()
+    writer.writerows(report)
+    return buffer.getvalue()
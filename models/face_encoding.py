@@ -1,11 +1,207 @@
-from config import db
+from config import db, FACE_GALLERY_MIN_DISTANCE, FACE_GALLERY_MAX_DISTANCE, FACE_GALLERY_MAX_CHECKIN
+import base64
+import os
+import numpy as np
+from datetime import datetime
+from models.employee import Employee
+from models.department import Department
+from models.attendance_matrix import MAX_IN_CLAUSE
+
+# Nguồn của encoding: ảnh đăng ký (do quản trị thêm) hoặc ảnh chấm công thành công
+SOURCE_ENROLL = 'enroll'
+SOURCE_CHECKIN = 'checkin'
 
 class FaceEncoding(db.Model):
     __tablename__ = 'FACE_ENCODINGS'
+    __table_args__ = (
+        db.Index('IX_FACE_ENCODINGS_EMPLOYEE_ID', 'employee_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(db.Integer, db.ForeignKey('EMPLOYEES.id'))
     encoding = db.Column(db.LargeBinary)
+    # 'enroll' / 'checkin' (NULL ở dữ liệu cũ = ảnh đăng ký)
+    source = db.Column(db.String(20), default=SOURCE_ENROLL)
     created_at = db.Column(db.DateTime)
 
     employee = db.relationship('Employee', backref='face_encodings')
+
+
+def add_checkin_sample(employee_id, encoding, distance):
+    """Bổ sung encoding của lần chấm công thành công vào bộ mẫu nhân viên (không commit)
+
+    Chỉ thêm khi khớp chắc chắn (``distance <= FACE_GALLERY_MAX_DISTANCE``) nhưng khác
+    đủ nhiều so với mẫu gần nhất (``>= FACE_GALLERY_MIN_DISTANCE``, ví dụ ánh sáng khác),
+    và giữ tối đa ``FACE_GALLERY_MAX_CHECKIN`` mẫu chấm công mới nhất. Ảnh đăng ký không
+    bao giờ bị xóa.
+
+    Args:
+        employee_id (int): Nhân viên vừa được nhận diện
+        encoding (array): Vector 128 chiều của lần chấm công
+        distance (float): Khoảng cách tới mẫu gần nhất khi nhận diện
+
+    Returns:
+        tuple: (FaceEncoding mới hoặc None, danh sách id encoding bị xóa)
+    """
+    cap = FACE_GALLERY_MAX_CHECKIN
+    if cap <= 0 or distance is None or not FACE_GALLERY_MIN_DISTANCE <= distance <= FACE_GALLERY_MAX_DISTANCE:
+        return None, []
+    # Giữ lại cap - 1 mẫu chấm công mới nhất, cộng mẫu vừa thêm
+    evicted = [face_id for face_id, in db.session.query(FaceEncoding.id).filter(
+        FaceEncoding.employee_id == employee_id,
+        FaceEncoding.source == SOURCE_CHECKIN
+    ).order_by(FaceEncoding.created_at.desc(), FaceEncoding.id.desc()).offset(cap - 1).all()]
+    for start in range(0, len(evicted), MAX_IN_CLAUSE):
+        FaceEncoding.query.filter(
+            FaceEncoding.id.in_(evicted[start:start + MAX_IN_CLAUSE])
+        ).delete(synchronize_session=False)
+    face = FaceEncoding(
+        employee_id=employee_id,
+        encoding=np.asarray(encoding, dtype=np.float64).tobytes(),
+        source=SOURCE_CHECKIN,
+        created_at=datetime.now()
+    )
+    db.session.add(face)
+    db.session.flush()
+    return face, evicted
+
+
+def face_encoding_version():
+    """Phiên bản dữ liệu nhận diện: thay đổi khi thêm/xóa encoding hoặc sửa nhân viên
+
+    Returns:
+        tuple: (etag, last_modified) - last_modified có thể là None khi chưa có dữ liệu
+    """
+    count, max_id, max_created, max_updated = db.session.query(
+        db.func.count(FaceEncoding.id),
+        db.func.max(FaceEncoding.id),
+        db.func.max(FaceEncoding.created_at),
+        db.select(db.func.max(Employee.updated_at)).scalar_subquery()
+    ).one()
+    stamps = [ts for ts in (max_created, max_updated) if ts is not None]
+    last_modified = max(stamps) if stamps else None
+    stamp = last_modified.strftime('%Y%m%d%H%M%S%f') if last_modified else '0'
+    return f'faces-{count}-{max_id or 0}-{stamp}', last_modified
+
+
+def load_face_payload(since=None, binary=False):
+    """Lấy encoding kèm thông tin nhân viên bằng một truy vấn JOIN
+
+    Args:
+        since (datetime, optional): Chỉ lấy encoding mới hoặc của nhân viên sửa từ thời điểm này
+        binary (bool): True -> encoding là base64 của float32 (512 byte), False -> danh sách số
+
+    Returns:
+        list: Các dict face_id, employee_id, name, department, position, encoding
+    """
+    query = db.session.query(
+        FaceEncoding.id,
+        FaceEncoding.employee_id,
+        FaceEncoding.encoding,
+        Employee.full_name,
+        Employee.position,
+        Department.name
+    ).join(Employee, FaceEncoding.employee_id == Employee.id).outerjoin(
+        Department, Employee.department_id == Department.id
+    )
+    if since is not None:
+        query = query.filter(db.or_(FaceEncoding.created_at >= since, Employee.updated_at >= since))
+    data = []
+    for face_id, employee_id, encoding, full_name, position, department in query.all():
+        if not encoding:
+            continue
+        vector = np.frombuffer(encoding, dtype=np.float64)
+        if binary:
+            encoded = base64.b64encode(vector.astype('<f4').tobytes()).decode('ascii')
+        else:
+            encoded = vector.tolist()
+        data.append({
+            'face_id': face_id,
+            'employee_id': employee_id,
+            'name': full_name,
+            'department': department or '',
+            'position': position,
+            'encoding': encoded
+        })
+    return data
+
+
+def current_face_ids():
+    """Danh sách id encoding hiện có (để client xóa các khuôn mặt đã bị xóa khi đồng bộ delta)"""
+    return [face_id for face_id, in db.session.query(FaceEncoding.id).join(
+        Employee, FaceEncoding.employee_id == Employee.id
+    ).all()]
+
+
+def reencode_face_encodings(image_dir, max_distance=0.3, dry_run=False):
+    """Mã hóa lại ảnh đăng ký theo thứ tự kênh RGB (chuyển dữ liệu trước khi đổi ``FACE_ENCODING_CHANNELS``)
+
+    Ảnh trong ``image_dir`` không gắn với nhân viên, nên mỗi ảnh được mã hóa lại theo cách
+    cũ (BGR) để tìm encoding đăng ký gần nhất (khoảng cách <= ``max_distance``), rồi thay
+    encoding đó bằng bản mã hóa RGB của cùng ảnh. Encoding từ chấm công không có ảnh gốc
+    nên bị xóa (được bổ sung lại qua các lần chấm công sau). Encoding đăng ký không tìm
+    được ảnh được giữ nguyên và báo lại để đăng ký lại khuôn mặt.
+
+    Args:
+        image_dir (str): Thư mục ảnh đăng ký (static/employee_images)
+        max_distance (float): Khoảng cách tối đa giữa encoding đã lưu và ảnh mã hóa lại
+        dry_run (bool): Chỉ đối chiếu, không ghi database
+
+    Returns:
+        dict: updated (số encoding đã thay), deleted (số encoding chấm công đã xóa),
+              unmatched_employees (id nhân viên còn encoding cũ), unmatched_images (tên ảnh không khớp)
+    """
+    from camera.preprocess import load_rgb, InvalidImage
+    from camera.recognition_pool import detect_and_encode
+    rows = db.session.query(FaceEncoding.id, FaceEncoding.employee_id, FaceEncoding.encoding).filter(
+        FaceEncoding.employee_id.isnot(None),
+        db.or_(FaceEncoding.source == SOURCE_ENROLL, FaceEncoding.source.is_(None))
+    ).all()
+    rows = [row for row in rows if row.encoding]
+    legacy = np.vstack([np.frombuffer(row.encoding, dtype=np.float64) for row in rows]) if rows else None
+    best = {}
+    unmatched_images = []
+    names = sorted(os.listdir(image_dir)) if os.path.isdir(image_dir) else []
+    for name in names:
+        path = os.path.join(image_dir, name)
+        if not os.path.isfile(path):
+            continue
+        try:
+            with open(path, 'rb') as f:
+                img_np = load_rgb(f.read())
+        except (OSError, InvalidImage):
+            unmatched_images.append(name)
+            continue
+        _, old = detect_and_encode(img_np, channels='bgr')
+        if legacy is None or len(old) != 1:
+            unmatched_images.append(name)
+            continue
+        distances = np.sqrt(((legacy - old[0]) ** 2).sum(axis=1))
+        i = int(np.argmin(distances))
+        if distances[i] > max_distance:
+            unmatched_images.append(name)
+            continue
+        if rows[i].id not in best or distances[i] < best[rows[i].id][0]:
+            best[rows[i].id] = (float(distances[i]), img_np)
+
+    updates = []
+    for face_id, (_, img_np) in best.items():
+        _, new = detect_and_encode(img_np, channels='rgb')
+        if len(new) == 1:
+            updates.append({'id': face_id, 'encoding': np.asarray(new[0], dtype=np.float64).tobytes()})
+    updated_ids = {u['id'] for u in updates}
+    unmatched_employees = sorted({row.employee_id for row in rows if row.id not in updated_ids})
+    checkin_query = FaceEncoding.query.filter(FaceEncoding.source == SOURCE_CHECKIN)
+    if dry_run:
+        deleted = checkin_query.count()
+    else:
+        if updates:
+            db.session.bulk_update_mappings(FaceEncoding, updates)
+        deleted = checkin_query.delete(synchronize_session=False)
+        db.session.commit()
+    return {
+        'updated': len(updates),
+        'deleted': deleted,
+        'unmatched_employees': unmatched_employees,
+        'unmatched_images': unmatched_images
+    }
@@ -0,0 +1,218 @@
+import bisect
+import logging
+import threading
+import time
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from config import METRICS_DEBUG_HEADER, METRICS_N_PLUS_ONE_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+# Khoảng chia (giây) cho thời gian xử lý request, thời gian DB và nhận diện khuôn mặt
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Khoảng chia số truy vấn SQL mỗi request
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000, 20000)
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        f'{name}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    """Bộ đếm tăng dần (kiểu ``counter`` của Prometheus)"""
+    type = 'counter'
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram(_Metric):
+    """Phân bố giá trị theo các khoảng ``buckets`` (kiểu ``histogram`` của Prometheus)"""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+        for key, (counts, total, count) in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f'{self.name}_bucket', dict(labels, le=_format_value(bound)), cumulative
+            yield f'{self.name}_bucket', dict(labels, le='+Inf'), count
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, count
+
+
+REQUESTS = Counter('hrms_http_requests_total', 'Số request HTTP đã xử lý', ('endpoint', 'method', 'status'))
+REQUEST_DURATION = Histogram('hrms_http_request_duration_seconds', 'Thời gian xử lý request (giây)',
+                             DURATION_BUCKETS, ('endpoint',))
+REQUEST_QUERIES = Histogram('hrms_http_request_db_queries', 'Số truy vấn SQL mỗi request',
+                            QUERY_COUNT_BUCKETS, ('endpoint',))
+REQUEST_DB_TIME = Histogram('hrms_http_request_db_seconds', 'Tổng thời gian chờ CSDL mỗi request (giây)',
+                            DURATION_BUCKETS, ('endpoint',))
+N_PLUS_ONE = Counter('hrms_n_plus_one_total', 'Số lần phát hiện một câu SQL lặp lại nhiều lần trong một request (N+1)',
+                     ('endpoint',))
+FACE_RECOGNITION = Histogram('hrms_face_recognition_seconds', 'Thời gian từng bước nhận diện khuôn mặt (giây)',
+                             DURATION_BUCKETS, ('step',))
+REGISTRY = (REQUESTS, REQUEST_DURATION, REQUEST_QUERIES, REQUEST_DB_TIME, N_PLUS_ONE, FACE_RECOGNITION)
+
+
+def observe_face_spans(timings):
+    """Ghi thời gian các bước nhận diện (face_locations, face_encodings, recognize)"""
+    for step, seconds in timings.items():
+        FACE_RECOGNITION.observe(seconds, step=step)
+
+
+def render_metrics():
+    """Toàn bộ số liệu dạng text của Prometheus (exposition format 0.0.4)"""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        for name, labels, value in metric.samples():
+            lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def _request_stats():
+    if not has_request_context():
+        return None
+    return g.get('_request_metrics')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    stats = _request_stats()
+    if stats is None:
+        return
+    stats['queries'] += 1
+    stats['db_time'] += elapsed
+    stats['statements'][statement] = stats['statements'].get(statement, 0) + 1
+
+
+def _handle_error(context):
+    starts = context.connection.info.get('query_start') if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def _start_request():
+    g._request_metrics = {'start': time.perf_counter(), 'queries': 0, 'db_time': 0.0, 'statements': {}}
+
+
+def _record(stats, endpoint, method, status):
+    REQUESTS.inc(endpoint=endpoint, method=method, status=status)
+    REQUEST_DURATION.observe(time.perf_counter() - stats['start'], endpoint=endpoint)
+    REQUEST_QUERIES.observe(stats['queries'], endpoint=endpoint)
+    REQUEST_DB_TIME.observe(stats['db_time'], endpoint=endpoint)
+    for statement, count in stats['statements'].items():
+        if count >= METRICS_N_PLUS_ONE_THRESHOLD:
+            N_PLUS_ONE.inc(endpoint=endpoint)
+            sql = ' '.join(statement.split())
+            logger.warning('Cảnh báo N+1: %s chạy %d lần câu SQL: %s', endpoint, count, sql[:200])
+
+
+def _finish_response(response):
+    stats = g.get('_request_metrics')
+    if stats is None:
+        return response
+    stats['responded'] = True
+    if METRICS_DEBUG_HEADER:
+        # Hiện trong tab Network/Timing của DevTools (số liệu tới lúc trả header, chưa gồm phần stream)
+        elapsed = time.perf_counter() - stats['start']
+        response.headers['Server-Timing'] = (
+            f'app;dur={elapsed * 1000:.1f}, '
+            f'db;dur={stats["db_time"] * 1000:.1f};desc="{stats["queries"]} queries"'
+        )
+    # Ghi số liệu khi response đóng để tính cả truy vấn trong generator của stream_with_context (xuất CSV)
+    endpoint, method, status = request.endpoint or 'unknown', request.method, response.status_code
+    response.call_on_close(lambda: _record(stats, endpoint, method, status))
+    return response
+
+
+def _finish_request(exc):
+    # Lỗi không được chuyển thành response (PROPAGATE_EXCEPTIONS): after_request không chạy
+    stats = g.get('_request_metrics')
+    if stats is not None and not stats.get('responded'):
+        stats['responded'] = True
+        _record(stats, request.endpoint or 'unknown', request.method, 500)
+
+
+_listening = False
+
+
+def init_metrics(app):
+    """Gắn đo thời gian request, đếm truy vấn SQL và cảnh báo N+1 vào ứng dụng
+
+    Sự kiện SQLAlchemy được gắn cho mọi Engine (CSDL chính và CSDL báo cáo). Số liệu nằm
+    trong bộ nhớ của từng tiến trình; khi chạy nhiều worker, Prometheus cần scrape từng
+    tiến trình (hoặc gộp theo nhãn instance).
+    """
+    global _listening
+    if not _listening:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+        _listening = True
+    app.before_request(_start_request)
+    app.after_request(_finish_response)
+    app.teardown_request(_finish_request)
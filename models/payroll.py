@@ -1,11 +1,33 @@
-from datetime import datetime, date
+from datetime import datetime, date, time
+from math import ceil
 import calendar
+import numpy as np
+from sqlalchemy.exc import IntegrityError
 from config import db
 from models.employee import Employee
 from models.attendance import Attendance
+from models.attendance_matrix import build_attendance_matrix, MAX_IN_CLAUSE
+from models.reporting import primary_reads
+
+# === Quy định tính lương dùng chung cho mọi màn hình ===
+# Lịch làm việc cố định 08:00 - 18:00
+WORK_START = time(8, 0)
+WORK_END = time(18, 0)
+# Mỗi 20 phút trễ bị phạt 50,000 (làm tròn lên mỗi khoảng 20 phút)
+LATE_BLOCK_MINUTES = 20
+LATE_PENALTY_PER_BLOCK = 50000
+# Ngày Chủ Nhật được tính lương x2
+SUNDAY_MULTIPLIER = 2
+# Tăng ca: lương giờ = lương ngày / 24, hệ số 1.5
+OVERTIME_HOURS_PER_DAY = 24.0
+OVERTIME_MULTIPLIER = 1.5
 
 class Payroll(db.Model):
     __tablename__ = 'PAYROLLS'
+    __table_args__ = (
+        # Một snapshot mỗi nhân viên mỗi tháng (hai lần chốt đồng thời không tạo bản ghi trùng)
+        db.UniqueConstraint('month_year', 'employee_id', name='UQ_PAYROLLS_MONTH_EMP'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(db.Integer, db.ForeignKey('EMPLOYEES.id'))
@@ -17,6 +39,8 @@ class Payroll(db.Model):
     tax = db.Column(db.Float)
     net_salary = db.Column(db.Float)
     generated_at = db.Column(db.DateTime)
+    # '1' khi chấm công của tháng đã chốt bị sửa, cần chốt lại
+    stale = db.Column(db.String(1), default='0')
 
     employee = db.relationship('Employee', backref='payrolls')
 
@@ -42,6 +66,154 @@ def count_standard_workdays(month, year):
     
     return workdays
 
+def compute_late_penalty(checkin_time):
+    """Tính số phút trễ và tiền phạt trễ của một lần check-in
+
+    Args:
+        checkin_time (datetime): Thời điểm check-in
+
+    Returns:
+        tuple: (late_minutes, late_penalty)
+    """
+    work_start = datetime.combine(checkin_time.date(), WORK_START)
+    if checkin_time <= work_start:
+        return 0, 0.0
+    late_minutes = int((checkin_time - work_start).total_seconds() // 60)
+    if late_minutes <= 0:
+        return 0, 0.0
+    return late_minutes, float(ceil(late_minutes / LATE_BLOCK_MINUTES) * LATE_PENALTY_PER_BLOCK)
+
+def compute_overtime_pay(checkout_time, daily_salary):
+    """Tính số phút tăng ca và phụ cấp tăng ca của một lần check-out
+
+    Args:
+        checkout_time (datetime): Thời điểm check-out
+        daily_salary (float): Lương một ngày công của nhân viên
+
+    Returns:
+        tuple: (overtime_minutes, overtime_pay)
+    """
+    work_end = datetime.combine(checkout_time.date(), WORK_END)
+    if checkout_time <= work_end:
+        return 0, 0.0
+    overtime_minutes = int((checkout_time - work_end).total_seconds() // 60)
+    hourly_base = (daily_salary / OVERTIME_HOURS_PER_DAY) if daily_salary else 0.0
+    overtime_pay = overtime_minutes / 60.0 * hourly_base * OVERTIME_MULTIPLIER
+    return overtime_minutes, round(overtime_pay, 2)
+
+def daily_salary_rates(base_salaries, salary_types, standard_workdays):
+    """Lương một ngày công của từng nhân viên
+
+    Nhân viên ``salary_type == 'daily'`` có lương cơ bản là lương ngày,
+    còn lại (monthly) lấy lương cơ bản chia cho số ngày công chuẩn của tháng.
+
+    Args:
+        base_salaries (array): Lương cơ bản
+        salary_types (array): Loại lương ('monthly' / 'daily')
+        standard_workdays (int): Số ngày công chuẩn của tháng
+
+    Returns:
+        numpy.ndarray: Lương ngày (float64)
+    """
+    base = np.nan_to_num(np.asarray(base_salaries, dtype=np.float64))
+    is_daily = np.asarray(salary_types, dtype=object) == 'daily'
+    monthly_rate = base / standard_workdays if standard_workdays else np.zeros_like(base)
+    return np.where(is_daily, base, monthly_rate)
+
+def payroll_from_counts(daily_salary, workdays_normal, workdays_sunday, late_penalties, overtime_pay):
+    """Tính lương từ số ngày công đã tổng hợp (vector hóa)
+
+    Args:
+        daily_salary (array): Lương ngày
+        workdays_normal (array): Số ngày đi làm thường
+        workdays_sunday (array): Số ngày đi làm Chủ Nhật
+        late_penalties (array): Tổng tiền phạt trễ
+        overtime_pay (array): Tổng phụ cấp tăng ca
+
+    Returns:
+        dict: Các mảng 'workdays_normal', 'workdays_sunday', 'daily_salary', 'salary',
+        'overtime', 'deductions', 'gross', 'net'
+    """
+    daily_salary = np.asarray(daily_salary, dtype=np.float64)
+    workdays_normal = np.asarray(workdays_normal, dtype=np.int64)
+    workdays_sunday = np.asarray(workdays_sunday, dtype=np.int64)
+    overtime = np.asarray(overtime_pay, dtype=np.float64)
+    deductions = np.asarray(late_penalties, dtype=np.float64)
+    salary = daily_salary * (workdays_normal + SUNDAY_MULTIPLIER * workdays_sunday)
+    gross = salary + overtime
+    net = np.maximum(gross - deductions, 0.0)
+    return {
+        'workdays_normal': workdays_normal,
+        'workdays_sunday': workdays_sunday,
+        'daily_salary': daily_salary,
+        'salary': salary,
+        'overtime': overtime,
+        'deductions': deductions,
+        'gross': gross,
+        'net': net
+    }
+
+def compute_payroll(base_salaries, salary_types, presence, sunday_mask, standard_workdays,
+                    late_penalties=None, overtime_pay=None):
+    """Tính lương cả tháng cho nhiều nhân viên trong một lượt NumPy
+
+    Công thức: Lương = Lương ngày × (Ngày thường + 2 × Ngày Chủ Nhật) + Tăng ca - Phạt trễ
+
+    Args:
+        base_salaries (array): Lương cơ bản, độ dài N
+        salary_types (array): Loại lương, độ dài N
+        presence (numpy.ndarray): Ma trận bool N × số ngày (có đủ IN/OUT)
+        sunday_mask (numpy.ndarray): Mảng bool đánh dấu ngày Chủ Nhật
+        standard_workdays (int): Số ngày công chuẩn của tháng
+        late_penalties (array, optional): Tổng phạt trễ của từng nhân viên
+        overtime_pay (array, optional): Tổng phụ cấp tăng ca của từng nhân viên
+
+    Returns:
+        dict: Kết quả như ``payroll_from_counts``
+    """
+    presence = np.asarray(presence, dtype=bool)
+    sunday_mask = np.asarray(sunday_mask, dtype=bool)
+    n = presence.shape[0]
+    workdays_sunday = presence[:, sunday_mask].sum(axis=1)
+    workdays_normal = presence.sum(axis=1) - workdays_sunday
+    if late_penalties is None:
+        late_penalties = np.zeros(n)
+    if overtime_pay is None:
+        overtime_pay = np.zeros(n)
+    daily_salary = daily_salary_rates(base_salaries, salary_types, standard_workdays)
+    return payroll_from_counts(daily_salary, workdays_normal, workdays_sunday, late_penalties, overtime_pay)
+
+def compute_month_payroll(month, year, employees=None):
+    """Tính bảng lương cả tháng: 1 truy vấn chấm công + 1 lượt tính vector hóa
+
+    Args:
+        month (int): Tháng
+        year (int): Năm
+        employees (list, optional): Danh sách nhân viên (mặc định: tất cả)
+
+    Returns:
+        tuple: (employees, matrix, result) với ``result`` như ``compute_payroll``
+    """
+    if employees is None:
+        employees = db.session.query(Employee.id, Employee.base_salary, Employee.salary_type).all()
+    matrix = build_attendance_matrix(month, year, [emp.id for emp in employees])
+    result = compute_payroll(
+        [emp.base_salary or 0.0 for emp in employees],
+        [emp.salary_type or 'monthly' for emp in employees],
+        matrix.presence,
+        matrix.sunday_mask,
+        count_standard_workdays(month, year),
+        matrix.late_penalty,
+        matrix.overtime_pay
+    )
+    return employees, matrix, result
+
+def employee_daily_salary(employee, month, year):
+    """Lương một ngày công của một nhân viên trong tháng"""
+    rates = daily_salary_rates([employee.base_salary or 0.0], [employee.salary_type or 'monthly'],
+                               count_standard_workdays(month, year))
+    return float(rates[0])
+
 def count_actual_workdays(employee_id, month, year):
     """Đếm số ngày làm thực tế của nhân viên trong tháng
     (Chỉ tính ngày có đủ check-in và check-out)
@@ -54,38 +226,14 @@ def count_actual_workdays(employee_id, month, year):
     Returns:
         int: Số ngày làm thực tế
     """
-    start_date = datetime(year, month, 1)
-    end_date = datetime(year, month, calendar.monthrange(year, month)[1], 23, 59, 59)
-    
-    # Lấy tất cả ngày có check-in
-    checkin_dates = set()
-    checkins = db.session.query(Attendance).filter(
-        Attendance.employee_id == employee_id,
-        Attendance.timestamp.between(start_date, end_date),
-        Attendance.status == 'IN'
-    ).all()
-    
-    for att in checkins:
-        checkin_dates.add(att.timestamp.date())
-    
-    # Đếm số ngày có cả check-in và check-out
-    actual_workdays = 0
-    for checkin_day in checkin_dates:
-        has_checkout = db.session.query(Attendance).filter(
-            Attendance.employee_id == employee_id,
-            db.func.trunc(Attendance.timestamp) == checkin_day,
-            Attendance.status == 'OUT'
-        ).first() is not None
-        
-        if has_checkout:
-            actual_workdays += 1
-    
-    return actual_workdays
+    from models.payroll_summary import ensure_payroll_summary
+    summary = ensure_payroll_summary(month, year, [employee_id])[employee_id]
+    return int((summary['workdays'] or 0) + (summary['sunday_days'] or 0))
 
 def calculate_salary(month, year):
     """Tính tổng lương của tất cả nhân viên trong tháng
-    
-    Công thức: Lương = (Lương cơ bản / 26) × Số ngày làm thực tế
+
+    Công thức: Lương = Lương ngày × (Ngày thường + 2 × Ngày Chủ Nhật) + Tăng ca - Phạt trễ
 
     Args:
         month (int): Tháng cần tính lương
@@ -94,36 +242,10 @@ def calculate_salary(month, year):
     Returns:
         float: Tổng số tiền lương phải trả
     """
-    total_salary = 0
-    employees = Employee.query.all()
-    num_days = calendar.monthrange(year, month)[1]
-    standard_workdays = count_standard_workdays(month, year)
-    for employee in employees:
-        if not employee.base_salary:
-            continue
-        daily_salary = employee.base_salary / standard_workdays
-        salary = 0
-        for day in range(1, num_days + 1):
-            current_date = date(year, month, day)
-            weekday = current_date.weekday()
-            # Kiểm tra có đi làm ngày này không
-            checkin = db.session.query(Attendance).filter(
-                Attendance.employee_id == employee.id,
-                db.func.trunc(Attendance.timestamp) == current_date,
-                Attendance.status == 'IN'
-            ).first()
-            checkout = db.session.query(Attendance).filter(
-                Attendance.employee_id == employee.id,
-                db.func.trunc(Attendance.timestamp) == current_date,
-                Attendance.status == 'OUT'
-            ).first()
-            if checkin and checkout:
-                if weekday == 6:  # Chủ nhật
-                    salary += daily_salary * 2
-                else:
-                    salary += daily_salary
-        total_salary += salary
-    return total_salary
+    from models.payroll_summary import summary_payroll
+    employees = db.session.query(Employee.id, Employee.base_salary, Employee.salary_type).all()
+    result = summary_payroll(month, year, employees)
+    return float(result['net'].sum())
 
 def calculate_employee_salary(employee_id, month, year):
     """Tính lương của một nhân viên cụ thể trong tháng
@@ -136,8 +258,8 @@ def calculate_employee_salary(employee_id, month, year):
     Returns:
         dict: Thông tin lương gồm số ngày làm việc, lương cơ bản, lương thực nhận, v.v.
     """
-    standard_workdays = 26
-    
+    standard_workdays = count_standard_workdays(month, year)
+
     # Lấy thông tin nhân viên
     employee = Employee.query.get(employee_id)
     if not employee or not employee.base_salary:
@@ -149,18 +271,125 @@ def calculate_employee_salary(employee_id, month, year):
             'salary': 0
         }
 
-    # Tính số ngày làm thực tế
-    actual_workdays = count_actual_workdays(employee_id, month, year)
-    
-    # Tính lương theo công thức: (lương cơ bản / 26) × số ngày làm
-    daily_salary = employee.base_salary / standard_workdays
-    salary = daily_salary * actual_workdays
+    # Đọc một dòng tổng hợp của tháng thay vì quét lại chấm công
+    from models.payroll_summary import employee_summary_payroll
+    result = employee_summary_payroll(employee, month, year)
 
     return {
         'workdays_standard': standard_workdays,
-        'workdays_actual': actual_workdays,
+        'workdays_actual': result['workdays_normal'] + result['workdays_sunday'],
+        'workdays_sunday': result['workdays_sunday'],
         'base_salary': employee.base_salary,
-        'daily_salary': daily_salary,
-        'salary': salary
+        'daily_salary': result['daily_salary'],
+        'overtime': result['overtime'],
+        'deductions': result['deductions'],
+        'salary': result['net']
     }
 
+def month_key(month, year):
+    """Khóa tháng dạng 'YYYY-MM' dùng cho cột ``Payroll.month_year``"""
+    return f'{year:04d}-{month:02d}'
+
+def is_closed_month(month, year):
+    """Tháng đã kết thúc (trước tháng hiện tại) thì được chốt lương"""
+    today = date.today()
+    return (year, month) < (today.year, today.month)
+
+def close_payroll(month, year):
+    """Chốt lương tháng: ghi một bản ghi ``Payroll`` cho mỗi nhân viên (ghi hàng loạt)
+
+    Chỉ chạy khi được yêu cầu rõ ràng (lệnh ``flask close-payroll``), không chạy từ các
+    trang báo cáo. Snapshot cũ của tháng (nếu có) bị thay thế. Dữ liệu chấm công luôn đọc
+    từ CSDL chính. ``base_salary`` lưu lương theo ngày công, ``overtime`` là phụ cấp tăng
+    ca, ``deductions`` là tiền phạt trễ.
+
+    Args:
+        month (int): Tháng cần chốt
+        year (int): Năm cần chốt
+
+    Returns:
+        int: Số bản ghi đã ghi
+
+    Raises:
+        IntegrityError: Tháng đang được chốt đồng thời ở nơi khác (vi phạm UQ_PAYROLLS_MONTH_EMP)
+    """
+    with primary_reads():
+        employees, _, result = compute_month_payroll(month, year)
+    key = month_key(month, year)
+    generated_at = datetime.now()
+    rows = []
+    for i, emp in enumerate(employees):
+        rows.append({
+            'employee_id': emp.id,
+            'month_year': key,
+            'base_salary': float(result['salary'][i]),
+            'allowances': 0.0,
+            'overtime': float(result['overtime'][i]),
+            'deductions': float(result['deductions'][i]),
+            'tax': 0.0,
+            'net_salary': float(result['net'][i]),
+            'generated_at': generated_at,
+            'stale': '0'
+        })
+    try:
+        Payroll.query.filter_by(month_year=key).delete(synchronize_session=False)
+        db.session.bulk_insert_mappings(Payroll, rows)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        raise
+    return len(rows)
+
+def mark_payroll_stale(month, year, employee_id=None):
+    """Đánh dấu snapshot của tháng đã chốt là cũ (không commit, dùng chung transaction của người gọi)
+
+    Args:
+        month (int): Tháng có chấm công bị sửa
+        year (int): Năm
+        employee_id (int | list, optional): Chỉ đánh dấu snapshot của nhân viên này (hoặc danh sách nhân viên)
+    """
+    if not is_closed_month(month, year):
+        return
+    query = Payroll.query.filter_by(month_year=month_key(month, year))
+    if isinstance(employee_id, (list, tuple, set)):
+        employee_ids = list(employee_id)
+        for start in range(0, len(employee_ids), MAX_IN_CLAUSE):
+            query.filter(Payroll.employee_id.in_(employee_ids[start:start + MAX_IN_CLAUSE])).update(
+                {'stale': '1'}, synchronize_session=False
+            )
+        return
+    if employee_id is not None:
+        query = query.filter_by(employee_id=employee_id)
+    query.update({'stale': '1'}, synchronize_session=False)
+
+def get_monthly_totals(months):
+    """Tổng lương thực nhận của nhiều tháng (chỉ đọc, không ghi snapshot)
+
+    Tháng đã chốt đọc từ snapshot ``PAYROLLS``; tháng đang mở, tháng chưa chốt hoặc có
+    snapshot đã cũ được tính trực tiếp từ chấm công.
+
+    Args:
+        months (list): Danh sách (year, month)
+
+    Returns:
+        dict: {(year, month): tổng lương}
+    """
+    keys = {month_key(m, y): (y, m) for y, m in months}
+    snapshots = db.session.query(
+        Payroll.month_year,
+        db.func.sum(Payroll.net_salary),
+        db.func.max(Payroll.stale)
+    ).filter(Payroll.month_year.in_(list(keys))).group_by(Payroll.month_year).all()
+    fresh = {key: total or 0.0 for key, total, stale in snapshots if stale != '1'}
+
+    totals = {}
+    for key, (y, m) in keys.items():
+        if is_closed_month(m, y) and key in fresh:
+            totals[(y, m)] = float(fresh[key])
+        else:
+            totals[(y, m)] = calculate_salary(m, y)
+    return totals
+
+def get_month_total(month, year):
+    """Tổng lương thực nhận của một tháng (xem ``get_monthly_totals``)"""
+    return get_monthly_totals([(year, month)])[(year, month)]
@@ -0,0 +1,85 @@
+import csv
+import io
+import tempfile
+from openpyxl import Workbook
+from config import db
+from models.employee import Employee
+from models.department import Department
+from models.attendance_matrix import MAX_IN_CLAUSE
+from models.payroll import compute_month_payroll
+
+# Số nhân viên tính lương mỗi lượt khi xuất file (bộ nhớ chỉ phụ thuộc kích thước lượt)
+EXPORT_CHUNK_SIZE = MAX_IN_CLAUSE
+# File XLSX nhỏ hơn ngưỡng này nằm hoàn toàn trong RAM, lớn hơn thì chuyển sang file tạm ẩn danh
+XLSX_SPOOL_MAX_SIZE = 16 * 1024 * 1024
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def payroll_header(num_days):
+    return ['Tên nhân viên', 'Phòng ban', 'Chức vụ', 'Lương (VNĐ)'] + [f'Ngày {d}' for d in range(1, num_days + 1)]
+
+
+def iter_payroll_chunks(month, year, chunk_size=EXPORT_CHUNK_SIZE):
+    """Sinh bảng lương theo từng lượt nhân viên (phân trang theo id)
+
+    Mỗi lượt: 1 truy vấn nhân viên + 1 truy vấn chấm công của lượt đó,
+    nên bộ nhớ không tăng theo tổng số nhân viên.
+
+    Yields:
+        list: Các dòng [tên, phòng ban, chức vụ, lương, trạng thái ngày 1..n]
+    """
+    last_id = 0
+    while True:
+        employees = db.session.query(
+            Employee.id,
+            Employee.full_name,
+            Employee.position,
+            Employee.base_salary,
+            Employee.salary_type,
+            Department.name.label('department')
+        ).outerjoin(Department, Employee.department_id == Department.id).filter(
+            Employee.id > last_id
+        ).order_by(Employee.id).limit(chunk_size).all()
+        if not employees:
+            return
+        last_id = employees[-1].id
+        _, matrix, result = compute_month_payroll(month, year, employees)
+        presence = matrix.presence
+        net = result['net'].tolist()
+        yield [
+            [emp.full_name, emp.department or '', emp.position, net[i]]
+            + ['✓' if present else 'X' for present in presence[i].tolist()]
+            for i, emp in enumerate(employees)
+        ]
+
+
+def iter_payroll_csv(month, year, num_days):
+    """Sinh nội dung CSV từng phần (có BOM để Excel đọc đúng tiếng Việt)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(payroll_header(num_days))
+    yield buffer.getvalue()
+    for rows in iter_payroll_chunks(month, year):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+
+def write_payroll_xlsx(month, year, num_days):
+    """Ghi bảng lương ra XLSX bằng workbook write-only (không giữ toàn bộ ô trong RAM)
+
+    Returns:
+        tempfile.SpooledTemporaryFile: Bộ đệm đã ghi xong, con trỏ ở đầu file
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(f'Luong {month:02d}-{year}')
+    sheet.append(payroll_header(num_days))
+    for rows in iter_payroll_chunks(month, year):
+        for row in rows:
+            sheet.append(row)
+    output = tempfile.SpooledTemporaryFile(max_size=XLSX_SPOOL_MAX_SIZE)
+    workbook.save(output)
+    output.seek(0)
+    return output
@@ -0,0 +1,275 @@
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from config import db
+from models.employee import Employee
+from models.attendance import Attendance, day_range
+from models.attendance_matrix import build_attendance_matrix, MAX_IN_CLAUSE
+from models.payroll import month_key, employee_daily_salary, daily_salary_rates, payroll_from_counts, count_standard_workdays
+
+# Sai lệch tiền tối đa bỏ qua khi đối soát (làm tròn số thực)
+RECONCILE_TOLERANCE = 0.01
+# Các cột cộng dồn của bảng tổng hợp
+SUMMARY_FIELDS = ('workdays', 'sunday_days', 'late_penalty', 'overtime_pay')
+
+
+class PayrollSummary(db.Model):
+    """Tổng hợp chấm công theo nhân viên và tháng, cộng dồn theo từng lần chấm công
+
+    ``workdays`` là số ngày thường có đủ IN/OUT, ``sunday_days`` là số ngày Chủ Nhật,
+    ``late_penalty`` / ``overtime_pay`` là tổng phạt trễ và phụ cấp tăng ca của tháng.
+    """
+    __tablename__ = 'PAYROLL_SUMMARY'
+    __table_args__ = (
+        db.UniqueConstraint('employee_id', 'month_year', name='UQ_PAYROLL_SUMMARY_EMP_MONTH'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    employee_id = db.Column(db.Integer, db.ForeignKey('EMPLOYEES.id'), nullable=False)
+    month_year = db.Column(db.String(7), nullable=False)
+    workdays = db.Column(db.Integer, default=0)
+    sunday_days = db.Column(db.Integer, default=0)
+    late_penalty = db.Column(db.Float, default=0.0)
+    overtime_pay = db.Column(db.Float, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.now)
+
+
+def day_contribution(employee_id, day):
+    """Phần đóng góp của một ngày chấm công vào tổng tháng (tính từ bảng ATTENDANCE)
+
+    Returns:
+        dict: workdays, sunday_days, late_penalty, overtime_pay
+    """
+    start, end = day_range(day)
+    rows = db.session.query(Attendance.status, Attendance.late_penalty, Attendance.overtime_pay).filter(
+        Attendance.employee_id == employee_id,
+        Attendance.timestamp >= start,
+        Attendance.timestamp < end
+    ).all()
+    statuses = {status for status, _, _ in rows}
+    present = int('IN' in statuses and 'OUT' in statuses)
+    is_sunday = start.weekday() == 6
+    return {
+        'workdays': 0 if is_sunday else present,
+        'sunday_days': present if is_sunday else 0,
+        'late_penalty': sum(late or 0.0 for _, late, _ in rows),
+        'overtime_pay': sum(overtime or 0.0 for _, _, overtime in rows)
+    }
+
+
+def _month_counts(month, year, employee_ids, session=None):
+    """Tính lại tổng tháng từ dữ liệu chấm công gốc (1 truy vấn cho cả danh sách)"""
+    matrix = build_attendance_matrix(month, year, employee_ids, session)
+    presence = matrix.presence
+    sunday_days = presence[:, matrix.sunday_mask].sum(axis=1)
+    workdays = presence.sum(axis=1) - sunday_days
+    return {
+        emp_id: {
+            'workdays': int(workdays[i]),
+            'sunday_days': int(sunday_days[i]),
+            'late_penalty': float(matrix.late_penalty[i]),
+            'overtime_pay': float(matrix.overtime_pay[i])
+        }
+        for i, emp_id in enumerate(matrix.employee_ids.tolist())
+    }
+
+
+def _all_employee_ids():
+    return [emp_id for emp_id, in db.session.query(Employee.id).all()]
+
+
+def rebuild_payroll_summary(month, year, employee_ids=None):
+    """Tính lại bảng tổng hợp của tháng từ ATTENDANCE (không commit)
+
+    Args:
+        month (int): Tháng
+        year (int): Năm
+        employee_ids (list, optional): Chỉ tính lại cho các nhân viên này (mặc định: tất cả)
+
+    Returns:
+        int: Số dòng tổng hợp đã ghi
+    """
+    key = month_key(month, year)
+    if employee_ids is None:
+        employee_ids = _all_employee_ids()
+        PayrollSummary.query.filter_by(month_year=key).delete(synchronize_session=False)
+    else:
+        employee_ids = list(employee_ids)
+        for start in range(0, len(employee_ids), MAX_IN_CLAUSE):
+            PayrollSummary.query.filter(
+                PayrollSummary.month_year == key,
+                PayrollSummary.employee_id.in_(employee_ids[start:start + MAX_IN_CLAUSE])
+            ).delete(synchronize_session=False)
+    return _insert_summaries(key, _month_counts(month, year, employee_ids))
+
+
+def _insert_summaries(key, counts_by_employee, session=None):
+    now = datetime.now()
+    rows = [
+        dict(counts, employee_id=emp_id, month_year=key, updated_at=now)
+        for emp_id, counts in counts_by_employee.items()
+    ]
+    (session or db.session).bulk_insert_mappings(PayrollSummary, rows)
+    return len(rows)
+
+
+def _backfill_summaries(month, year, employee_ids):
+    """Tính và commit các dòng tổng hợp còn thiếu trong một transaction riêng trên CSDL chính
+
+    Chỉ đọc dữ liệu chấm công đã commit; lần chấm công đang dở ở transaction khác sẽ cộng
+    dồn vào dòng này như bình thường (hoặc tạo dòng trước, khi đó lượt tạo bù bị bỏ qua).
+    """
+    with Session(db.engine) as session:
+        counts = _month_counts(month, year, employee_ids, session)
+        try:
+            _insert_summaries(month_key(month, year), counts, session)
+            session.commit()
+        except IntegrityError:
+            # Request khác vừa tạo các dòng này; lần đọc sau sẽ dùng dòng của request đó
+            session.rollback()
+    return counts
+
+
+def apply_payroll_delta(employee_id, day, workdays=0, sunday_days=0, late_penalty=0.0, overtime_pay=0.0):
+    """Cộng phần thay đổi của một ngày vào tổng tháng (không commit, dùng chung transaction)
+
+    Cập nhật bằng ``SET cột = cột + delta`` nên các lần chấm công đồng thời không ghi đè
+    nhau. Nếu tháng chưa có dòng tổng hợp, dòng đó được tính lại từ ATTENDANCE (đã gồm
+    thay đổi vừa flush) thay vì cộng từ 0.
+
+    Args:
+        employee_id (int): ID nhân viên
+        day (date | datetime): Ngày có chấm công thay đổi
+    """
+    delta = {'workdays': workdays, 'sunday_days': sunday_days,
+             'late_penalty': late_penalty, 'overtime_pay': overtime_pay}
+    if not any(delta.values()):
+        return
+    key = month_key(day.month, day.year)
+    values = {getattr(PayrollSummary, field): getattr(PayrollSummary, field) + change
+              for field, change in delta.items() if change}
+    values[PayrollSummary.updated_at] = datetime.now()
+
+    def increment():
+        return PayrollSummary.query.filter_by(employee_id=employee_id, month_year=key).update(
+            values, synchronize_session=False
+        )
+
+    if increment():
+        return
+    db.session.flush()
+    try:
+        with db.session.begin_nested():
+            rebuild_payroll_summary(day.month, day.year, [employee_id])
+    except IntegrityError:
+        # Request khác vừa tạo dòng tổng hợp (chưa gồm thay đổi này): cộng dồn như bình thường
+        increment()
+
+
+def apply_day_change(employee_id, day, before):
+    """Cộng chênh lệch giữa đóng góp hiện tại của ngày và ``before`` (lấy trước khi sửa)"""
+    db.session.flush()
+    after = day_contribution(employee_id, day)
+    apply_payroll_delta(employee_id, day, **{field: after[field] - before[field] for field in SUMMARY_FIELDS})
+
+
+def ensure_payroll_summary(month, year, employee_ids):
+    """Dòng tổng hợp của các nhân viên trong tháng, tạo bù những dòng còn thiếu
+
+    Dòng tạo bù được tính từ CSDL chính và commit ngay trong transaction riêng
+    (``_backfill_summaries``), không phụ thuộc transaction của người gọi: trang báo cáo
+    rollback sau khi đọc thì lần đọc sau vẫn chỉ đọc bảng tổng hợp, không quét lại ATTENDANCE.
+
+    Returns:
+        dict: {employee_id: dict workdays, sunday_days, late_penalty, overtime_pay}
+    """
+    key = month_key(month, year)
+    employee_ids = list(employee_ids)
+    summaries = {}
+    for start in range(0, len(employee_ids), MAX_IN_CLAUSE):
+        rows = db.session.query(
+            PayrollSummary.employee_id,
+            PayrollSummary.workdays,
+            PayrollSummary.sunday_days,
+            PayrollSummary.late_penalty,
+            PayrollSummary.overtime_pay
+        ).filter(
+            PayrollSummary.month_year == key,
+            PayrollSummary.employee_id.in_(employee_ids[start:start + MAX_IN_CLAUSE])
+        ).all()
+        for emp_id, *counts in rows:
+            summaries[emp_id] = dict(zip(SUMMARY_FIELDS, counts))
+    missing = [emp_id for emp_id in employee_ids if emp_id not in summaries]
+    if missing:
+        summaries.update(_backfill_summaries(month, year, missing))
+    return summaries
+
+
+def summary_payroll(month, year, employees):
+    """Tính lương tháng từ bảng tổng hợp (không quét ATTENDANCE)
+
+    Args:
+        month (int): Tháng
+        year (int): Năm
+        employees (list): Các đối tượng có ``id``, ``base_salary``, ``salary_type``
+
+    Returns:
+        dict: Kết quả như ``payroll_from_counts``
+    """
+    summaries = ensure_payroll_summary(month, year, [emp.id for emp in employees])
+    counts = [summaries[emp.id] for emp in employees]
+    daily_salary = daily_salary_rates(
+        [emp.base_salary or 0.0 for emp in employees],
+        [emp.salary_type or 'monthly' for emp in employees],
+        count_standard_workdays(month, year)
+    )
+    return payroll_from_counts(
+        daily_salary,
+        [c['workdays'] or 0 for c in counts],
+        [c['sunday_days'] or 0 for c in counts],
+        [c['late_penalty'] or 0.0 for c in counts],
+        [c['overtime_pay'] or 0.0 for c in counts]
+    )
+
+
+def employee_summary_payroll(employee, month, year):
+    """Lương tháng của một nhân viên: đọc một dòng tổng hợp, O(1)"""
+    summary = ensure_payroll_summary(month, year, [employee.id])[employee.id]
+    result = payroll_from_counts(
+        [employee_daily_salary(employee, month, year)],
+        [summary['workdays'] or 0],
+        [summary['sunday_days'] or 0],
+        [summary['late_penalty'] or 0.0],
+        [summary['overtime_pay'] or 0.0]
+    )
+    return {name: values[0].item() for name, values in result.items()}
+
+
+def reconcile_payroll_summary(month, year, fix=False):
+    """Đối soát bảng tổng hợp với dữ liệu chấm công gốc
+
+    Args:
+        month (int): Tháng
+        year (int): Năm
+        fix (bool): Ghi lại các dòng bị lệch (hoặc thiếu) từ ATTENDANCE và commit
+
+    Returns:
+        list: Các dòng lệch dạng dict employee_id, field, stored, actual
+    """
+    key = month_key(month, year)
+    actual = _month_counts(month, year, _all_employee_ids())
+    stored = {
+        row.employee_id: row
+        for row in PayrollSummary.query.filter_by(month_year=key).all()
+    }
+    drift = []
+    for emp_id, counts in actual.items():
+        row = stored.get(emp_id)
+        for field in SUMMARY_FIELDS:
+            value = getattr(row, field) if row is not None else None
+            if value is None or abs((value or 0) - counts[field]) > RECONCILE_TOLERANCE:
+                drift.append({'employee_id': emp_id, 'field': field, 'stored': value, 'actual': counts[field]})
+    if fix and drift:
+        rebuild_payroll_summary(month, year, sorted({d['employee_id'] for d in drift}))
+        db.session.commit()
+    return drift
@@ -4,6 +4,9 @@ from models.employee import Employee
 
 class RecentActivity(db.Model):
     __tablename__ = 'RECENT_ACTIVITY'
+    __table_args__ = (
+        db.Index('IX_RECENT_ACTIVITY_TIMESTAMP', 'timestamp'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(db.Integer, db.ForeignKey('EMPLOYEES.id'))
@@ -0,0 +1,60 @@
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import has_request_context, session as flask_session
+from config import db, REPORTING_BIND, LAST_WRITE_KEY, REPORTING_READ_AFTER_WRITE_SECONDS
+
+
+
+def _recent_write():
+    """Người dùng hiện tại vừa ghi dữ liệu (bản sao có thể chưa kịp nhận)"""
+    if not has_request_context():
+        return False
+    last_write = flask_session.get(LAST_WRITE_KEY)
+    return last_write is not None and time.time() - last_write < REPORTING_READ_AFTER_WRITE_SECONDS
+
+
+@contextmanager
+def reporting_reads():
+    """Các truy vấn đọc trong khối được gửi tới CSDL báo cáo
+
+    Không có gì thay đổi (đọc từ CSDL chính) khi chưa cấu hình ``REPORTING_DATABASE_URL``,
+    hoặc khi người dùng vừa ghi dữ liệu trong ``REPORTING_READ_AFTER_WRITE_SECONDS`` giây
+    (ví dụ sửa bảng công rồi quay lại trang bảng lương).
+    """
+    session = db.session()
+    if session.info.get('reporting') or REPORTING_BIND not in db.engines or _recent_write():
+        yield
+        return
+    session.info['reporting'] = True
+    try:
+        yield
+    finally:
+        session.info.pop('reporting', None)
+        if not session.in_transaction():
+            session.info.pop('wrote', None)
+
+
+@contextmanager
+def primary_reads():
+    """Các truy vấn đọc trong khối luôn đi vào CSDL chính, kể cả khi đang trong ``reporting_reads``
+
+    Dùng cho mọi câu đọc mà kết quả được ghi lại (chốt lương, tạo bù dòng tổng hợp).
+    """
+    session = db.session()
+    session.info['primary'] = session.info.get('primary', 0) + 1
+    try:
+        yield
+    finally:
+        session.info['primary'] -= 1
+        if not session.info['primary']:
+            del session.info['primary']
+
+
+def reporting_view(f):
+    """Decorator cho các trang báo cáo: chạy cả view (kể cả render template) trong ``reporting_reads``"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        with reporting_reads():
+            return f(*args, **kwargs)
+    return decorated_function
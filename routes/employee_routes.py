@@ -1,18 +1,29 @@
 from models.recent_activity import RecentActivity
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session
-from config import db
-from models.employee import Employee
-from models.attendance import Attendance
-from models.face_encoding import FaceEncoding
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session, current_app, send_file, abort
+from config import db, ATTENDANCE_HISTORY_PAGE_SIZE, EMPLOYEES_PAGE_SIZE, EDGE_CHECKIN, IMPORT_WEB_MAX_ROWS, FACE_ENROLL_MAX_PHOTOS
+from models.employee import Employee, name_search_filter, employee_directory_query, EMPLOYEE_SORTS
+from models.department import Department, department_id_for
+from models.attendance import Attendance, day_range, month_range, keyset_page
+from models.face_encoding import FaceEncoding, SOURCE_ENROLL, face_encoding_version, load_face_payload, current_face_ids, add_checkin_sample
+from camera.face_index import face_index
+from camera.preprocess import decode_data_url, load_rgb, image_extension, save_original, InvalidImage
+from camera.image_store import attendance_image_store, is_archived, thumbnail_path
+from camera.recognition_pool import recognition_pool, RecognitionBusy, RecognitionTimeout
+from models.payroll import Payroll, mark_payroll_stale
+from models.dashboard_stats import invalidate_employee_stats, invalidate_attendance_stats
+from models.employee_import import read_import_file, import_employees, report_to_csv, ImportFileError
+from models.payroll_summary import PayrollSummary, apply_day_change, day_contribution
+from models.checkin import record_check, CHECK_IN, CHECK_OUT, REJECTED
+from models.checkin_journal import checkin_journal, checkin_syncer
 from datetime import datetime
 import os
-import base64
 import io
+import json
+import mimetypes
 import numpy as np
-from PIL import Image
-import face_recognition
 from werkzeug.utils import secure_filename
-import cv2
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 from functools import wraps
 
 employee_bp = Blueprint('employee', __name__)
@@ -25,23 +36,53 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Cache payload đầy đủ theo phiên bản dữ liệu: {format: (etag, body)}
+_face_payload_cache = {}
+
 # API trả về encoding và tên nhân viên cho nhận diện realtime
+# ?format=f32  : encoding dạng base64 float32 thay vì danh sách số JSON
+# ?since=<ISO> : chỉ trả các khuôn mặt thay đổi từ thời điểm đó (kèm face_ids để xóa khuôn mặt cũ)
 @employee_bp.route('/api/face-encodings', methods=['GET'])
 def api_face_encodings():
-    # Lấy tất cả encoding và tên nhân viên
-    faces = FaceEncoding.query.all()
-    data = []
-    for face in faces:
-        emp = Employee.query.get(face.employee_id)
-        if emp:
-            data.append({
-                'employee_id': emp.id,
-                'name': emp.full_name,
-                'department': emp.department.name if emp.department else '',
-                'position': emp.position,
-                'encoding': list(np.frombuffer(face.encoding, dtype=np.float64))
-            })
-    return jsonify(data)
+    fmt = request.args.get('format', 'json')
+    since = None
+    if request.args.get('since'):
+        try:
+            since = datetime.fromisoformat(request.args['since'])
+        except ValueError:
+            since = None
+    etag, last_modified = face_encoding_version()
+    # Client đã có dữ liệu mới nhất -> 304, không cần truy vấn encoding
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    cached = _face_payload_cache.get(fmt)
+    if since is None and cached and cached[0] == etag:
+        body = cached[1]
+    else:
+        faces = load_face_payload(since=since, binary=(fmt == 'f32'))
+        if fmt == 'json' and since is None:
+            # Định dạng cũ: danh sách khuôn mặt
+            payload = faces
+        else:
+            payload = {
+                'version': etag,
+                'last_modified': last_modified.isoformat() if last_modified else None,
+                'full': since is None,
+                'faces': faces,
+                'face_ids': current_face_ids() if since is not None else [f['face_id'] for f in faces]
+            }
+        body = json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+        if since is None:
+            _face_payload_cache[fmt] = (etag, body)
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
     # Sửa nhân viên
     # Xóa nhân viên
     # Route lịch sử chấm công
@@ -63,20 +104,20 @@ def edit_employee(emp_id):
         salary = float(request.form.get('salary', 0))
     except:
         salary = 0.0
+    # Ảnh đăng ký bổ sung (ví dụ ảnh chụp ở điều kiện ánh sáng khác)
+    encodings, skipped = [], 0
+    try:
+        photos = _enrollment_photos(request.files.getlist('images'))
+        encodings, skipped = _encode_enrollment_photos(photos)
+    except (RecognitionBusy, RecognitionTimeout):
+        flash("Hệ thống nhận diện đang bận, ảnh bổ sung chưa được lưu!", "warning")
     emp.full_name = name
     emp.position = pos
     emp.base_salary = salary
-    # Cập nhật phòng ban
-    department_obj = None
-    if dept:
-        from models.department import Department
-        department_obj = Department.query.filter_by(name=dept).first()
-        if not department_obj:
-            department_obj = Department(name=dept)
-            db.session.add(department_obj)
-            db.session.commit()
-    emp.department_id = department_obj.id if department_obj else None
-    db.session.commit()
+    emp.updated_at = datetime.now()
+    # Cập nhật phòng ban (tạo mới nếu chưa có, cùng transaction với nhân viên)
+    emp.department_id = department_id_for(dept)
+    face_ids = _add_enrollment_encodings(emp, encodings) if encodings else []
     # Ghi nhận hoạt động cập nhật lương
     activity = RecentActivity(
         employee_id=emp.id,
@@ -86,6 +127,10 @@ def edit_employee(emp_id):
     )
     db.session.add(activity)
     db.session.commit()
+    face_index.add_many(face_ids, [emp_id] * len(face_ids), encodings)
+    invalidate_employee_stats()
+    if skipped:
+        flash(f'Bỏ qua {skipped} ảnh không nhận diện được khuôn mặt', 'warning')
     flash('Đã cập nhật thông tin nhân viên!', 'success')
     return redirect(url_for('employee.list_employees'))
 
@@ -100,8 +145,13 @@ def delete_employee(emp_id):
     Attendance.query.filter_by(employee_id=emp.id).delete()
     # Xóa tất cả bản ghi FaceEncoding liên quan
     FaceEncoding.query.filter_by(employee_id=emp.id).delete()
+    # Xóa snapshot lương đã chốt và bảng tổng hợp
+    Payroll.query.filter_by(employee_id=emp.id).delete()
+    PayrollSummary.query.filter_by(employee_id=emp.id).delete()
     db.session.delete(emp)
     db.session.commit()
+    face_index.remove_employee(emp_id)
+    invalidate_employee_stats()
     flash('Đã xóa nhân viên!', 'success')
     return redirect(url_for('employee.list_employees'))
 
@@ -112,34 +162,62 @@ def attendance_history():
     search = request.args.get('search', '').strip()
     date_str = request.args.get('date', '').strip()
     month_str = request.args.get('month', '').strip()
-    query = Attendance.query.join(Employee)
+    query = Attendance.query.options(
+        joinedload(Attendance.employee).joinedload(Employee.department)
+    )
     if search:
-        query = query.filter(Employee.full_name.ilike(f'%{search}%'))
+        # Tìm theo đầu tên hoặc đầu từ, không dấu ('nguyen v' / 'dat' khớp 'Nguyễn Văn Đạt')
+        query = query.filter(Attendance.employee_id.in_(
+            db.select(Employee.id).where(name_search_filter(search))
+        ))
     if month_str:
         try:
-            from datetime import datetime
             year, month = map(int, month_str.split('-'))
-            start = datetime(year, month, 1)
-            if month == 12:
-                end = datetime(year + 1, 1, 1)
-            else:
-                end = datetime(year, month + 1, 1)
+            start, end = month_range(month, year)
             query = query.filter(Attendance.timestamp >= start, Attendance.timestamp < end)
         except:
             pass
     elif date_str:
         try:
-            from datetime import datetime, timedelta
-            date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-            start = datetime.combine(date_obj.date(), datetime.min.time())
-            end = datetime.combine(date_obj.date(), datetime.max.time())
-            query = query.filter(Attendance.timestamp.between(start, end))
+            start, end = day_range(datetime.strptime(date_str, '%Y-%m-%d'))
+            query = query.filter(Attendance.timestamp >= start, Attendance.timestamp < end)
         except:
             pass
-    attendances = query.order_by(Attendance.timestamp.desc()).limit(100).all()
-    return render_template('attendance_history.html', attendances=attendances, search=search)
+    attendances, next_cursor, prev_cursor = keyset_page(
+        query,
+        ATTENDANCE_HISTORY_PAGE_SIZE,
+        after=request.args.get('after'),
+        before=request.args.get('before')
+    )
+    filters = {key: value for key, value in (('search', search), ('month', month_str), ('date', date_str)) if value}
+    return render_template('attendance_history.html', attendances=attendances, search=search,
+                           filters=filters, next_cursor=next_cursor, prev_cursor=prev_cursor)
 
 # === Route chỉnh sửa chấm công (admin) ===
+@employee_bp.app_template_filter('attendance_thumb')
+def attendance_thumb(image):
+    """URL ảnh hiển thị trong lịch sử: ảnh thu nhỏ nếu có, ảnh gốc nếu chưa tạo"""
+    if is_archived(image):
+        return None
+    thumb = thumbnail_path(image)
+    return '/' + (thumb if os.path.exists(thumb) else image)
+
+
+@employee_bp.route('/attendance/image/<int:att_id>')
+@admin_required
+def attendance_image(att_id):
+    """Ảnh chấm công gốc, kể cả ảnh đã được gom vào file lưu trữ theo tháng"""
+    att = Attendance.query.get_or_404(att_id)
+    if not att.image:
+        abort(404)
+    try:
+        data = attendance_image_store.read(att.image)
+    except (OSError, KeyError):
+        abort(404)
+    mimetype = mimetypes.guess_type(att.image.rsplit('#', 1)[-1])[0] or 'image/jpeg'
+    return send_file(io.BytesIO(data), mimetype=mimetype, max_age=86400)
+
+
 @employee_bp.route('/attendance/edit/<int:att_id>', methods=['GET', 'POST'])
 def edit_attendance(att_id):
     att = Attendance.query.get(att_id)
@@ -152,6 +230,9 @@ def edit_attendance(att_id):
         if not session.get('is_admin'):
             flash('Bạn không có quyền chỉnh sửa!', 'danger')
             return redirect(url_for('employee.attendance_history'))
+        old_timestamp = att.timestamp
+        # Đóng góp vào tổng lương của các ngày bị ảnh hưởng, lấy trước khi sửa
+        before = {old_timestamp.date(): day_contribution(att.employee_id, old_timestamp)} if old_timestamp else {}
         # Cập nhật các trường
         try:
             att.timestamp = datetime.strptime(request.form.get('timestamp'), '%Y-%m-%d %H:%M:%S')
@@ -164,11 +245,39 @@ def edit_attendance(att_id):
         att.overtime_pay = float(request.form.get('overtime_pay', att.overtime_pay or 0))
         att.image = request.form.get('image', att.image)
         att.reason = request.form.get('reason', getattr(att, 'reason', ''))
-        db.session.commit()
+        # Sửa chấm công của tháng đã chốt -> snapshot lương cần chốt lại
+        if att.timestamp and att.timestamp.date() not in before:
+            # Ngày mới chưa có trong ``before``: đọc từ DB (bản ghi đang sửa chưa được flush)
+            with db.session.no_autoflush:
+                before[att.timestamp.date()] = day_contribution(att.employee_id, att.timestamp)
+        employee_id, status, day = att.employee_id, att.status, att.timestamp
+        try:
+            for ts in {old_timestamp, att.timestamp}:
+                if ts:
+                    mark_payroll_stale(ts.month, ts.year, employee_id)
+            for day_key, contribution in before.items():
+                apply_day_change(employee_id, day_key, contribution)
+            db.session.commit()
+        except IntegrityError:
+            # Vi phạm UQ_ATTENDANCE_EMP_DAY_SEQ: ngày mới đã có bản ghi cùng loại
+            db.session.rollback()
+            flash(f'Nhân viên #{employee_id} đã có bản ghi {status} ngày {day:%d/%m/%Y}!', 'danger')
+            return redirect(url_for('employee.edit_attendance', att_id=att_id))
+        for ts in {old_timestamp, att.timestamp}:
+            if ts:
+                invalidate_attendance_stats(ts)
         flash('Đã cập nhật bản ghi chấm công!', 'success')
         return redirect(url_for('employee.attendance_history'))
     return render_template('edit_attendance.html', att=att)
 
+def _publish_checkin_sample(employee_id, sample_id, encoding, evicted):
+    """Cập nhật chỉ mục khuôn mặt trong bộ nhớ sau khi mẫu chấm công đã được commit (file ghi ở luồng nền)"""
+    if sample_id:
+        face_index.replace_faces(evicted or [], [sample_id], [employee_id], [encoding])
+    elif evicted:
+        face_index.remove_faces(evicted)
+
+
 # === Trang chấm công bằng camera ===
 @employee_bp.route('/attendance/camera', methods=['GET', 'POST'])
 @admin_required
@@ -178,175 +287,220 @@ def attendance_camera():
         if not image_base64:
             flash("Không nhận được ảnh từ camera!", "danger")
             return redirect(url_for('employee.attendance_camera'))
-        # ...existing code...
-        # Sau khi nhận diện khuôn mặt, xác định employee
-        # Giả sử có biến employee_id hoặc employee đã xác định ở đoạn nhận diện
-        # Ví dụ: employee = Employee.query.get(employee_id)
-        # Nếu chưa có, cần lấy employee từ kết quả nhận diện
-        # ...
-        # Nếu đã xác định employee:
-        if 'employee' in locals() and employee:
-            activity = RecentActivity(
-                employee_id=employee.id,
-                action='Check-in',
-                detail=f'Chấm công thành công lúc {datetime.now().strftime("%H:%M %d/%m/%Y")}',
-                timestamp=datetime.now()
-            )
-            db.session.add(activity)
-            db.session.commit()
-        header, encoded = image_base64.split(',', 1)
-        img_bytes = base64.b64decode(encoded)
-        pil_img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
-        img_np = np.array(pil_img, dtype=np.uint8)
-        # Resize nếu quá lớn
-        max_width = 640
-        # ...existing code...
-        if img_np.shape[1] > max_width:
-            scale = max_width / img_np.shape[1]
-            new_size = (int(img_np.shape[1] * scale), int(img_np.shape[0] * scale))
-            img_np = cv2.resize(img_np, new_size, interpolation=cv2.INTER_AREA)
-        # Đảm bảo đúng kiểu
-        if img_np.ndim == 2:
-            img_np = cv2.cvtColor(img_np, cv2.COLOR_GRAY2RGB)
-        elif img_np.shape[2] == 4:
-            img_np = cv2.cvtColor(img_np, cv2.COLOR_RGBA2RGB)
-        else:
-            img_np = cv2.cvtColor(img_np, cv2.COLOR_BGR2RGB)
-        img_np = np.ascontiguousarray(img_np, dtype=np.uint8)
-        # Nhận diện khuôn mặt
-        # ...existing code...
-        face_locations = face_recognition.face_locations(img_np, model='hog')
+        # Giải mã thu nhỏ ngay khi đọc JPEG, ra mảng RGB liền mạch cho dlib
+        try:
+            img_bytes = decode_data_url(image_base64)
+            img_np = load_rgb(img_bytes)
+        except InvalidImage:
+            flash("Ảnh từ camera không hợp lệ!", "danger")
+            return redirect(url_for('employee.attendance_camera'))
+        # Nhận diện khuôn mặt trên pool tiến trình (không giữ luồng request bằng việc tính toán CPU)
+        try:
+            face_locations, encodings = recognition_pool.recognize(img_np)
+        except (RecognitionBusy, RecognitionTimeout):
+            flash("Hệ thống nhận diện đang bận, vui lòng thử lại sau giây lát!", "warning")
+            response = current_app.make_response((render_template('attendance_camera.html'), 503))
+            response.headers['Retry-After'] = '2'
+            return response
         if len(face_locations) == 0:
             flash("Không phát hiện được khuôn mặt!", "warning")
             return redirect(url_for('employee.list_employees'))
-        encodings = face_recognition.face_encodings(img_np, face_locations)
         if not encodings:
             flash("Không thể mã hóa khuôn mặt!", "danger")
             return redirect(url_for('employee.list_employees'))
-        # So sánh với DB
-        known_faces = FaceEncoding.query.all()
-        matched_emp_id = None
-        for face in known_faces:
-            known_encoding = np.frombuffer(face.encoding, dtype=np.float64)
-            matches = face_recognition.compare_faces([known_encoding], encodings[0], tolerance=0.5)
-            if matches[0]:
-                matched_emp_id = face.employee_id
-                break
+        # So sánh với chỉ mục encoding trong bộ nhớ, lấy người gần nhất
+        matched_emp_id, distance = face_index.match(encodings[0])
         if matched_emp_id:
-            # Chỉ lưu ảnh nếu điểm danh thành công
-            save_dir = os.path.join('static', 'attendance_images')
-            os.makedirs(save_dir, exist_ok=True)
-            filename = f"attendance_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-            image_path = os.path.join(save_dir, filename)
-            pil_img.save(image_path, format='JPEG')
-            rel_path = image_path.replace('\\', '/').replace('\\', '/')
-            emp = Employee.query.filter_by(id=matched_emp_id).first()
+            # Chỉ lưu ảnh nếu điểm danh thành công: tên theo hash nội dung, ghi ở luồng nền
+            rel_path = attendance_image_store.put(img_bytes, image_extension(img_bytes))
+            # Chỉ các cột cần cho tính lương/thông báo, không nạp cả đối tượng Employee
+            emp = db.session.query(
+                Employee.id, Employee.full_name, Employee.base_salary, Employee.salary_type
+            ).filter(Employee.id == matched_emp_id).first()
             if emp:
-                from datetime import time
-                today = datetime.now().date()
-                # Lấy tất cả bản ghi chấm công hôm nay của nhân viên
-                today_att = Attendance.query.filter(
-                    Attendance.employee_id == emp.id,
-                    Attendance.timestamp >= datetime.combine(today, time.min),
-                    Attendance.timestamp <= datetime.combine(today, time.max)
-                ).order_by(Attendance.timestamp).all()
-                if len(today_att) == 0:
-                    # Lần đầu: IN
-                    # Tính trễ: lịch làm việc cố định 08:00 - 18:00
-                    from math import ceil
-                    work_start = time(8, 0)
-                    now_dt = datetime.now()
-                    late_minutes = 0
-                    late_penalty = 0.0
-                    if now_dt.time() > work_start:
-                        delta = datetime.combine(now_dt.date(), now_dt.time()) - datetime.combine(now_dt.date(), work_start)
-                        late_minutes = int(delta.total_seconds() // 60)
-                        # Mỗi 20 phút trễ bị phạt 50,000 (làm tròn lên mỗi khoảng 20 phút)
-                        if late_minutes > 0:
-                            intervals = ceil(late_minutes / 20)
-                            late_penalty = intervals * 50000
-
-                    att = Attendance(
-                        employee_id=emp.id,
-                        timestamp=now_dt,
-                        status="IN",
-                        image=rel_path,
-                        late_minutes=late_minutes,
-                        late_penalty=late_penalty
-                    )
-                    db.session.add(att)
-                    db.session.commit()
-                    # Ghi nhận hoạt động chấm công thành công
-                    activity = RecentActivity(
-                        employee_id=emp.id,
-                        action='Check-in',
-                        detail=f'Chấm công thành công lúc {now_dt.strftime("%H:%M %d/%m/%Y")}',
-                        timestamp=now_dt
-                    )
-                    db.session.add(activity)
-                    db.session.commit()
-                    if late_minutes > 0:
-                        flash(f"✅ Chấm công (IN) cho {emp.full_name} — Trễ {late_minutes} phút, phạt {late_penalty:,.0f} VND", "warning")
+                # Một transaction: chấm công + tổng lương tháng + hoạt động + mẫu khuôn mặt
+                now_dt = datetime.now()
+                result, att = record_check(emp, image=rel_path, now=now_dt)
+                if result is REJECTED:
+                    db.session.rollback()
+                    flash(f"❌ Mỗi ngày chỉ được chấm công 2 lần (IN/OUT)!", "warning")
+                else:
+                    # Đọc trước khi commit (sau commit các thuộc tính bị expire -> thêm một truy vấn)
+                    if result == CHECK_IN and att.late_minutes > 0:
+                        message = (f"✅ Chấm công (IN) cho {emp.full_name} — Trễ {att.late_minutes} phút, phạt {att.late_penalty:,.0f} VND", "warning")
+                    elif result == CHECK_OUT and att.overtime_minutes > 0:
+                        message = (f"✅ Chấm công (OUT) cho {emp.full_name} — Tăng ca {att.overtime_minutes} phút, phụ cấp {att.overtime_pay:,.0f} VND", "success")
                     else:
-                        flash(f"✅ Chấm công (IN) thành công cho {emp.full_name}", "success")
-                elif len(today_att) == 1:
-                    # Lần 2: OUT
-                    now_dt = datetime.now()
-                    work_end = time(18, 0)
-                    overtime_minutes = 0
-                    overtime_pay = 0.0
-
-                    if now_dt.time() > work_end:
-                        delta = datetime.combine(now_dt.date(), now_dt.time()) - datetime.combine(now_dt.date(), work_end)
-                        overtime_minutes = int(delta.total_seconds() // 60)
-
-                        # Tính lương cơ bản theo ngày -> mặc định lấy từ salary_type
-                        def compute_daily_salary(emp_obj):
-                            # Giả định: nếu salary_type == 'monthly' thì base_salary là lương tháng, chia 30 để ra ngày
-                            try:
-                                st = getattr(emp_obj, 'salary_type', 'monthly') or 'monthly'
-                            except:
-                                st = 'monthly'
-                            if st == 'daily':
-                                return emp_obj.base_salary or 0.0
-                            # mặc định monthly
-                            return (emp_obj.base_salary or 0.0) / 30.0
-
-                        daily_salary = compute_daily_salary(emp)
-                        hourly_base = (daily_salary / 24.0) if daily_salary else 0.0
-                        overtime_hours = overtime_minutes / 60.0
-                        overtime_pay = overtime_hours * hourly_base * 1.5
-
-                    att = Attendance(
-                        employee_id=emp.id,
-                        timestamp=now_dt,
-                        status="OUT",
-                        image=rel_path,
-                        overtime_minutes=overtime_minutes,
-                        overtime_pay=round(overtime_pay, 2)
-                    )
-                    db.session.add(att)
+                        message = (f"✅ Chấm công ({result}) thành công cho {emp.full_name}", "success")
+                    sample, evicted = add_checkin_sample(emp.id, encodings[0], distance)
+                    sample_id = sample.id if sample else None
                     db.session.commit()
-                    if overtime_minutes > 0:
-                        flash(f"✅ Chấm công (OUT) cho {emp.full_name} — Tăng ca {overtime_minutes} phút, phụ cấp {overtime_pay:,.0f} VND", "success")
-                    else:
-                        flash(f"✅ Chấm công (OUT) thành công cho {emp.full_name}", "success")
-                else:
-                    flash(f"❌ Mỗi ngày chỉ được chấm công 2 lần (IN/OUT)!", "warning")
+                    _publish_checkin_sample(emp.id, sample_id, encodings[0], evicted)
+                    invalidate_attendance_stats(now_dt)
+                    flash(*message)
             else:
                 flash("Không tìm thấy nhân viên tương ứng!", "danger")
         else:
             flash("Không nhận diện được khuôn mặt!", "warning")
         return redirect(url_for('employee.list_employees'))
-    return render_template('attendance_camera.html')
+    return render_template('attendance_camera.html', edge_mode=EDGE_CHECKIN)
+
+
+# === Chấm công chế độ edge: kiosk đã nhận diện ở trình duyệt ===
+# Sự kiện được ghi vào nhật ký cục bộ và trả lời ngay; luồng nền đồng bộ vào CSDL trung tâm.
+# Kiosk gửi lại cùng ``event_key`` khi lỗi mạng, server chỉ ghi nhận một lần.
+@employee_bp.route('/api/checkins', methods=['POST'])
+@admin_required
+def api_checkin():
+    if not EDGE_CHECKIN:
+        abort(404)
+    data = request.get_json(silent=True) or request.form
+    event_key = str(data.get('event_key') or '').strip()
+    if not event_key or len(event_key) > 64:
+        return jsonify({'error': 'Thiếu hoặc sai event_key'}), 400
+    try:
+        employee_id = int(data.get('employee_id'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Thiếu hoặc sai employee_id'}), 400
+    image = None
+    if data.get('image_base64'):
+        try:
+            img_bytes = decode_data_url(data['image_base64'])
+        except InvalidImage:
+            return jsonify({'error': 'Ảnh từ camera không hợp lệ'}), 400
+        image = attendance_image_store.put(img_bytes, image_extension(img_bytes))
+    created = checkin_journal.append(event_key, employee_id, datetime.now(), image)
+    checkin_syncer.ensure_running()
+    checkin_syncer.notify()
+    return jsonify(checkin_journal.get(event_key)), 202 if created else 200
+
+
+@employee_bp.route('/api/checkins/<event_key>', methods=['GET'])
+@admin_required
+def api_checkin_status(event_key):
+    """Trạng thái đồng bộ của một sự kiện (pending / synced kèm kết quả IN, OUT, REJECTED)"""
+    if not EDGE_CHECKIN:
+        abort(404)
+    event = checkin_journal.get(event_key)
+    if event is None:
+        abort(404)
+    return jsonify(event)
 
 
 # === Trang danh sách nhân viên ===
 @employee_bp.route('/employees')
 @admin_required
 def list_employees():
-    employees = Employee.query.all()
-    return render_template('employees.html', employees=employees, now=datetime.now)
+    """Danh sách nhân viên phân trang, lọc theo phòng ban/chức vụ/trạng thái
+
+    ``?format=json`` trả một trang dạng JSON để trang danh sách tải thêm khi cuộn.
+    """
+    filters = {
+        'search': request.args.get('search', '').strip(),
+        'department_id': request.args.get('department_id', type=int),
+        'position': request.args.get('position', '').strip(),
+        'active': request.args.get('active', '').strip(),
+        'sort': request.args.get('sort', 'name'),
+        'desc': request.args.get('desc') == '1'
+    }
+    if filters['sort'] not in EMPLOYEE_SORTS:
+        filters['sort'] = 'name'
+    page = employee_directory_query(**filters).paginate(
+        page=request.args.get('page', 1, type=int),
+        per_page=EMPLOYEES_PAGE_SIZE,
+        error_out=False
+    )
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'employees': [{
+                'id': e.id,
+                'full_name': e.full_name,
+                'department': e.department.name if e.department else None,
+                'position': e.position,
+                'base_salary': e.base_salary,
+                'hire_date': e.hire_date.isoformat() if e.hire_date else None,
+                'active': e.active
+            } for e in page.items],
+            'page': page.page,
+            'pages': page.pages,
+            'total': page.total,
+            'next_page': page.next_num
+        })
+    # Tham số lọc giữ lại trên link phân trang (bỏ giá trị rỗng)
+    query_args = {
+        key: ('1' if value is True else value)
+        for key, value in filters.items() if value not in ('', None, False)
+    }
+    departments = Department.query.order_by(Department.name).all()
+    positions = [pos for pos, in db.session.query(Employee.position).filter(
+        Employee.position.isnot(None)
+    ).distinct().order_by(Employee.position).all()]
+    return render_template('employees.html', employees=page.items, page=page, filters=filters,
+                           query_args=query_args, departments=departments, positions=positions,
+                           now=datetime.now)
+
+
+def _enrollment_photos(files, image_base64=None):
+    """Ảnh đăng ký gửi lên (chụp từ camera và/hoặc nhiều file upload)
+
+    Returns:
+        list: Các bộ (img_bytes, filename), tối đa ``FACE_ENROLL_MAX_PHOTOS`` ảnh
+
+    Raises:
+        InvalidImage: Ảnh base64 không hợp lệ
+    """
+    photos = []
+    stamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    if image_base64:
+        img_bytes = decode_data_url(image_base64)
+        photos.append((img_bytes, f"camera_{stamp}{image_extension(img_bytes)}"))
+    for image_file in files:
+        if image_file and image_file.filename:
+            img_bytes = image_file.read()
+            name_root, _ = os.path.splitext(secure_filename(image_file.filename))
+            photos.append((img_bytes, f"{name_root or stamp}{image_extension(img_bytes)}"))
+    return photos[:FACE_ENROLL_MAX_PHOTOS]
+
+
+def _encode_enrollment_photos(photos):
+    """Mã hóa khuôn mặt từng ảnh đăng ký, bỏ qua ảnh không đọc được hoặc không có khuôn mặt
+
+    Returns:
+        tuple: (danh sách encoding float64, số ảnh bị bỏ qua)
+
+    Raises:
+        RecognitionBusy, RecognitionTimeout: Pool nhận diện đang quá tải
+    """
+    encodings = []
+    skipped = 0
+    for img_bytes, _ in photos:
+        try:
+            img_np = load_rgb(img_bytes)
+        except InvalidImage:
+            skipped += 1
+            continue
+        face_locations, found = recognition_pool.recognize(img_np)
+        if not face_locations or not found:
+            skipped += 1
+            continue
+        encodings.append(np.array(found[0], dtype=np.float64))
+    return encodings, skipped
+
+
+def _add_enrollment_encodings(emp, encodings):
+    """Thêm các encoding ảnh đăng ký cho nhân viên (không commit)
+
+    Returns:
+        list: id các encoding mới (đã flush)
+    """
+    now = datetime.now()
+    faces = [
+        FaceEncoding(employee=emp, encoding=encoding.tobytes(), source=SOURCE_ENROLL, created_at=now)
+        for encoding in encodings
+    ]
+    db.session.add_all(faces)
+    db.session.flush()
+    return [face.id for face in faces]
 
 
 # === Thêm nhân viên (ảnh upload hoặc camera) ===
@@ -360,113 +514,51 @@ def add_employee():
     except:
         salary = 0.0
 
-    image_file = request.files.get('image')
-    image_base64 = request.form.get('image_base64')
-
     save_dir = os.path.join('static', 'employee_images')
-    os.makedirs(save_dir, exist_ok=True)
-    image_path = None
-    encodings = None
 
     try:
-        # === 1️⃣ Lấy ảnh từ camera hoặc upload ===
-        if image_base64:
-            header, encoded = image_base64.split(',', 1)
-            img_bytes = base64.b64decode(encoded)
-            filename = f"camera_{datetime.now().strftime('%Y%m%d%H%M%S')}.jpg"
-            image_path = os.path.join(save_dir, filename)
-
-            pil_img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
-            pil_img.save(image_path, format='JPEG')
-            img_np = np.array(pil_img, dtype=np.uint8)
-            print("DEBUG base64 image:", img_np.shape, img_np.dtype)
-
-        elif image_file and image_file.filename:
-            filename = secure_filename(image_file.filename)
-            name_root, ext = os.path.splitext(filename)
-            if ext.lower() not in ['.jpg', '.jpeg', '.png']:
-                filename = f"{name_root}.jpg"
-            image_path = os.path.join(save_dir, filename)
-
-            pil_img = Image.open(image_file).convert("RGB")
-            pil_img.save(image_path, format='JPEG')
-            img_np = np.array(pil_img, dtype=np.uint8)
-            print("DEBUG upload image:", img_np.shape, img_np.dtype)
-        else:
+        # === Lấy ảnh từ camera và/hoặc các file upload ===
+        photos = _enrollment_photos(request.files.getlist('image'), request.form.get('image_base64'))
+        if not photos:
             flash("Vui lòng tải ảnh hoặc chụp ảnh nhân viên!", "warning")
             return redirect(url_for('employee.list_employees'))
 
-        # === 2️⃣ Resize nếu quá lớn ===
-        max_width = 640
-        if img_np.shape[1] > max_width:
-            scale = max_width / img_np.shape[1]
-            new_size = (int(img_np.shape[1] * scale), int(img_np.shape[0] * scale))
-            img_np = cv2.resize(img_np, new_size, interpolation=cv2.INTER_AREA)
-            print("Ảnh đã resize:", img_np.shape)
-
-        # === 3️⃣ Đảm bảo dữ liệu ảnh đúng kiểu cho dlib 19.24 ===
-        if img_np.ndim == 2:  # grayscale
-            img_np = cv2.cvtColor(img_np, cv2.COLOR_GRAY2RGB)
-        elif img_np.shape[2] == 4:  # RGBA
-            img_np = cv2.cvtColor(img_np, cv2.COLOR_RGBA2RGB)
-        else:
-            img_np = cv2.cvtColor(img_np, cv2.COLOR_BGR2RGB)
-
-        # ép kiểu contiguous (bộ nhớ liền mạch, tránh lỗi “Unsupported image type”)
-        img_np = np.ascontiguousarray(img_np, dtype=np.uint8)
-
-        # === 4️⃣ Phát hiện khuôn mặt bằng face_recognition ===
-        face_locations = face_recognition.face_locations(img_np, model='hog')  # dùng HOG cho nhanh
-        print(f"DEBUG face_locations: {len(face_locations)} khuôn mặt được phát hiện")
-
-        if len(face_locations) == 0:
-            flash("Không phát hiện được khuôn mặt trong ảnh!", "danger")
+        # === Phát hiện + mã hóa khuôn mặt của từng ảnh trên pool nhận diện (HOG cho nhanh) ===
+        try:
+            encodings, skipped = _encode_enrollment_photos(photos)
+        except (RecognitionBusy, RecognitionTimeout):
+            flash("Hệ thống nhận diện đang bận, vui lòng thử lại sau giây lát!", "warning")
             return redirect(url_for('employee.list_employees'))
 
-        # === 5️⃣ Mã hóa khuôn mặt ===
-        encodings = face_recognition.face_encodings(img_np, face_locations)
         if not encodings:
-            flash("Không thể tạo mã nhận diện khuôn mặt!", "danger")
+            flash("Không phát hiện được khuôn mặt trong ảnh!", "danger")
             return redirect(url_for('employee.list_employees'))
 
-        # === 6️⃣ Lưu dữ liệu vào DB ===
-        rel_path = image_path.replace('\\', '/')
-        department_obj = None
-        if dept:
-            from models.department import Department
-            department_obj = Department.query.filter_by(name=dept).first()
-            if not department_obj:
-                department_obj = Department(name=dept)
-                db.session.add(department_obj)
-                db.session.commit()
+        # === Lưu ảnh gốc (không nén lại), nhân viên và các encoding trong một transaction ===
+        for img_bytes, filename in photos:
+            save_original(img_bytes, os.path.join(save_dir, filename))
+        now = datetime.now()
         new_emp = Employee(
-            employee_code=f"EMP{datetime.now().strftime('%Y%m%d%H%M%S')}",
+            employee_code=f"EMP{now.strftime('%Y%m%d%H%M%S')}",
             full_name=name,
             position=pos,
             base_salary=salary,
-            department_id=department_obj.id if department_obj else None,
-            created_at=datetime.now(),
-            updated_at=datetime.now(),
+            department_id=department_id_for(dept),
+            created_at=now,
+            updated_at=now,
             active='1'
         )
-
-        
         db.session.add(new_emp)
+        face_ids = _add_enrollment_encodings(new_emp, encodings)
+        emp_id = new_emp.id
         db.session.commit()
+        face_index.add_many(face_ids, [emp_id] * len(face_ids), encodings)
+        invalidate_employee_stats()
 
-        enc0 = np.array(encodings[0], dtype=np.float64)
-        face_enc = FaceEncoding(
-            employee_id=new_emp.id,
-            encoding=enc0.tobytes(),
-            created_at=datetime.now()
-        )
-        db.session.add(face_enc)
-        db.session.commit()
-
-        new_emp.image = rel_path
-        db.session.commit()
-
-        flash("✅ Thêm nhân viên và nhận diện khuôn mặt thành công!", "success")
+        if skipped:
+            flash(f"✅ Thêm nhân viên thành công ({len(encodings)} ảnh khuôn mặt, bỏ qua {skipped} ảnh không nhận diện được)", "warning")
+        else:
+            flash(f"✅ Thêm nhân viên và nhận diện khuôn mặt thành công ({len(encodings)} ảnh)!", "success")
         return redirect(url_for('employee.list_employees'))
 
     except Exception as e:
@@ -474,3 +566,42 @@ def add_employee():
         traceback.print_exc()
         flash(f"Lỗi nhận diện khuôn mặt: {e}", "danger")
         return redirect(url_for('employee.list_employees'))
+
+
+# === Nhập nhân viên hàng loạt (CSV hoặc ZIP kèm ảnh) ===
+@employee_bp.route('/import', methods=['POST'])
+@admin_required
+def import_employees_route():
+    """Nhập nhân viên từ file ZIP (CSV + ảnh), trả báo cáo từng dòng
+
+    Trả JSON gồm số dòng thành công/lỗi và danh sách dòng lỗi;
+    ``?format=csv`` trả báo cáo đầy đủ dạng file CSV.
+    """
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'error': 'Vui lòng chọn file CSV hoặc ZIP'}), 400
+    try:
+        rows, read_photo = read_import_file(upload.filename, upload.read())
+    except ImportFileError as e:
+        return jsonify({'error': str(e)}), 400
+    if len(rows) > IMPORT_WEB_MAX_ROWS:
+        return jsonify({'error': f'File có {len(rows)} dòng, tối đa {IMPORT_WEB_MAX_ROWS} dòng mỗi lần nhập từ web; '
+                                 f'file lớn hơn hãy dùng lệnh "flask import-employees"'}), 413
+    # Mã hóa trên pool nhận diện dùng chung (giới hạn số ảnh đang chờ) để kiosk vẫn chấm công được
+    report = import_employees(rows, read_photo, recognition=recognition_pool)
+    created = sum(1 for entry in report if entry['status'] == 'created')
+    if created:
+        invalidate_employee_stats()
+    if request.args.get('format') == 'csv':
+        return send_file(
+            io.BytesIO(report_to_csv(report).encode('utf-8')),
+            mimetype='text/csv',
+            as_attachment=True,
+            download_name=f"import_report_{datetime.now().strftime('%Y%m%d%H%M%S')}.csv"
+        )
+    return jsonify({
+        'total': len(report),
+        'created': created,
+        'failed': len(report) - created,
+        'errors': [entry for entry in report if entry['status'] != 'created']
+    })
@@ -1,106 +1,140 @@
 
-import pandas as pd
-from flask import send_file, Blueprint, render_template, request, redirect, url_for, flash
+from flask import send_file, Blueprint, render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context
 from models.employee import Employee
-from models.attendance import Attendance
+from models.recent_activity import RecentActivity
+from models.attendance_matrix import replace_month_attendance, DAY_STATUSES, MAX_IN_CLAUSE
+from models.payroll import compute_month_payroll, mark_payroll_stale
+from models.payroll_summary import rebuild_payroll_summary
+from models.payroll_export import iter_payroll_csv, write_payroll_xlsx, XLSX_MIMETYPE
+from models.dashboard_stats import invalidate_salary_stats, invalidate_attendance_stats
+from models.reporting import reporting_reads, reporting_view
 from config import db
+from sqlalchemy.orm import joinedload
 from datetime import datetime
 import calendar
+import time
 
 payroll_bp = Blueprint('payroll', __name__)
 
 @payroll_bp.route('/payroll/export', methods=['GET'])
+@reporting_view
 def export_payroll():
+    """Xuất bảng lương: ``?format=csv`` trả về dạng stream, mặc định là XLSX trong bộ nhớ"""
     month = int(request.args.get('month', datetime.now().month))
     year = int(request.args.get('year', datetime.now().year))
-    from models.payroll import count_standard_workdays
     num_days = calendar.monthrange(year, month)[1]
-    standard_workdays = count_standard_workdays(month, year)
-    employees = Employee.query.all()
-    data = []
-    for emp in employees:
-        days = [datetime(year, month, d+1) for d in range(num_days)]
-        day_status = []
-        total_salary = 0
-        daily_salary = emp.base_salary / standard_workdays if emp.base_salary and standard_workdays else 0
-        for day in days:
-            att_in = Attendance.query.filter(
-                Attendance.employee_id == emp.id,
-                Attendance.timestamp >= datetime(day.year, day.month, day.day, 0, 0, 0),
-                Attendance.timestamp <= datetime(day.year, day.month, day.day, 23, 59, 59),
-                Attendance.status == 'IN'
-            ).first()
-            att_out = Attendance.query.filter(
-                Attendance.employee_id == emp.id,
-                Attendance.timestamp >= datetime(day.year, day.month, day.day, 0, 0, 0),
-                Attendance.timestamp <= datetime(day.year, day.month, day.day, 23, 59, 59),
-                Attendance.status == 'OUT'
-            ).first()
-            if att_in and att_out:
-                day_status.append('✓')
-                is_sunday = day.weekday() == 6
-                if is_sunday:
-                    total_salary += daily_salary * 2
-                else:
-                    total_salary += daily_salary
-            else:
-                day_status.append('X')
-        row = {
-            'Tên nhân viên': emp.full_name,
-            'Phòng ban': emp.department.name if emp.department else '',
-            'Chức vụ': emp.position,
-            'Lương (VNĐ)': total_salary
-        }
-        for i, status in enumerate(day_status, 1):
-            row[f'Ngày {i}'] = status
-        data.append(row)
-    df = pd.DataFrame(data)
-    file_path = f'payroll_{month}_{year}.xlsx'
-    df.to_excel(file_path, index=False)
-    return send_file(file_path, as_attachment=True)
+    filename = f'payroll_{month}_{year}'
+    if request.args.get('format') == 'csv':
+        def generate():
+            # Stream chạy sau khi view trả về: mở lại khối đọc từ CSDL báo cáo trong generator
+            with reporting_reads():
+                yield from iter_payroll_csv(month, year, num_days)
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/csv; charset=utf-8',
+            headers={'Content-Disposition': f'attachment; filename={filename}.csv'}
+        )
+    return send_file(
+        write_payroll_xlsx(month, year, num_days),
+        mimetype=XLSX_MIMETYPE,
+        as_attachment=True,
+        download_name=f'{filename}.xlsx'
+    )
+
+def save_month_grid(month, year, grid):
+    """Ghi bảng công của một tháng cho nhiều nhân viên trong một transaction
+
+    Args:
+        month (int): Tháng
+        year (int): Năm
+        grid (dict): {employee_id: danh sách trạng thái từng ngày}
+
+    Returns:
+        int: Số bản ghi chấm công đã chèn
+    """
+    employee_ids = list(grid)
+    inserted = replace_month_attendance(month, year, grid)
+    mark_payroll_stale(month, year, employee_ids)
+    # Cả tháng của các nhân viên thay đổi: tính lại dòng tổng hợp trong cùng transaction
+    rebuild_payroll_summary(month, year, employee_ids)
+    # Lưu hoạt động gần đây
+    now = datetime.now()
+    db.session.execute(db.insert(RecentActivity), [
+        {'employee_id': emp_id, 'action': f'Cập nhật ngày công tháng {month}/{year}', 'timestamp': now}
+        for emp_id in employee_ids
+    ])
+    db.session.commit()
+    today = datetime.now()
+    if (today.month, today.year) == (month, year):
+        # Bảng công tháng này có thể đổi cả số người đi làm hôm nay
+        invalidate_attendance_stats(today)
+    else:
+        invalidate_salary_stats(month, year)
+    return inserted
 
 @payroll_bp.route('/payroll/update', methods=['POST'])
 def update_payroll():
-    employee_name = request.form.get('employee_name')
-    employee = Employee.query.filter_by(full_name=employee_name).first()
-    month = int(request.args.get('month', datetime.now().month))
-    year = int(request.args.get('year', datetime.now().year))
+    month = int(request.args.get('month', request.form.get('month', datetime.now().month)))
+    year = int(request.args.get('year', request.form.get('year', datetime.now().year)))
+    employee_id = request.form.get('employee_id', type=int)
+    if employee_id:
+        employee = Employee.query.get(employee_id)
+    else:
+        employee = Employee.query.filter_by(full_name=request.form.get('employee_name')).first()
     num_days = calendar.monthrange(year, month)[1]
     if not employee:
         flash('Không tìm thấy nhân viên.', 'danger')
-        return redirect(url_for('payroll.payroll'))
+        return redirect(url_for('payroll.payroll', month=month, year=year))
     try:
-        for d in range(1, num_days+1):
-            status = request.form.get(f'day_status_{d}')
-            day_date = datetime(year, month, d)
-            Attendance.query.filter(
-                Attendance.employee_id == employee.id,
-                Attendance.timestamp >= datetime(day_date.year, day_date.month, day_date.day, 0, 0, 0),
-                Attendance.timestamp <= datetime(day_date.year, day_date.month, day_date.day, 23, 59, 59)
-            ).delete()
-            if status == '✓':
-                att_in = Attendance(employee_id=employee.id, timestamp=datetime(year, month, d, 8, 0, 0), status='IN')
-                att_out = Attendance(employee_id=employee.id, timestamp=datetime(year, month, d, 17, 0, 0), status='OUT')
-                db.session.add(att_in)
-                db.session.add(att_out)
-        db.session.commit()
-        # Lưu hoạt động gần đây
-        try:
-            from models.recent_activity import RecentActivity
-            activity = RecentActivity(
-                employee_id=employee.id,
-                action=f'Cập nhật ngày công tháng {month}/{year}',
-                timestamp=datetime.now()
-            )
-            db.session.add(activity)
-            db.session.commit()
-        except Exception:
-            pass
+        days = [request.form.get(f'day_status_{d}') for d in range(1, num_days + 1)]
+        save_month_grid(month, year, {employee.id: days})
         flash('Cập nhật ngày đi làm thành công!', 'success')
     except Exception as e:
         db.session.rollback()
         flash('Lỗi khi cập nhật ngày đi làm: ' + str(e), 'danger')
-    return redirect(url_for('payroll.payroll'))
+    return redirect(url_for('payroll.payroll', month=month, year=year))
+
+@payroll_bp.route('/payroll/update-bulk', methods=['POST'])
+def update_payroll_bulk():
+    """Cập nhật bảng công nhiều nhân viên một lần
+
+    Body JSON: ``{"month": 10, "year": 2025, "employees": {"<id>": ["✓", "X", ...]}}``
+    (mỗi danh sách có đúng số ngày của tháng).
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        month = int(data.get('month', datetime.now().month))
+        year = int(data.get('year', datetime.now().year))
+        num_days = calendar.monthrange(year, month)[1]
+        grid = {int(emp_id): list(days) for emp_id, days in (data.get('employees') or {}).items()}
+    except (TypeError, ValueError, calendar.IllegalMonthError):
+        return jsonify({'error': 'Dữ liệu bảng công không hợp lệ'}), 400
+    if not grid:
+        return jsonify({'error': 'Không có nhân viên nào cần cập nhật'}), 400
+    for emp_id, days in grid.items():
+        if len(days) != num_days or any(status not in DAY_STATUSES for status in days):
+            return jsonify({'error': f'Bảng công của nhân viên {emp_id} không hợp lệ'}), 400
+    known = set()
+    employee_ids = list(grid)
+    for i in range(0, len(employee_ids), MAX_IN_CLAUSE):
+        known.update(emp_id for emp_id, in db.session.query(Employee.id).filter(
+            Employee.id.in_(employee_ids[i:i + MAX_IN_CLAUSE])
+        ).all())
+    unknown = sorted(set(employee_ids) - known)
+    if unknown:
+        return jsonify({'error': 'Không tìm thấy nhân viên', 'employee_ids': unknown}), 404
+    started = time.perf_counter()
+    try:
+        inserted = save_month_grid(month, year, grid)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Lỗi khi cập nhật ngày đi làm: ' + str(e)}), 500
+    return jsonify({
+        'updated': len(grid),
+        'inserted': inserted,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)
+    })
+
 from models.employee import Employee
 from models.attendance import Attendance
 from datetime import datetime
@@ -108,49 +142,26 @@ import calendar
 
 
 @payroll_bp.route('/payroll', methods=['GET'])
+@reporting_view
 def payroll():
     # Lấy tháng/năm từ query, mặc định là tháng/năm hiện tại
     month = int(request.args.get('month', datetime.now().month))
     year = int(request.args.get('year', datetime.now().year))
     num_days = calendar.monthrange(year, month)[1]
-    employees = Employee.query.all()
+    # Lấy chấm công cả tháng bằng một truy vấn và tính lương vector hóa (phòng ban JOIN cùng truy vấn nhân viên)
+    employees, matrix, result = compute_month_payroll(
+        month, year, Employee.query.options(joinedload(Employee.department)).all()
+    )
+    presence = matrix.presence
     payroll_data = []
-    for emp in employees:
-        days = [datetime(year, month, d+1) for d in range(num_days)]
-        day_status = []
-        workdays_normal = 0
-        workdays_sunday = 0
-        for day in days:
-            att_in = Attendance.query.filter(
-                Attendance.employee_id == emp.id,
-                Attendance.timestamp >= datetime(day.year, day.month, day.day, 0, 0, 0),
-                Attendance.timestamp <= datetime(day.year, day.month, day.day, 23, 59, 59),
-                Attendance.status == 'IN'
-            ).first()
-            att_out = Attendance.query.filter(
-                Attendance.employee_id == emp.id,
-                Attendance.timestamp >= datetime(day.year, day.month, day.day, 0, 0, 0),
-                Attendance.timestamp <= datetime(day.year, day.month, day.day, 23, 59, 59),
-                Attendance.status == 'OUT'
-            ).first()
-            if att_in and att_out:
-                day_status.append('✓')
-                if day.weekday() == 6:
-                    workdays_sunday += 1
-                else:
-                    workdays_normal += 1
-            else:
-                day_status.append('X')
-        # Số ngày công chuẩn (không tính chủ nhật)
-        standard_workdays = sum(1 for d in days if d.weekday() != 6)
-        salary_per_day = emp.base_salary / standard_workdays if emp.base_salary and standard_workdays > 0 else 0
-        total_salary = salary_per_day * workdays_normal + salary_per_day * 2 * workdays_sunday
+    for i, emp in enumerate(employees):
         payroll_data.append({
+            'id': emp.id,
             'name': emp.full_name,
             'department': emp.department.name if emp.department else '',
             'position': emp.position,
-            'days': day_status,
-            'total_salary': total_salary
+            'days': ['✓' if present else 'X' for present in presence[i].tolist()],
+            'total_salary': float(result['net'][i])
         })
     # Tạo danh sách các ngày chủ nhật trong tháng
     sundays = []
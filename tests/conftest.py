@@ -0,0 +1,56 @@
+import os
+import sys
+import pytest
+from flask import Flask
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import db  # noqa: E402
+from models.department import Department  # noqa: E402,F401
+from models.employee import Employee  # noqa: E402,F401
+from models.attendance import Attendance  # noqa: E402,F401
+from models.payroll import Payroll  # noqa: E402,F401
+from models.payroll_summary import PayrollSummary  # noqa: E402,F401
+from models.face_encoding import FaceEncoding  # noqa: E402,F401
+from models.recent_activity import RecentActivity  # noqa: E402,F401
+
+
+def _sqlite_connect(dbapi_connection, connection_record):
+    # pysqlite tự commit khi gặp SAVEPOINT/DDL: để SQLAlchemy tự phát BEGIN như trên Oracle
+    dbapi_connection.isolation_level = None
+    # WAL: transaction đang đọc không chặn transaction khác ghi (giống Oracle)
+    dbapi_connection.execute('PRAGMA journal_mode=WAL')
+
+
+def _sqlite_begin(conn):
+    conn.exec_driver_sql('BEGIN')
+
+
+@pytest.fixture
+def app(tmp_path):
+    """Ứng dụng Flask tối thiểu trên một file SQLite riêng cho mỗi test"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path / "hrms.db"}'
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 30, 'check_same_thread': False}}
+    db.init_app(app)
+    with app.app_context():
+        event.listen(db.engine, 'connect', _sqlite_connect)
+        event.listen(db.engine, 'begin', _sqlite_begin)
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def statements(app):
+    """Danh sách các câu SQL đã chạy trên CSDL chính"""
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    yield executed
+    event.remove(db.engine, 'before_cursor_execute', record)
@@ -0,0 +1,95 @@
+import threading
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from config import db
+from models.attendance import Attendance
+from models.checkin import CHECK_IN, CHECK_OUT, REJECTED, record_check
+from models.employee import Employee
+
+SCAN_TIME = datetime(2026, 3, 10, 8, 0)
+
+
+def _employee():
+    emp = Employee(employee_code='NV001', full_name='Nguyễn Văn A', base_salary=10000000)
+    db.session.add(emp)
+    db.session.commit()
+    # Dạng Row như luồng đồng bộ edge: dùng được ở luồng khác, không gắn với session
+    return db.session.query(
+        Employee.id, Employee.full_name, Employee.base_salary, Employee.salary_type
+    ).filter(Employee.id == emp.id).one()
+
+
+def _scan(app, employee, now):
+    with app.app_context():
+        try:
+            result, _ = record_check(employee, now=now)
+            db.session.commit()
+            return result
+        finally:
+            db.session.remove()
+
+
+def _scan_concurrently(app, employee, times):
+    """Chạy các lần chấm công cùng lúc ở các luồng riêng (mỗi luồng một session/kết nối)"""
+    barrier = threading.Barrier(len(times))
+    results = [None] * len(times)
+    errors = []
+
+    def worker(index, now):
+        try:
+            barrier.wait()
+            results[index] = _scan(app, employee, now)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i, now)) for i, now in enumerate(times)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    return results
+
+
+def _statuses(employee_id):
+    # Kết thúc transaction đang đọc để thấy dữ liệu các luồng khác đã commit
+    db.session.rollback()
+    return sorted(status for status, in db.session.query(Attendance.status).filter_by(employee_id=employee_id))
+
+
+def test_concurrent_double_scan_records_one_check_in(app):
+    employee = _employee()
+
+    results = _scan_concurrently(app, employee, [SCAN_TIME, SCAN_TIME])
+
+    assert sorted(results) == [CHECK_IN, CHECK_OUT]
+    assert _statuses(employee.id) == ['IN', 'OUT']
+
+
+def test_check_in_then_check_out(app):
+    employee = _employee()
+
+    assert _scan(app, employee, SCAN_TIME) == CHECK_IN
+    assert _scan(app, employee, SCAN_TIME + timedelta(hours=9)) == CHECK_OUT
+    assert _statuses(employee.id) == ['IN', 'OUT']
+
+
+def test_third_scan_is_rejected(app):
+    employee = _employee()
+
+    results = _scan_concurrently(app, employee, [SCAN_TIME + timedelta(minutes=i) for i in range(3)])
+
+    assert sorted(results, key=str) == sorted([CHECK_IN, CHECK_OUT, REJECTED], key=str)
+    assert _statuses(employee.id) == ['IN', 'OUT']
+    assert _scan(app, employee, SCAN_TIME + timedelta(hours=10)) is REJECTED
+
+
+def test_day_slot_is_required(app):
+    employee = _employee()
+    db.session.add(Attendance(employee_id=employee.id, status='IN'))
+
+    # Thiếu work_date/seq thì UQ_ATTENDANCE_EMP_DAY_SEQ không chặn được bản ghi trùng
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
@@ -0,0 +1,42 @@
+from datetime import datetime
+from config import db
+from models.attendance import Attendance
+from models.employee import Employee
+from models.payroll import calculate_employee_salary
+from models.payroll_summary import PayrollSummary, ensure_payroll_summary
+
+
+def _employee_with_month(days=(6, 7, 8)):
+    employee = Employee(employee_code='E1', full_name='Nguyễn Văn A', base_salary=2600000, salary_type='monthly')
+    db.session.add(employee)
+    db.session.flush()
+    for day in days:
+        db.session.add(Attendance(employee_id=employee.id, timestamp=datetime(2025, 1, day, 7, 55), status='IN'))
+        db.session.add(Attendance(employee_id=employee.id, timestamp=datetime(2025, 1, day, 17, 5), status='OUT'))
+    db.session.commit()
+    return employee.id
+
+
+def _attendance_queries(statements):
+    return [sql for sql in statements if 'ATTENDANCE' in sql]
+
+
+def test_backfill_survives_read_rollback(app, statements):
+    employee_id = _employee_with_month()
+    first = ensure_payroll_summary(1, 2025, [employee_id])
+    # Trang báo cáo kết thúc request bằng rollback
+    db.session.rollback()
+    assert first[employee_id]['workdays'] == 3
+    assert PayrollSummary.query.filter_by(employee_id=employee_id, month_year='2025-01').count() == 1
+
+
+def test_second_read_does_not_scan_attendance(app, statements):
+    employee_id = _employee_with_month()
+    first = calculate_employee_salary(employee_id, 1, 2025)
+    db.session.rollback()
+    assert _attendance_queries(statements)
+
+    statements.clear()
+    second = calculate_employee_salary(employee_id, 1, 2025)
+    assert second == first
+    assert _attendance_queries(statements) == []